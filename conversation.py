@@ -2,6 +2,7 @@ import os
 import openai
 import json
 from programmer import Programmer
+from knw_in import configure_retrieval, warm_up_retrieval
 from inspector import Inspector
 from cache.cache import *
 from prompt_engineering.prompts import *
@@ -28,6 +29,11 @@ class Conversation:
         self.session_cache_path = config["session_cache_path"]
         self.chat_history_display = config["chat_history_display"] if "chat_history_display" in config else []
         self.retrieval = self.config['retrieval']
+        if self.retrieval:
+            configure_retrieval(config.get('retrieval_backend'), config.get('retrieval_top_k'),
+                                config.get('retrieval_token_budget'), config.get('retrieval_cache'))
+            # load the retrieval model in the background, the first retrieval waits for it if needed
+            warm_up_retrieval()
         self.kernel = CodeKernel(session_cache_path=self.session_cache_path, max_exe_time=config['max_exe_time'])
         self.max_attempts = config['max_attempts']
         self.error_count = 0
@@ -104,6 +110,35 @@ class Conversation:
         message = {"role": role, "content": CODE_INSPECT.format(bug_code=bug_code, error_message=error_msg)}
         self.inspector.messages.append(message)
 
+    def semantic_check(self, error_msg, code=''):
+        """
+        以獨立的訊息送出一次 SEMANTIC_CHECK_REQUEST 並回傳 Inspector 的回應（失敗時為 None）
+
+        供 headless 批次模式使用：不經過 Programmer 與 kernel，也不會改動 self.inspector.messages，
+        每個資料集的判斷不受先前資料集影響。
+        """
+        messages = self.inspector.messages
+        self.inspector.messages = [{"role": "user", "content": CODE_INSPECT.format(bug_code=code, error_message=error_msg)}]
+        try:
+            inspector_result = self.inspector._call_chat_model()
+        finally:
+            self.inspector.messages = messages
+        return inspector_result.choices[0].message.content if inspector_result else None
+
+    def record_semantic_check(self, error_msg, response):
+        """
+        將 Inspector 的語意檢查結果寫入 catalog（訊息中附上的輸出目錄，即 trigger_inspector_check 查詢的 catalog），
+        同一 revision 的欄位之後不需再檢查
+        """
+        try:
+            from hf_pipeline.screening import record_semantic_check
+
+            verdicts = record_semantic_check(error_msg, response)
+            if verdicts:
+                print(f"✓ 已記錄 {len(verdicts)} 個欄位的判斷結果至 catalog")
+        except Exception as e:
+            print(f"⚠️  無法記錄判斷結果至 catalog: {e}")
+
     def run_code(self, code):
         try:
             sign, msg_llm, exe_res = execute(code, self.kernel)
@@ -232,6 +267,8 @@ class Conversation:
                             if inspector_result:
                                 insp_response = inspector_result.choices[0].message.content
                                 print(f"✓ Inspector 回應:\n{insp_response[:200]}..." if len(insp_response) > 200 else f"✓ Inspector 回應:\n{insp_response}")
+                                if "SEMANTIC_CHECK_REQUEST" in msg_llm:
+                                    self.record_semantic_check(msg_llm, insp_response)
                             else:
                                 insp_response = "Inspector API 呼叫失敗，請檢查網路或 API 設定"
                                 print("❌ Inspector 無法提供回應")
@@ -0,0 +1,201 @@
+"""
+輸出目錄的資料目錄（catalog）
+
+./output 下的 _catalog.sqlite 保存跨 session 的分析結果與輸出位置：
+- verdicts：以資料集、revision（commit sha）、subset、split、欄位為 key，記錄 Inspector 的判斷、理由、
+  統計（初篩預評分或 profile 摘要）與輸出路徑；分析前先查詢，已判斷過的欄位不需再送 Inspector
+- locations：位置（相對於輸出根目錄的匯出目錄、合併後的目錄或單一 parquet 檔）與資料來源（source）的對應，
+  以及該來源在此位置的筆數、token 數與檔案數（見 hf_pipeline.compaction）
+- selections：資料集在 revision 下實際選用的 subset 與 split（指定的 split 不存在時改用第一個可用的 split），
+  批次初篩沿用判斷結果時以此找出與探測相同的 subset（見 hf_pipeline.screening）
+使用標準函式庫的 sqlite3，每次操作各自連線並以 transaction 寫入，可在多個執行緒或行程中同時使用。
+"""
+import json
+import os
+import sqlite3
+import time
+
+from hf_pipeline.ids import parse_source_key
+
+
+CATALOG_NAME = '_catalog.sqlite'
+DEFAULT_OUTPUT_ROOT = './output'
+
+LOCATION_COLUMNS = ['location', 'source', 'dataset_name', 'config_name', 'split', 'revision', 'field_name',
+                    'flatten_mode', 'num_rows', 'num_tokens', 'num_files', 'updated_at']
+KEY_COLUMNS = ['dataset_name', 'revision', 'config_name', 'split']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS locations (
+    location TEXT NOT NULL,
+    source TEXT NOT NULL,
+    dataset_name TEXT,
+    config_name TEXT,
+    split TEXT,
+    revision TEXT,
+    field_name TEXT,
+    flatten_mode TEXT,
+    num_rows INTEGER NOT NULL,
+    num_tokens INTEGER,
+    num_files INTEGER NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (location, source)
+);
+CREATE TABLE IF NOT EXISTS verdicts (
+    dataset_name TEXT NOT NULL,
+    revision TEXT NOT NULL,
+    config_name TEXT NOT NULL,
+    split TEXT NOT NULL,
+    field_name TEXT NOT NULL,
+    verdict TEXT,
+    reason TEXT,
+    stats TEXT,
+    output_path TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (dataset_name, revision, config_name, split, field_name)
+);
+CREATE TABLE IF NOT EXISTS selections (
+    dataset_name TEXT NOT NULL,
+    revision TEXT NOT NULL,
+    requested_split TEXT NOT NULL,
+    config_name TEXT NOT NULL,
+    split TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (dataset_name, revision, requested_split)
+);
+"""
+
+
+def catalog_key(dataset_name, revision=None, config_name=None, split="train"):
+    """verdicts 的 key；revision 為 None 時記為 main，沒有 subset 時 config_name 記為空字串"""
+    return {'dataset_name': dataset_name, 'revision': revision or 'main', 'config_name': config_name or '',
+            'split': split}
+
+
+def _verdict_entry(row):
+    entry = dict(row)
+    entry['config_name'] = entry['config_name'] or None
+    entry['stats'] = json.loads(entry['stats']) if entry['stats'] else {}
+    return entry
+
+
+class Catalog:
+    """
+    輸出根目錄的 catalog
+
+    - output_root: 輸出根目錄（如 ./output），catalog 存放於 {output_root}/_catalog.sqlite
+    """
+
+    def __init__(self, output_root=DEFAULT_OUTPUT_ROOT):
+        os.makedirs(output_root, exist_ok=True)
+        self.output_root = output_root
+        self.path = os.path.join(output_root, CATALOG_NAME)
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _execute(self, query, args=()):
+        conn = self._connect()
+        try:
+            return conn.execute(query, args).fetchall()
+        finally:
+            conn.close()
+
+    def replace_location(self, location, sources, num_files):
+        """
+        以新的內容取代 location 的所有紀錄
+
+        - location: 相對於 output_root 的路徑
+        - sources: {source: {'num_rows': 筆數, 'num_tokens': token 數或 None}}
+        - num_files: location 中的資料檔數
+        """
+        updated_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        rows = []
+        for source, counts in sources.items():
+            parsed = parse_source_key(source) or {}
+            rows.append((location, source, parsed.get('dataset_name'), parsed.get('config_name'), parsed.get('split'),
+                         parsed.get('revision'), parsed.get('field_name'), parsed.get('flatten_mode'),
+                         counts['num_rows'], counts.get('num_tokens'), num_files, updated_at))
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM locations WHERE location = ?", (location,))
+                conn.executemany(f"INSERT INTO locations VALUES ({', '.join('?' * len(LOCATION_COLUMNS))})", rows)
+        finally:
+            conn.close()
+
+    def locations(self, source=None, location=None):
+        """查詢位置紀錄，可依 source 或 location 篩選，回傳 dict 的 list"""
+        query, args = "SELECT * FROM locations", []
+        conditions = [(column, value) for column, value in (('source', source), ('location', location))
+                      if value is not None]
+        if conditions:
+            query += " WHERE " + " AND ".join(f"{column} = ?" for column, _ in conditions)
+            args = [value for _, value in conditions]
+        return [dict(row) for row in self._execute(query + " ORDER BY location, source", args)]
+
+    def record_field(self, key, field_name, verdict=None, reason=None, stats=None, output_path=None):
+        """
+        新增或更新單一欄位的紀錄，只更新有指定（不為 None）的項目；stats 會與既有的統計合併
+
+        key 為 catalog_key 的結果
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                args = [key[column] for column in KEY_COLUMNS] + [field_name]
+                where = " AND ".join(f"{column} = ?" for column in KEY_COLUMNS + ['field_name'])
+                row = conn.execute(f"SELECT * FROM verdicts WHERE {where}", args).fetchone()
+                entry = _verdict_entry(row) if row else {'verdict': None, 'reason': None, 'stats': {},
+                                                         'output_path': None}
+                if verdict is not None:
+                    entry['verdict'], entry['reason'] = verdict, reason
+                if stats:
+                    entry['stats'].update(stats)
+                if output_path is not None:
+                    entry['output_path'] = output_path
+                conn.execute("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             args + [entry['verdict'], entry['reason'],
+                                     json.dumps(entry['stats'], ensure_ascii=False) if entry['stats'] else None,
+                                     entry['output_path'], time.strftime('%Y-%m-%dT%H:%M:%S')])
+        finally:
+            conn.close()
+
+    def fields(self, key):
+        """回傳 key 下所有欄位的紀錄 {欄位: dict}"""
+        where = " AND ".join(f"{column} = ?" for column in KEY_COLUMNS)
+        rows = self._execute(f"SELECT * FROM verdicts WHERE {where} ORDER BY field_name",
+                             [key[column] for column in KEY_COLUMNS])
+        return {row['field_name']: _verdict_entry(row) for row in rows}
+
+    def dataset_fields(self, dataset_name, revision=None):
+        """回傳資料集在 revision 下所有 subset、split 與欄位的紀錄（dict 的 list）"""
+        rows = self._execute("SELECT * FROM verdicts WHERE dataset_name = ? AND revision = ? "
+                             "ORDER BY config_name, split, field_name", (dataset_name, revision or 'main'))
+        return [_verdict_entry(row) for row in rows]
+
+    def record_selection(self, key, requested_split):
+        """記錄指定 requested_split 時探測選用的 subset 與 split，key 為選用結果的 catalog_key"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO selections VALUES (?, ?, ?, ?, ?, ?)",
+                             (key['dataset_name'], key['revision'], requested_split, key['config_name'], key['split'],
+                              time.strftime('%Y-%m-%dT%H:%M:%S')))
+        finally:
+            conn.close()
+
+    def selection(self, dataset_name, revision=None, requested_split="train"):
+        """回傳 record_selection 記錄的 catalog_key，沒有紀錄時回傳 None"""
+        rows = self._execute("SELECT * FROM selections WHERE dataset_name = ? AND revision = ? AND requested_split = ?",
+                             (dataset_name, revision or 'main', requested_split))
+        if not rows:
+            return None
+        return {column: rows[0][column] for column in KEY_COLUMNS}
@@ -0,0 +1,162 @@
+"""
+可續傳匯出的檢查點
+
+匯出目錄中的 _export_state.json 記錄已提交（已關閉並改名）的分片，
+以及下一個尚未提交的輸出列對應到的來源位置。
+中斷後重新執行時只需從該位置繼續讀取，已完成的分片不會重寫。
+"""
+import os
+import copy
+import json
+
+from hf_pipeline.dedup import SEGMENT_PREFIX
+from hf_pipeline.shards import write_json_atomic
+
+
+STATE_NAME = '_export_state.json'
+# 這些參數不同表示是另一個資料來源的匯出
+SOURCE_PARAMS = ['dataset_name', 'config_name', 'split', 'field_name', 'flatten_mode']
+# 這些參數相同的匯出彼此不去重（同一欄位的重新匯出）
+DEDUP_SOURCE_PARAMS = ['dataset_name', 'config_name', 'split', 'field_name']
+
+
+def check_source(output_dir, params):
+    """
+    output_dir 中已有另一個資料來源（資料集、subset、split、欄位或攤平方式不同）的匯出時 raise ValueError，
+    不會為了重新匯出而刪除其他來源的結果；同一來源只有其他參數不同時仍會重新匯出
+    """
+    path = os.path.join(output_dir, STATE_NAME)
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        previous = json.load(f).get('params', {})
+    different = [key for key in SOURCE_PARAMS if previous.get(key) != params[key]]
+    if different:
+        raise ValueError(f"{output_dir} already holds an export of another source (different {different}), "
+                         f"please choose another output directory or remove it first.")
+
+
+def same_source_exports(index_root, params, output_dir=None):
+    """
+    index_root 下與 params 為同一來源（資料集、subset、split、欄位相同）的其他匯出目錄名稱，不含 output_dir
+
+    重新匯出同一欄位（例如改用另一種攤平方式或輸出目錄）時不應與這些舊結果去重，否則幾乎每一筆都會被視為重複
+    """
+    names = set()
+    if not os.path.isdir(index_root):
+        return names
+    current = os.path.abspath(output_dir) if output_dir is not None else None
+    for name in os.listdir(index_root):
+        path = os.path.join(index_root, name)
+        state_path = os.path.join(path, STATE_NAME)
+        if os.path.abspath(path) == current or not os.path.exists(state_path):
+            continue
+        with open(state_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f).get('params', {})
+        if all(previous.get(key) == params.get(key) for key in DEDUP_SOURCE_PARAMS):
+            names.add(name)
+    return names
+
+
+class ExportCheckpoint:
+    """
+    匯出狀態
+
+    - params: 匯出參數，參數不同時不可續傳
+    - shards: 已提交的分片資訊
+    - committed_rows: 已提交的總筆數
+    - source_offset: 續傳時從來源的第幾筆開始讀取
+    - skip_output_rows: 從 source_offset 開始讀取後，需要捨棄的輸出筆數（已寫入已提交分片）
+    - dedup_segments: 已提交的去重簽章片段檔名
+    - filter_stats: 讀取到 source_offset 為止的過濾統計（見 hf_pipeline.filters.FilterPipeline）
+    - completed: 是否已完成整個匯出
+    """
+
+    def __init__(self, output_dir, params):
+        self.path = os.path.join(output_dir, STATE_NAME)
+        self.params = params
+        self.shards = []
+        self.dedup_segments = []
+        self.committed_rows = 0
+        self.source_offset = 0
+        self.skip_output_rows = 0
+        self.filter_stats = None
+        self.completed = False
+
+    @classmethod
+    def load(cls, output_dir, params):
+        """讀取既有狀態；狀態不存在、參數不同或分片檔案不完整時回傳 None"""
+        path = os.path.join(output_dir, STATE_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('params') != params:
+            print(f"⚠ 匯出參數與 {path} 不同，將重新匯出")
+            return None
+        for shard in state['shards']:
+            shard_path = os.path.join(output_dir, shard['file'])
+            if not os.path.exists(shard_path) or os.path.getsize(shard_path) != shard['num_bytes']:
+                print(f"⚠ 已提交的分片 {shard['file']} 遺失或大小不符，將重新匯出")
+                return None
+        for filename in state.get('dedup_segments', []):
+            if not os.path.exists(os.path.join(output_dir, filename)):
+                print(f"⚠ 已提交的去重索引 {filename} 遺失，將重新匯出")
+                return None
+
+        checkpoint = cls(output_dir, params)
+        checkpoint.shards = state['shards']
+        checkpoint.dedup_segments = state.get('dedup_segments', [])
+        checkpoint.committed_rows = state['committed_rows']
+        checkpoint.source_offset = state['source_offset']
+        checkpoint.skip_output_rows = state['skip_output_rows']
+        checkpoint.filter_stats = state.get('filter_stats')
+        checkpoint.completed = state['completed']
+        return checkpoint
+
+    def save(self):
+        write_json_atomic(self.path, {
+            'params': self.params,
+            'shards': self.shards,
+            'dedup_segments': self.dedup_segments,
+            'committed_rows': self.committed_rows,
+            'source_offset': self.source_offset,
+            'skip_output_rows': self.skip_output_rows,
+            'filter_stats': self.filter_stats,
+            'completed': self.completed,
+        })
+
+    def remove_uncommitted(self):
+        """刪除未提交的分片、去重索引與暫存檔，讓目錄回到最後一次提交時的狀態"""
+        output_dir = os.path.dirname(self.path)
+        committed = {shard['file'] for shard in self.shards} | set(self.dedup_segments)
+        for filename in os.listdir(output_dir):
+            if filename.startswith(('part-', SEGMENT_PREFIX)) and filename not in committed:
+                os.remove(os.path.join(output_dir, filename))
+
+
+class SourceTracker:
+    """
+    記錄每批來源資料與輸出列的對應關係
+
+    過濾後每批輸出筆數不固定，分片也可能在一批資料中間切換，
+    因此需要記錄每批的 (來源起點, 輸出起點)，才能將已提交的輸出筆數換算回來源位置。
+    每批起點也記錄當時的過濾統計，續傳時從該批重新讀取，統計才不會重複計算。
+    """
+
+    def __init__(self, source_offset=0, output_offset=0, stats=None):
+        self._batches = [(source_offset, output_offset, copy.deepcopy(stats))]
+
+    def add_batch(self, source_end, output_end, stats=None):
+        """一批資料處理完後呼叫，記錄下一批的起點"""
+        self._batches.append((source_end, output_end, copy.deepcopy(stats)))
+
+    def resume_point(self, committed_rows):
+        """回傳 (source_offset, skip_output_rows, stats)，並捨棄已不需要的紀錄"""
+        index = 0
+        for i, (_, output_start, _) in enumerate(self._batches):
+            if output_start <= committed_rows:
+                index = i
+        self._batches = self._batches[index:]
+        source_start, output_start, stats = self._batches[0]
+        return source_start, committed_rows - output_start, stats
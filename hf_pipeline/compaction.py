@@ -0,0 +1,252 @@
+"""
+合併 ./output 中的小檔案
+
+每個資料集、欄位各自匯出一個目錄（或舊版的單一 *_cp_data.parquet），時間一久 ./output 會有大量小檔案，
+訓練端列出與開啟檔案的成本隨之增加。compact_output 以串流方式逐批讀取所有匯出結果，
+重新寫成大小平均的分片（預設 {output_root}/compacted/）：
+- 保留每筆資料的 id、source、source_row、source_part（沒有來源欄位的舊檔案以檔名作為 source 並重新計算 id）
+- 所有輸入都有 num_tokens 時一併保留
+- 可選擇全域去重（dedup），只在本次合併的輸入之間比對；簽章不會保存，
+  否則之後重新匯出已合併過的來源時，會把自己的資料當成重複而全部捨棄
+- 以指定的 encoding 重新編碼（見 hf_pipeline.encoding）
+- 完成後更新 catalog（見 hf_pipeline.catalog），記錄每個來源位於哪些位置
+
+輸入不會被刪除；新的分片先寫入暫存目錄，全部完成後才取代舊的合併結果。
+"""
+import math
+import os
+import shutil
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from hf_pipeline.catalog import Catalog
+from hf_pipeline.dedup import DEFAULT_NUM_PROC, Deduplicator, resolve_dedup
+from hf_pipeline.encoding import resolve_encoding, writer_options
+from hf_pipeline.export import DEFAULT_BATCH_SIZE, output_schema
+from hf_pipeline.ids import stable_ids
+from hf_pipeline.shards import (
+    DEFAULT_MAX_BYTES_PER_SHARD,
+    DEFAULT_ROW_GROUP_SIZE,
+    MANIFEST_NAME,
+    ShardedParquetWriter,
+    read_manifest,
+    write_json_atomic,
+)
+from hf_pipeline.tokens import TOKEN_COLUMN
+
+
+COMPACTED_DIR = 'compacted'
+LEGACY_SUFFIX = '_cp_data.parquet'
+
+
+def find_inputs(output_root, exclude=()):
+    """
+    找出 output_root 下已完成的匯出結果，回傳 [(相對路徑, [parquet 檔路徑])]
+
+    匯出目錄需有 _manifest.json（中斷或進行中的匯出不會有），檔案依 manifest 的分片順序排列；
+    舊版的單一檔案為 output_root 下的 *_cp_data.parquet。exclude 中的相對路徑會略過。
+    """
+    inputs = []
+    for name in sorted(os.listdir(output_root)):
+        if name in exclude:
+            continue
+        path = os.path.join(output_root, name)
+        if os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST_NAME)):
+            files = [os.path.join(path, shard['file']) for shard in read_manifest(path)['shards']]
+            inputs.append((name, files))
+        elif os.path.isfile(path) and name.endswith(LEGACY_SUFFIX):
+            inputs.append((name, [path]))
+    return inputs
+
+
+def _even_rows_per_shard(total_rows, total_bytes, max_bytes_per_shard, max_rows_per_shard):
+    """依輸入大小決定分片數，讓每個分片的筆數平均，而不是最後剩下一個很小的分片"""
+    if not total_rows:
+        return max_rows_per_shard
+    num_shards = 1
+    if max_bytes_per_shard is not None:
+        num_shards = max(num_shards, math.ceil(total_bytes / max_bytes_per_shard))
+    if max_rows_per_shard is not None:
+        num_shards = max(num_shards, math.ceil(total_rows / max_rows_per_shard))
+    return math.ceil(total_rows / num_shards)
+
+
+def _read_records(path, location, schema, batch_size):
+    """逐批讀取一個輸入檔並轉為輸出 schema；沒有來源欄位時以 location 作為 source，列編號為檔案中的位置"""
+    parquet_file = pq.ParquetFile(path)
+    names = parquet_file.schema_arrow.names
+    has_source = all(name in names for name in ('source', 'source_row', 'source_part'))
+    columns = [name for name in schema.names if name in names]
+    row_offset = 0
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        table = pa.Table.from_batches([batch])
+        if not has_source:
+            source = f"file:{location}"
+            rows = pa.array(np.arange(row_offset, row_offset + table.num_rows, dtype=np.int64))
+            parts = pa.array(np.zeros(table.num_rows, dtype=np.int32))
+            table = pa.table({
+                'id': pa.array(stable_ids(source, rows, parts)),
+                'text': table.column('text'),
+                'source': pa.array([source] * table.num_rows, pa.string()),
+                'source_row': rows,
+                'source_part': parts,
+                **({TOKEN_COLUMN: table.column(TOKEN_COLUMN)} if TOKEN_COLUMN in schema.names else {}),
+            })
+        row_offset += batch.num_rows
+        yield table.select(schema.names).cast(schema)
+
+
+def _count_sources(counts, table):
+    """累計每個 source 的筆數與 token 數"""
+    sources = table.column('source').combine_chunks().dictionary_encode()
+    indices = sources.indices.to_numpy(zero_copy_only=False)
+    rows = np.bincount(indices, minlength=len(sources.dictionary))
+    tokens = None
+    if TOKEN_COLUMN in table.column_names:
+        tokens = np.bincount(indices, weights=table.column(TOKEN_COLUMN).to_numpy(zero_copy_only=False),
+                             minlength=len(sources.dictionary))
+    for i, source in enumerate(sources.dictionary.to_pylist()):
+        entry = counts.setdefault(source, {'num_rows': 0, 'num_tokens': 0 if tokens is not None else None})
+        entry['num_rows'] += int(rows[i])
+        if tokens is not None:
+            entry['num_tokens'] += int(tokens[i])
+
+
+def compact_output(output_root="./output", target=None, inputs=None, max_bytes_per_shard=DEFAULT_MAX_BYTES_PER_SHARD,
+                   max_rows_per_shard=None, row_group_size=DEFAULT_ROW_GROUP_SIZE, encoding=None, dedup=False,
+                   batch_size=DEFAULT_BATCH_SIZE, num_proc=DEFAULT_NUM_PROC):
+    """
+    將 output_root 下的匯出結果合併為大小平均的分片
+
+    參數：
+    - output_root: 輸出根目錄
+    - target: 合併結果的目錄，None 表示 {output_root}/compacted
+    - inputs: 要合併的匯出目錄或檔案（相對於 output_root），None 表示全部已完成的匯出
+    - max_bytes_per_shard / max_rows_per_shard: 分片大小上限，分片數依輸入大小決定，各分片筆數平均
+    - row_group_size: 每個 row group 的筆數
+    - encoding: parquet 編碼設定（見 hf_pipeline.encoding），None 表示 DEFAULT_ENCODING
+    - dedup: 全域去重設定，False 表示不去重，True 表示 DEFAULT_DEDUP，也可為 dict（見 hf_pipeline.dedup）；
+             只在本次合併的輸入之間比對，重複筆數記錄在 manifest 的 filter_stats
+    - batch_size: 每批讀取的筆數
+    - num_proc: 計算去重簽章的行程數
+
+    回傳：合併結果的 manifest（dict）
+    """
+    target = target if target is not None else os.path.join(output_root, COMPACTED_DIR)
+    target_name = os.path.relpath(os.path.abspath(target), os.path.abspath(output_root))
+    all_inputs = find_inputs(output_root, exclude={target_name, target_name + '.tmp'})
+    if inputs is not None:
+        available = dict(all_inputs)
+        missing = [name for name in inputs if name not in available]
+        if missing:
+            raise ValueError(f"Inputs not found or not completed in {output_root}: {missing}.")
+        all_inputs = [(name, available[name]) for name in inputs]
+    if not all_inputs:
+        raise ValueError(f"No completed exports found in {output_root}.")
+    dedup = resolve_dedup(None if dedup is True else dedup or False)
+    encoding = resolve_encoding(encoding)
+
+    # 所有輸入都有 num_tokens 時才保留
+    files = [path for _, paths in all_inputs for path in paths]
+    with_tokens = all(TOKEN_COLUMN in pq.read_schema(path).names for path in files)
+    schema = output_schema(with_tokens)
+    total_rows = sum(pq.read_metadata(path).num_rows for path in files)
+    total_bytes = sum(os.path.getsize(path) for path in files)
+    rows_per_shard = _even_rows_per_shard(total_rows, total_bytes, max_bytes_per_shard, max_rows_per_shard)
+    print(f"▶ 合併 {len(all_inputs)} 個匯出結果（{len(files)} 個檔案、{total_rows} 筆）至 {target}")
+
+    tmp_dir = target.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    writer = ShardedParquetWriter(tmp_dir, schema, max_rows_per_shard=rows_per_shard,
+                                  max_bytes_per_shard=max_bytes_per_shard, row_group_size=row_group_size,
+                                  total_columns=[TOKEN_COLUMN] if with_tokens else [],
+                                  parquet_options=writer_options(encoding, schema))
+    deduplicator = None
+    if dedup:
+        # 索引根目錄為新的暫存目錄，只在本次的輸入之間比對，也不保存簽章
+        deduplicator = Deduplicator(dedup, tmp_dir, None, num_proc)
+    stats = {'input_rows': 0, 'dropped': {}}
+    input_counts = {}
+    output_counts = {}
+    try:
+        for location, paths in all_inputs:
+            counts = input_counts.setdefault(location, {})
+            for path in paths:
+                for table in _read_records(path, location, schema, batch_size):
+                    stats['input_rows'] += table.num_rows
+                    _count_sources(counts, table)
+                    if deduplicator is not None:
+                        table = deduplicator.apply(table, stats)
+                    if table.num_rows:
+                        writer.write_table(table)
+                        _count_sources(output_counts, table)
+            print(f"  ✓ {location}")
+    except BaseException:
+        writer.abort()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    finally:
+        if deduplicator is not None:
+            deduplicator.close()
+    shards = writer.close()
+
+    manifest = {
+        'inputs': [{'location': location, 'num_files': len(paths)} for location, paths in all_inputs],
+        'encoding': encoding,
+        'dedup': dedup,
+        'row_group_size': row_group_size,
+        'filter_stats': stats,
+        'schema': {field.name: str(field.type) for field in schema},
+        'num_rows': sum(shard['num_rows'] for shard in shards),
+        'num_bytes': sum(shard['num_bytes'] for shard in shards),
+        'num_shards': len(shards),
+        'shards': shards,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    if with_tokens:
+        manifest['num_tokens'] = sum(shard[TOKEN_COLUMN] for shard in shards)
+    write_json_atomic(os.path.join(tmp_dir, MANIFEST_NAME), manifest)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp_dir, target)
+
+    catalog = Catalog(output_root)
+    for location, paths in all_inputs:
+        catalog.replace_location(location, input_counts[location], len(paths))
+    catalog.replace_location(target_name, output_counts, len(shards))
+
+    print(f"✓ 已合併為 {manifest['num_shards']} 個分片（{manifest['num_rows']} 筆，"
+          f"{manifest['num_bytes'] / 1e6:.1f} MB），重複 {sum(stats['dropped'].values())} 筆")
+    return manifest
+
+
+def main(argv=None):
+    import argparse
+
+    from hf_pipeline.encoding import ENCODING_PROFILES
+
+    parser = argparse.ArgumentParser(prog='lambda_cli.py compact',
+                                     description='將 ./output 中的匯出結果合併為大小平均的 parquet 分片並更新 catalog')
+    parser.add_argument('--output', default='./output', help='輸出根目錄')
+    parser.add_argument('--target', default=None, help='合併結果的目錄，預設為 {output}/compacted')
+    parser.add_argument('--inputs', nargs='+', default=None, help='只合併這些匯出目錄或檔案（相對於 --output）')
+    parser.add_argument('--max-shard-mb', type=int, default=DEFAULT_MAX_BYTES_PER_SHARD // (1024 * 1024),
+                        help='單一分片大小上限（MB）')
+    parser.add_argument('--max-rows-per-shard', type=int, default=None)
+    parser.add_argument('--row-group-size', type=int, default=DEFAULT_ROW_GROUP_SIZE)
+    parser.add_argument('--encoding', default=None, choices=list(ENCODING_PROFILES), help='parquet 編碼 profile')
+    parser.add_argument('--dedup', action='store_true', help='在所有輸入之間全域去重')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--num-proc', type=int, default=DEFAULT_NUM_PROC, help='計算去重簽章的行程數')
+    args = parser.parse_args(argv)
+
+    compact_output(args.output, target=args.target, inputs=args.inputs,
+                   max_bytes_per_shard=args.max_shard_mb * 1024 * 1024, max_rows_per_shard=args.max_rows_per_shard,
+                   row_group_size=args.row_group_size, encoding=args.encoding, dedup=args.dedup,
+                   batch_size=args.batch_size, num_proc=args.num_proc)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,424 @@
+"""
+完全重複與近似重複（MinHash LSH）去除
+
+從多個 Hub 資料集匯出的 CP 語料常有大量重疊，匯出時會逐批去除：
+- 完全重複：整列文字的 64-bit 雜湊
+- 近似重複：字元 n-gram（預設 5 字，適合不分詞的中文）的 MinHash 簽章，
+  分為 bands 段，任一段與先前的資料相同即視為近似重複（Jaccard 約 (1/bands)^(1/rows) 以上）
+
+雜湊與簽章都以 numpy 對整批計算，資料量大時分成多段交由多個行程平行計算。
+每個匯出目錄保存自己的簽章（_dedup-00000.npz 等，隨分片一起提交），
+新的匯出會載入同一個輸出根目錄（如 ./output）下其他來源的匯出目錄的簽章，
+因此之後匯出的其他資料集也會與已儲存的資料去重；同一來源的舊匯出（例如以另一種攤平方式重新匯出）不會載入。
+索引超過 memory_keys 筆後依 key 分片寫入磁碟上的排序檔案，以 memory map 查詢，記憶體用量不隨資料量增加。
+"""
+import io
+import os
+import json
+import shutil
+import tempfile
+import concurrent.futures
+
+import numpy as np
+
+from hf_pipeline.ids import mix64
+from hf_pipeline.script import decode_codepoints
+
+
+DEFAULT_DEDUP = {
+    'exact': True,
+    'minhash': True,
+    'ngram': 5,
+    'num_perm': 128,
+    'bands': 16,
+    'seed': 42,
+}
+
+SEGMENT_PREFIX = '_dedup-'
+DEFAULT_NUM_PROC = min(8, os.cpu_count() or 1)
+# 每批少於此筆數時不值得分給多個行程
+PARALLEL_MIN_ROWS = 2000
+# 每個索引在記憶體中最多保留的 key 數（每個 8 bytes），超過時寫入磁碟
+DEFAULT_MEMORY_KEYS = 1 << 22
+
+_PRIME = np.uint64(1000003)
+
+
+def resolve_dedup(dedup):
+    """None 表示使用 DEFAULT_DEDUP，False 或空 dict 表示不去重"""
+    if dedup is None:
+        return dict(DEFAULT_DEDUP)
+    if not dedup:
+        return {}
+    unknown = set(dedup) - set(DEFAULT_DEDUP)
+    if unknown:
+        raise ValueError(f"Unknown dedup options: {sorted(unknown)}, please choose from {list(DEFAULT_DEDUP)}.")
+    config = {**DEFAULT_DEDUP, **dedup}
+    if config['num_perm'] % config['bands']:
+        raise ValueError(f"num_perm ({config['num_perm']}) must be divisible by bands ({config['bands']}).")
+    return config
+
+
+def segment_filename(i):
+    return f"{SEGMENT_PREFIX}{i:05d}.npz"
+
+
+def _row_starts(row_index, num_rows):
+    return np.searchsorted(row_index, np.arange(num_rows))
+
+
+def exact_hashes(codepoints, row_index, num_rows):
+    """每列文字的 64-bit 雜湊（多項式雜湊加上長度）"""
+    lengths = np.bincount(row_index, minlength=num_rows).astype(np.uint64)
+    if not len(codepoints):
+        return mix64(lengths)
+    starts = _row_starts(row_index, num_rows)
+    positions = np.arange(len(codepoints)) - starts[row_index]
+    powers = np.cumprod(np.full(positions.max() + 1, _PRIME, dtype=np.uint64))
+    terms = codepoints.astype(np.uint64) * powers[positions]
+
+    hashes = np.zeros(num_rows, dtype=np.uint64)
+    nonempty = lengths > 0
+    hashes[nonempty] = np.add.reduceat(terms, starts[nonempty])
+    return mix64(hashes ^ mix64(lengths))
+
+
+def _permutations(config):
+    rng = np.random.default_rng(config['seed'])
+    a = rng.integers(1, 2 ** 63, size=config['num_perm'], dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2 ** 63, size=config['num_perm'], dtype=np.uint64)
+    return a, b
+
+
+def band_keys(codepoints, row_index, num_rows, config):
+    """
+    每列 MinHash 簽章各 band 的 64-bit key
+
+    回傳 (keys, has_signature)：keys 為 shape (num_rows, bands) 的陣列；
+    字數少於 ngram 的列沒有簽章，只做完全重複比對
+    """
+    n = config['ngram']
+    keys = np.zeros((num_rows, config['bands']), dtype=np.uint64)
+    num_windows = len(codepoints) - n + 1
+    if num_windows <= 0:
+        return keys, np.zeros(num_rows, dtype=bool)
+
+    shingles = np.zeros(num_windows, dtype=np.uint64)
+    values = codepoints.astype(np.uint64)
+    for k in range(n):
+        shingles = shingles * _PRIME + values[k:k + num_windows]
+    rows = row_index[:num_windows]
+    within_row = rows == row_index[n - 1:]
+    shingles, rows = mix64(shingles[within_row]), rows[within_row]
+
+    has_signature = np.bincount(rows, minlength=num_rows) > 0
+    if not len(rows):
+        return keys, has_signature
+    starts = _row_starts(rows, num_rows)[has_signature]
+
+    # multiply-shift 雜湊作為排列，取每列最小值
+    a, b = _permutations(config)
+    signature = np.empty((len(starts), config['num_perm']), dtype=np.uint64)
+    for i in range(config['num_perm']):
+        signature[:, i] = np.minimum.reduceat((shingles * a[i] + b[i]) >> np.uint64(32), starts)
+
+    rows_per_band = config['num_perm'] // config['bands']
+    bands = signature.reshape(len(starts), config['bands'], rows_per_band)
+    combined = np.zeros(bands.shape[:2], dtype=np.uint64)
+    for i in range(rows_per_band):
+        combined = combined * _PRIME + bands[:, :, i]
+    # 不同 band 的 key 放在同一個索引中，混入 band 編號避免互相碰撞
+    band_ids = np.arange(config['bands'], dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    keys[has_signature] = mix64(combined ^ band_ids)
+    return keys, has_signature
+
+
+def compute_signatures(text, config):
+    """回傳 (exact, lsh, has_signature)，可在子行程中執行"""
+    codepoints, row_index = decode_codepoints(text)
+    exact = exact_hashes(codepoints, row_index, len(text))
+    if config['minhash']:
+        lsh, has_signature = band_keys(codepoints, row_index, len(text), config)
+    else:
+        lsh, has_signature = np.zeros((len(text), 0), dtype=np.uint64), np.zeros(len(text), dtype=bool)
+    return exact, lsh, has_signature
+
+
+def _sorted_unique(keys):
+    # 比 np.unique 快：numpy 2 的 np.unique 對整數先做雜湊去重再排序
+    keys = np.sort(keys)
+    return keys[np.r_[True, keys[1:] != keys[:-1]]] if len(keys) else keys
+
+
+def _lookup(sorted_keys, keys):
+    position = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return sorted_keys[position] == keys
+
+
+class KeyIndex:
+    """
+    以多個排序過的 uint64 陣列保存已見過的 key
+
+    新增的 key 先成為記憶體中獨立的小段，段數過多時才合併，避免每批都重新排序整個索引。
+    記憶體中的 key 超過 memory_keys 筆時，依 key 的最高 8 位元分成 NUM_SHARDS 個分片，
+    各寫成 spill_root 下暫存目錄中的一個排序 .npy 檔（run），查詢時以 memory map 二分搜尋，
+    只有讀到的頁面會載入記憶體；同一分片的 run 超過 MAX_RUNS 個時合併為一個。
+    memory_keys 為 None 表示全部保留在記憶體中。
+    """
+
+    MAX_SEGMENTS = 8
+    MAX_RUNS = 8
+    NUM_SHARDS = 256
+    _SHARD_SHIFT = np.uint64(56)
+
+    def __init__(self, spill_root=None, memory_keys=DEFAULT_MEMORY_KEYS):
+        self.spill_root = spill_root
+        self.memory_keys = memory_keys
+        self._segments = []
+        self._num_memory_keys = 0
+        self._spill_dir = None
+        self._runs = [[] for _ in range(self.NUM_SHARDS)]  # 每個分片的 [(路徑, memmap)]
+        self._num_runs = 0
+
+    def __len__(self):
+        return self._num_memory_keys + sum(len(run) for runs in self._runs for _, run in runs)
+
+    def add(self, keys):
+        if len(keys):
+            self._segments.append(_sorted_unique(keys))
+            self._num_memory_keys += len(self._segments[-1])
+        if len(self._segments) > self.MAX_SEGMENTS:
+            self._segments = [_sorted_unique(np.concatenate(self._segments))]
+            self._num_memory_keys = len(self._segments[0])
+        if self.memory_keys is not None and self._num_memory_keys > self.memory_keys:
+            self._spill()
+
+    def _write_run(self, shard, keys):
+        path = os.path.join(self._spill_dir, f"{shard:03d}-{self._num_runs:06d}.npy")
+        self._num_runs += 1
+        np.save(path, keys)
+        return path, np.load(path, mmap_mode='r')
+
+    def _spill(self):
+        keys = _sorted_unique(np.concatenate(self._segments))
+        self._segments = []
+        self._num_memory_keys = 0
+        if self._spill_dir is None:
+            root = self.spill_root if self.spill_root and os.path.isdir(self.spill_root) else None
+            self._spill_dir = tempfile.mkdtemp(prefix='.dedup-index-', dir=root)
+        # key 已排序，各分片為連續的一段
+        starts = np.arange(self.NUM_SHARDS, dtype=np.uint64) << self._SHARD_SHIFT
+        bounds = np.append(np.searchsorted(keys, starts), len(keys))
+        for shard in np.flatnonzero(np.diff(bounds)):
+            runs = self._runs[shard]
+            runs.append(self._write_run(shard, keys[bounds[shard]:bounds[shard + 1]]))
+            if len(runs) > self.MAX_RUNS:
+                merged = _sorted_unique(np.concatenate([np.asarray(run) for _, run in runs]))
+                paths = [path for path, _ in runs]
+                runs.clear()
+                for path in paths:
+                    os.remove(path)
+                runs.append(self._write_run(shard, merged))
+
+    def contains(self, keys):
+        found = np.zeros(len(keys), dtype=bool)
+        for segment in self._segments:
+            found |= _lookup(segment, keys)
+        if self._spill_dir is not None and len(keys):
+            shards = (keys >> self._SHARD_SHIFT).astype(np.intp)
+            order = np.argsort(shards, kind='stable')
+            bounds = np.searchsorted(shards[order], np.arange(self.NUM_SHARDS + 1))
+            for shard in np.flatnonzero(np.diff(bounds)):
+                if not self._runs[shard]:
+                    continue
+                rows = order[bounds[shard]:bounds[shard + 1]]
+                part = keys[rows]
+                hit = np.zeros(len(part), dtype=bool)
+                for _, run in self._runs[shard]:
+                    hit |= _lookup(run, part)
+                found[rows] |= hit
+        return found
+
+    def close(self):
+        """刪除寫入磁碟的 run"""
+        self._runs = [[] for _ in range(self.NUM_SHARDS)]
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+
+def _seen_earlier(keys, rows, num_rows):
+    """同一批中，key 與更前面的列相同的列"""
+    duplicate = np.zeros(num_rows, dtype=bool)
+    if not len(keys):
+        return duplicate
+    order = np.lexsort((rows, keys))
+    keys, rows = keys[order], rows[order]
+    first = np.r_[True, keys[1:] != keys[:-1]]
+    first_row = rows[np.maximum.accumulate(np.where(first, np.arange(len(keys)), 0))]
+    duplicate[rows[first_row < rows]] = True
+    return duplicate
+
+
+def clear_segments(output_dir):
+    """刪除匯出目錄中的簽章片段，重新匯出時才不會與舊的結果重複"""
+    if not os.path.isdir(output_dir):
+        return
+    for filename in os.listdir(output_dir):
+        if filename.startswith(SEGMENT_PREFIX):
+            os.remove(os.path.join(output_dir, filename))
+
+
+def _read_segment(path):
+    with np.load(path) as data:
+        return json.loads(str(data['config'])), data['exact'], data['lsh']
+
+
+class Deduplicator:
+    """
+    逐批去除重複資料
+
+    - config: 去重設定（見 DEFAULT_DEDUP）
+    - index_root: 共用索引的根目錄，會載入其下各匯出目錄的 _dedup-*.npz
+    - output_dir: 目前的匯出目錄，提交時簽章寫入此目錄；None 表示只比對、不保存
+    - num_proc: 計算簽章的行程數
+    - exclude: 不載入的匯出目錄名稱（index_root 下的相對路徑），例如同一來源的舊匯出
+               （見 hf_pipeline.checkpoint.same_source_exports）
+    - memory_keys: 每個索引在記憶體中最多保留的 key 數，超過時寫入 index_root 下的暫存目錄（見 KeyIndex）
+    """
+
+    def __init__(self, config, index_root, output_dir=None, num_proc=DEFAULT_NUM_PROC, exclude=(),
+                 memory_keys=DEFAULT_MEMORY_KEYS):
+        self.config = config
+        self.output_dir = output_dir
+        self.num_proc = num_proc
+        self.exact_index = KeyIndex(index_root, memory_keys)
+        self.lsh_index = KeyIndex(index_root, memory_keys)
+        self._batch = []
+        self._pending = []
+        self._executor = None
+        self._load(index_root, set(exclude))
+
+    def _load(self, index_root, exclude):
+        if not os.path.isdir(index_root):
+            return
+        num_segments = 0
+        for name in sorted(os.listdir(index_root)):
+            export_dir = os.path.join(index_root, name)
+            if name in exclude or not os.path.isdir(export_dir):
+                continue
+            for filename in sorted(os.listdir(export_dir)):
+                if not (filename.startswith(SEGMENT_PREFIX) and filename.endswith('.npz')):
+                    continue
+                config, exact, lsh = _read_segment(os.path.join(export_dir, filename))
+                self.exact_index.add(exact)
+                if config == self.config:
+                    self.lsh_index.add(lsh)
+                num_segments += 1
+        if num_segments:
+            print(f"✓ 已載入 {num_segments} 個去重索引片段（{len(self.exact_index)} 筆）")
+
+    def _signatures(self, text):
+        if self.num_proc <= 1 or len(text) < PARALLEL_MIN_ROWS:
+            return compute_signatures(text, self.config)
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(self.num_proc)
+        bounds = np.linspace(0, len(text), self.num_proc + 1).astype(int)
+        chunks = [text.slice(start, end - start) for start, end in zip(bounds[:-1], bounds[1:])]
+        results = list(self._executor.map(compute_signatures, chunks, [self.config] * len(chunks)))
+        return tuple(np.concatenate(parts) for parts in zip(*results))
+
+    def apply(self, records, stats, limit=None):
+        """
+        records 為含 text 欄位的 pyarrow.Table，回傳去除重複後的資料，
+        捨棄筆數累加到 stats['dropped'] 的 exact_duplicate / near_duplicate
+
+        limit 為最多保留的筆數，超過的資料不寫入索引（用於 max_rows）
+        """
+        if not records.num_rows:
+            # 只在 stats 中建立捨棄筆數的項目
+            self.select(np.zeros(0, dtype=np.uint64), None, None, stats)
+            return records
+        exact, lsh, has_signature = self._signatures(records.column('text').combine_chunks())
+        return records.filter(self.select(exact, lsh, has_signature, stats, limit))
+
+    def select(self, exact, lsh, has_signature, stats, limit=None):
+        """
+        依已算好的簽章（compute_signatures 的結果）判斷重複，回傳要保留的列（bool 陣列），
+        統計與索引的更新方式與 apply 相同；平行匯出時由 worker 計算簽章，合併時只需比對簽章
+        """
+        dropped = stats['dropped']
+        dropped.setdefault('exact_duplicate', 0)
+        dropped.setdefault('near_duplicate', 0)
+        num_rows = len(exact)
+        if not num_rows:
+            return np.zeros(0, dtype=bool)
+
+        row_ids = np.arange(num_rows)
+        exact_duplicate = np.zeros(num_rows, dtype=bool)
+        if self.config['exact']:
+            exact_duplicate = self.exact_index.contains(exact) | _seen_earlier(exact, row_ids, num_rows)
+
+        near_duplicate = np.zeros(num_rows, dtype=bool)
+        if self.config['minhash']:
+            rows = np.repeat(row_ids[has_signature], lsh.shape[1])
+            keys = lsh[has_signature].ravel()
+            seen = self.lsh_index.contains(keys)
+            near_duplicate[rows[seen]] = True
+            near_duplicate |= _seen_earlier(keys, rows, num_rows)
+            near_duplicate &= ~exact_duplicate
+
+        keep = ~(exact_duplicate | near_duplicate)
+        seen = np.ones(num_rows, dtype=bool)
+        kept = np.flatnonzero(keep)
+        if limit is not None and len(kept) > limit:
+            # 超過 limit 的列不會寫出，也不算已見過
+            seen[kept[limit]:] = False
+            keep &= seen
+        dropped['exact_duplicate'] += int((exact_duplicate & seen).sum())
+        dropped['near_duplicate'] += int((near_duplicate & seen).sum())
+
+        # 捨棄的近似重複列也寫入索引：同一批中的比對本來就包含這些列，
+        # 之後的批次才會得到相同的判斷，統計與輸出不會因為批次的切分位置而不同
+        recorded = seen & ~exact_duplicate
+        new_exact = exact[recorded]
+        new_lsh = lsh[recorded & has_signature].ravel()
+        self.exact_index.add(new_exact)
+        self.lsh_index.add(new_lsh)
+        if self.output_dir is not None:
+            self._batch.append((new_exact, new_lsh))
+        return keep
+
+    def end_batch(self, source_end):
+        """一批資料處理完後呼叫，記錄此批簽章對應的來源位置"""
+        for exact, lsh in self._batch:
+            self._pending.append((source_end, exact, lsh))
+        self._batch = []
+
+    def commit(self, source_offset, index):
+        """
+        將來源位置 source_offset 之前的簽章寫成第 index 個片段並回傳檔名，沒有新簽章時回傳 None
+
+        續傳時會從 source_offset 重新讀取，之後的簽章必須留到下次提交，才不會與自己重複
+        """
+        ready = [item for item in self._pending if item[0] <= source_offset]
+        self._pending = [item for item in self._pending if item[0] > source_offset]
+        if not ready or self.output_dir is None:
+            return None
+        exact = np.concatenate([item[1] for item in ready])
+        lsh = np.concatenate([item[2] for item in ready])
+        filename = segment_filename(index)
+        buffer = io.BytesIO()
+        np.savez(buffer, exact=exact, lsh=lsh, config=json.dumps(self.config, sort_keys=True))
+        path = os.path.join(self.output_dir, filename)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(path + '.tmp', path)
+        return filename
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.exact_index.close()
+        self.lsh_index.close()
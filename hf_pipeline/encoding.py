@@ -0,0 +1,199 @@
+"""
+parquet 編碼設定
+
+CP 語料幾乎都是不重複的長文字，pyarrow 預設的 snappy 壓縮與全欄位 dictionary encoding 並不適合：
+- text 欄位幾乎沒有重複值，dictionary 會在超過 dictionary page 上限後退回 plain 編碼，只是白做工
+- source 欄位整個分片只有一個值，dictionary encoding 後幾乎不佔空間
+- text 欄位的 min/max 統計沒有用途，只需保留 id 與 source_row 的統計供讀取端以範圍過濾
+
+編碼設定以 profile 表示（壓縮方式、壓縮等級、dictionary 欄位、data page 大小、統計欄位），
+匯出時以 encoding 參數選擇，row group 大小沿用匯出的 row_group_size 參數。
+benchmark_encodings 以記憶體中的樣本比較各 profile 的寫入 / 讀取速度與壓縮率。
+"""
+import io
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+ENCODING_OPTIONS = ['compression', 'compression_level', 'use_dictionary', 'data_page_size', 'write_statistics']
+
+ENCODING_PROFILES = {
+    # pyarrow 的預設值（原本的行為）
+    'pyarrow': {
+        'compression': 'snappy',
+        'compression_level': None,
+        'use_dictionary': True,
+        'data_page_size': None,
+        'write_statistics': True,
+    },
+    # 讀寫速度優先，適合暫存或會再重新編碼的檔案
+    'fast': {
+        'compression': 'lz4',
+        'compression_level': None,
+        'use_dictionary': ['source'],
+        'data_page_size': 1024 * 1024,
+        'write_statistics': ['id', 'source_row'],
+    },
+    'zstd': {
+        'compression': 'zstd',
+        'compression_level': 3,
+        'use_dictionary': ['source'],
+        'data_page_size': 4 * 1024 * 1024,
+        'write_statistics': ['id', 'source_row'],
+    },
+    # 檔案大小優先，寫入較慢，讀取速度與 zstd 相近
+    'archive': {
+        'compression': 'zstd',
+        'compression_level': 9,
+        'use_dictionary': ['source'],
+        'data_page_size': 8 * 1024 * 1024,
+        'write_statistics': ['id', 'source_row'],
+    },
+}
+DEFAULT_ENCODING = 'zstd'
+
+DEFAULT_BENCHMARK_SAMPLES = 20000
+
+
+def resolve_encoding(encoding):
+    """
+    None 表示使用 DEFAULT_ENCODING，字串為 ENCODING_PROFILES 中的名稱，
+    dict 會覆蓋 DEFAULT_ENCODING 中的對應設定（如 {'compression_level': 9}）
+    """
+    if encoding is None:
+        encoding = DEFAULT_ENCODING
+    if isinstance(encoding, str):
+        if encoding not in ENCODING_PROFILES:
+            raise ValueError(f"Unknown encoding profile: {encoding}, please choose from {list(ENCODING_PROFILES)}.")
+        return dict(ENCODING_PROFILES[encoding])
+    unknown = set(encoding) - set(ENCODING_OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown encoding options: {sorted(unknown)}, please choose from {ENCODING_OPTIONS}.")
+    return {**ENCODING_PROFILES[DEFAULT_ENCODING], **encoding}
+
+
+def writer_options(encoding, schema):
+    """將 encoding 設定轉為 pyarrow.parquet.ParquetWriter 的參數，只保留 schema 中存在的欄位"""
+    options = {}
+    for key, value in resolve_encoding(encoding).items():
+        if value is None:
+            continue
+        if isinstance(value, list):
+            value = [name for name in value if name in schema.names]
+        options[key] = value
+    return options
+
+
+def _benchmark_one(table, encoding, row_group_size, repeat):
+    raw_bytes = table.nbytes
+    write_seconds = read_seconds = float('inf')
+    for _ in range(repeat):
+        buffer = io.BytesIO()
+        started = time.perf_counter()
+        pq.write_table(table, buffer, row_group_size=row_group_size, **writer_options(encoding, table.schema))
+        write_seconds = min(write_seconds, time.perf_counter() - started)
+
+        buffer.seek(0)
+        started = time.perf_counter()
+        pq.read_table(buffer)
+        read_seconds = min(read_seconds, time.perf_counter() - started)
+    num_bytes = buffer.getbuffer().nbytes
+    return {
+        'num_bytes': num_bytes,
+        'compression_ratio': raw_bytes / num_bytes if num_bytes else 0.0,
+        'write_mb_s': raw_bytes / 1e6 / write_seconds if write_seconds else float('inf'),
+        'read_mb_s': raw_bytes / 1e6 / read_seconds if read_seconds else float('inf'),
+    }
+
+
+def benchmark_encodings(table, profiles=None, row_group_sizes=(50000,), repeat=3):
+    """
+    以記憶體中的 table 比較各編碼設定
+
+    - profiles: {名稱: encoding} 或 profile 名稱的 list，None 表示 ENCODING_PROFILES 中的全部 profile
+    - row_group_sizes: 要比較的 row group 筆數
+    - repeat: 每個設定重複寫入與讀取的次數，速度取最快的一次
+
+    寫入 / 讀取速度以 Arrow 記憶體中的大小（table.nbytes）計算，壓縮率為 table.nbytes / 檔案大小。
+    回傳每個設定一筆結果的 list
+    """
+    if profiles is None:
+        profiles = list(ENCODING_PROFILES)
+    if not isinstance(profiles, dict):
+        profiles = {name: name for name in profiles}
+    results = []
+    for name, encoding in profiles.items():
+        for row_group_size in row_group_sizes:
+            result = _benchmark_one(table, encoding, row_group_size, repeat)
+            results.append({'profile': name, 'row_group_size': row_group_size, 'num_rows': table.num_rows,
+                            'raw_bytes': table.nbytes, **result})
+    return results
+
+
+def benchmark_field(dataset_name, field_name, config_name=None, split="train", token=None, revision=None,
+                    flatten_mode='explode', separator='\n', template=None, num_samples=DEFAULT_BENCHMARK_SAMPLES,
+                    cache=None, **kwargs):
+    """
+    從 split 分層抽樣 num_samples 列，轉為匯出時的 CP schema 後執行 benchmark_encodings
+
+    資料檔清單與各 row group 的筆數來自 MetadataCache（參數 cache 與 hf_pipeline.metadata.get_split_info 相同），
+    kwargs 傳給 benchmark_encodings（profiles、row_group_sizes、repeat）
+    """
+    from hf_pipeline.export import extract_records, source_columns, to_cp_table
+    from hf_pipeline.ids import source_key
+    from hf_pipeline.metadata import get_split_info, sample_split
+
+    _, _, data_files = get_split_info(dataset_name, config_name, token, revision, cache)
+    sample, rows = sample_split(dataset_name, config_name, split, num_samples, token, revision,
+                                data_files=(data_files or {}).get(split), columns=source_columns(field_name, template),
+                                cache=cache)
+    records = extract_records(sample, field_name, flatten_mode, separator, template)
+    # 換算為 split 中的來源列編號，id 與 source_row 的分布才與實際匯出相同
+    records = records.set_column(1, 'source_row', pa.array(rows[records.column('source_row').to_numpy()]))
+    source = source_key(dataset_name, field_name, config_name, split, revision, flatten_mode)
+    return benchmark_encodings(to_cp_table(records, source), **kwargs)
+
+
+def format_benchmark(results):
+    """將 benchmark 結果格式化為文字表格"""
+    lines = [f"{'profile':<12}{'row_group':>10}{'size (MB)':>12}{'ratio':>8}{'write MB/s':>12}{'read MB/s':>12}"]
+    for result in results:
+        lines.append(f"{result['profile']:<12}{result['row_group_size']:>10}{result['num_bytes'] / 1e6:>12.2f}"
+                     f"{result['compression_ratio']:>8.2f}{result['write_mb_s']:>12.1f}{result['read_mb_s']:>12.1f}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    import argparse
+    import os
+
+    from hf_pipeline.flatten import FLATTEN_MODES
+
+    parser = argparse.ArgumentParser(description='比較 parquet 編碼設定的寫入 / 讀取速度與壓縮率')
+    parser.add_argument('dataset_name', help='HF 資料集名稱或本機路徑')
+    parser.add_argument('field_name', help='要匯出的欄位，可為巢狀路徑（如 messages[].content）')
+    parser.add_argument('--config', default=None, help='subset 名稱')
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--revision', default=None)
+    parser.add_argument('--flatten-mode', default='explode', choices=list(FLATTEN_MODES))
+    parser.add_argument('--separator', default='\n', help="'join' / 'template' 模式串接字串時的分隔字元")
+    parser.add_argument('--template', default=None,
+                        help="'template' 模式組合 struct 欄位的格式，例如 '{role}：{content}'（field_name 為 messages[]）")
+    parser.add_argument('--num-samples', type=int, default=DEFAULT_BENCHMARK_SAMPLES, help='抽樣列數')
+    parser.add_argument('--profiles', nargs='+', default=None, help='要比較的 profile，預設為全部')
+    parser.add_argument('--row-group-sizes', nargs='+', type=int, default=[50000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    token = os.environ.get('HF_KEY') or os.environ.get('HF_TOKEN') or os.environ.get('HUGGING_FACE_HUB_TOKEN')
+    results = benchmark_field(args.dataset_name, args.field_name, config_name=args.config, split=args.split,
+                              token=token, revision=args.revision, flatten_mode=args.flatten_mode,
+                              separator=args.separator, template=args.template, num_samples=args.num_samples,
+                              profiles=args.profiles, row_group_sizes=args.row_group_sizes, repeat=args.repeat)
+    print(format_benchmark(results))
+
+
+if __name__ == '__main__':
+    main()
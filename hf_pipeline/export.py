@@ -0,0 +1,339 @@
+"""
+Hugging Face 資料集串流匯出
+
+以 streaming 模式開啟已認可的 split，按固定筆數逐批讀取欄位，
+再透過 ShardedParquetWriter 逐批寫出 {id, text} parquet 分片與 manifest。
+記憶體用量只與 batch_size 和 row_group_size 有關，與資料集大小無關。
+"""
+import os
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from hf_pipeline.checkpoint import ExportCheckpoint, SourceTracker, check_source, same_source_exports
+from hf_pipeline.fields import LIST_MARK, root_column
+from hf_pipeline.flatten import ROW_PATH, flatten_field, template_columns
+from hf_pipeline.dedup import DEFAULT_NUM_PROC, Deduplicator, clear_segments, resolve_dedup
+from hf_pipeline.encoding import resolve_encoding, writer_options
+from hf_pipeline.filters import FilterPipeline, resolve_filters
+from hf_pipeline.ids import source_key, stable_ids
+from hf_pipeline.tokens import TOKEN_COLUMN, TokenCounter
+from hf_pipeline.shards import (
+    DEFAULT_MAX_BYTES_PER_SHARD,
+    DEFAULT_MAX_ROWS_PER_SHARD,
+    DEFAULT_ROW_GROUP_SIZE,
+    MANIFEST_NAME,
+    ShardedParquetWriter,
+    clear_shards,
+    read_manifest,
+    write_json_atomic,
+)
+
+
+DEFAULT_BATCH_SIZE = 10000
+
+# 寫入 manifest 的匯出參數
+MANIFEST_PARAMS = ['dataset_name', 'revision', 'config_name', 'split', 'field_name', 'flatten_mode', 'template',
+                   'filters', 'dedup', 'tokenizer', 'row_group_size', 'encoding']
+
+# id 為穩定的全域唯一 id，source / source_row / source_part 記錄資料來源（見 hf_pipeline.ids）
+CP_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('text', pa.string()),
+    ('source', pa.string()),
+    ('source_row', pa.int64()),
+    ('source_part', pa.int32()),
+])
+# 指定 tokenizer 時加上每筆的 token 數（見 hf_pipeline.tokens）
+TOKEN_SCHEMA = CP_SCHEMA.append(pa.field(TOKEN_COLUMN, pa.int32()))
+
+
+def output_schema(tokenizer=None):
+    return TOKEN_SCHEMA if tokenizer else CP_SCHEMA
+
+
+def safe_name(name):
+    """清理資料集或欄位名稱（含巢狀路徑，如 messages[].content），用於檔案命名"""
+    return name.replace('/', '_').replace('\\', '_').replace(LIST_MARK, '').replace(ROW_PATH, 'row')
+
+
+def open_streaming_split(dataset_name, config_name=None, split="train", token=None, revision=None):
+    """以 streaming 模式開啟 HF split，不會下載或快取整個資料集"""
+    from datasets import load_dataset
+
+    load_kwargs = {}
+    if token:
+        load_kwargs['token'] = token
+    if revision:
+        load_kwargs['revision'] = revision
+    return load_dataset(dataset_name, config_name, split=split, streaming=True, **load_kwargs)
+
+
+def source_columns(field_name, template=None):
+    """匯出欄位需要讀取的頂層欄位"""
+    if field_name == ROW_PATH:
+        return template_columns(template)
+    return [root_column(field_name)]
+
+
+def iter_field_batches(dataset, field_name, batch_size=DEFAULT_BATCH_SIZE, template=None):
+    """逐批取出欄位所在的頂層欄位，每批回傳一個 pyarrow.Table"""
+    dataset = dataset.select_columns(source_columns(field_name, template)).with_format("arrow")
+    for table in dataset.iter(batch_size=batch_size):
+        yield table
+
+
+def extract_records(table, field_name, flatten_mode='explode', separator='\n', template=None, row_offset=0):
+    """
+    取出欄位（可為巢狀路徑）中的字串，巢狀欄位依 flatten_mode 攤平（見 hf_pipeline.flatten）
+
+    回傳 {text, source_row, source_part} 的 pyarrow.Table：
+    source_row 為來源列編號（table 第一列的編號為 row_offset），source_part 為同一列中的第幾個字串
+    """
+    text, row_index = flatten_field(table, field_name, flatten_mode, separator, template)
+    valid = pc.is_valid(text)
+    text, row_index = pc.filter(text, valid), pc.filter(row_index, valid)
+    if text.type != pa.string():
+        text = pc.cast(text, pa.string())
+
+    rows = row_index.to_numpy(zero_copy_only=False)
+    # row_index 為遞增排序，同一列的第一個字串位置即為 searchsorted 的結果
+    parts = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    return pa.Table.from_arrays([text, pa.array(rows + row_offset), pa.array(parts.astype(np.int32))],
+                                names=['text', 'source_row', 'source_part'])
+
+
+def to_cp_table(records, source):
+    """
+    依來源位置計算穩定 id（見 hf_pipeline.ids），組成輸出的 CP_SCHEMA Table
+    records 含 num_tokens 欄位（TokenCounter.apply 的結果）時輸出 TOKEN_SCHEMA
+    """
+    ids = stable_ids(source, records.column('source_row'), records.column('source_part'))
+    arrays = [
+        pa.array(ids),
+        records.column('text'),
+        pa.array([source] * records.num_rows, pa.string()),
+        records.column('source_row'),
+        records.column('source_part'),
+    ]
+    if TOKEN_COLUMN in records.column_names:
+        return pa.Table.from_arrays(arrays + [records.column(TOKEN_COLUMN)], schema=TOKEN_SCHEMA)
+    return pa.Table.from_arrays(arrays, schema=CP_SCHEMA)
+
+
+def export_name(dataset_name, field_name, flatten_mode='explode', config_name=None, split="train"):
+    """
+    單一欄位匯出結果的檔名主體：{dataset}_{field}，
+    有 subset 或 split 不是 train 時加上 @{subset} / @{split}，非預設的攤平模式加在欄位名稱後
+    """
+    name = safe_name(dataset_name)
+    if config_name:
+        name += f"@{safe_name(config_name)}"
+    if split != "train":
+        name += f"@{safe_name(split)}"
+    if flatten_mode != 'explode':
+        field_name = f"{field_name}_{flatten_mode}"
+    return f"{name}_{safe_name(field_name)}"
+
+
+def export_dir_name(dataset_name, field_name, flatten_mode='explode', config_name=None, split="train"):
+    """單一欄位匯出結果的目錄名稱，不同 subset、split 的匯出會寫入不同目錄"""
+    return f"{export_name(dataset_name, field_name, flatten_mode, config_name, split)}_cp_data"
+
+
+def export_params(dataset_name, field_name, config_name, split, revision, flatten_mode, separator, template,
+                  filters, dedup, max_rows, max_rows_per_shard, max_bytes_per_shard, row_group_size, tokenizer=None,
+                  encoding=None):
+    """匯出參數，存入 _export_state.json，參數相同的匯出才可續傳或略過"""
+    return {
+        'dataset_name': dataset_name,
+        'revision': revision,
+        'config_name': config_name,
+        'split': split,
+        'field_name': field_name,
+        'flatten_mode': flatten_mode,
+        'separator': separator,
+        'template': template,
+        'filters': resolve_filters(filters),
+        'dedup': resolve_dedup(dedup),
+        'tokenizer': tokenizer,
+        'max_rows': max_rows,
+        'max_rows_per_shard': max_rows_per_shard,
+        'max_bytes_per_shard': max_bytes_per_shard,
+        'row_group_size': row_group_size,
+        'encoding': resolve_encoding(encoding),
+        'columns': output_schema(tokenizer).names,
+    }
+
+
+def export_field(dataset_name, field_name, output_dir, config_name=None, split="train",
+                 batch_size=DEFAULT_BATCH_SIZE, max_rows=None, token=None,
+                 max_rows_per_shard=DEFAULT_MAX_ROWS_PER_SHARD, max_bytes_per_shard=DEFAULT_MAX_BYTES_PER_SHARD,
+                 row_group_size=DEFAULT_ROW_GROUP_SIZE, resume=True, revision=None,
+                 flatten_mode='explode', separator='\n', template=None, filters=None,
+                 dedup=None, dedup_root=None, num_proc=DEFAULT_NUM_PROC, tokenizer=None, encoding=None):
+    """
+    以串流方式將單一欄位完整匯出為 parquet 分片
+
+    參數：
+    - dataset_name: HF 資料集名稱
+    - field_name: 要匯出的欄位，可為巢狀路徑（如 messages[].content，見 hf_pipeline.fields）
+    - output_dir: 分片與 _manifest.json 的輸出目錄
+    - config_name: subset 名稱，None 表示沒有 subset
+    - split: 要匯出的 split
+    - batch_size: 每批讀取的筆數
+    - max_rows: 最多匯出的筆數，None 表示全部
+    - token: Hugging Face token
+    - max_rows_per_shard / max_bytes_per_shard: 分片切換門檻，None 表示不限制
+    - row_group_size: 每個 row group 的筆數
+    - resume: True 時若 output_dir 中有相同參數的 _export_state.json，
+              會保留已提交的分片並從中斷處繼續；已完成的匯出直接回傳 manifest
+    - revision: 資料集的 git revision（branch、tag 或 commit sha），None 表示 main
+    - flatten_mode / separator / template: 巢狀欄位的攤平方式（explode / join / template，見 hf_pipeline.flatten）
+    - filters: 逐列品質過濾設定（見 hf_pipeline.filters），None 表示使用 DEFAULT_FILTERS，False 表示不過濾；
+               各條件的捨棄筆數記錄在 manifest 的 filter_stats
+    - dedup: 去重設定（見 hf_pipeline.dedup），None 表示使用 DEFAULT_DEDUP，False 表示不去重；
+             重複筆數同樣記錄在 filter_stats（exact_duplicate / near_duplicate）
+    - dedup_root: 共用去重索引的根目錄，None 表示 output_dir 的上層目錄（如 ./output）
+    - num_proc: 計算去重簽章與 token 數的行程數
+    - tokenizer: Hugging Face tokenizer 名稱或路徑（需有 fast 版本），指定時輸出 num_tokens 欄位，
+                 manifest 記錄每個分片與全部資料的 token 總數（見 hf_pipeline.tokens）；None 表示不計算
+    - encoding: parquet 編碼設定（壓縮方式與等級、dictionary、data page 大小、統計欄位，見 hf_pipeline.encoding），
+                可為 profile 名稱或 dict，None 表示 DEFAULT_ENCODING（zstd）
+
+    回傳：manifest 內容（dict）
+    """
+    params = export_params(dataset_name, field_name, config_name, split, revision, flatten_mode, separator, template,
+                           filters, dedup, max_rows, max_rows_per_shard, max_bytes_per_shard, row_group_size,
+                           tokenizer, encoding)
+    filters, dedup = params['filters'], params['dedup']
+    os.makedirs(output_dir, exist_ok=True)
+    check_source(output_dir, params)
+    checkpoint = ExportCheckpoint.load(output_dir, params) if resume else None
+    if checkpoint is not None and checkpoint.completed:
+        print(f"✓ {output_dir} 已完成匯出，略過")
+        return read_manifest(output_dir)
+
+    if checkpoint is None:
+        clear_shards(output_dir)
+        clear_segments(output_dir)
+        checkpoint = ExportCheckpoint(output_dir, params)
+        checkpoint.save()
+    else:
+        checkpoint.remove_uncommitted()
+        print(f"↻ 從第 {checkpoint.committed_rows} 筆（來源位置 {checkpoint.source_offset}）繼續匯出，"
+              f"已完成 {len(checkpoint.shards)} 個分片")
+
+    dataset = open_streaming_split(dataset_name, config_name, split, token, revision)
+    if checkpoint.source_offset:
+        dataset = dataset.skip(checkpoint.source_offset)
+    schema = output_schema(tokenizer)
+    writer = ShardedParquetWriter(output_dir, schema, max_rows_per_shard=max_rows_per_shard,
+                                  max_bytes_per_shard=max_bytes_per_shard, row_group_size=row_group_size,
+                                  shards=checkpoint.shards, total_columns=[TOKEN_COLUMN] if tokenizer else [],
+                                  parquet_options=writer_options(params['encoding'], schema))
+
+    source = source_key(dataset_name, field_name, config_name, split, revision, flatten_mode)
+    num_rows = checkpoint.committed_rows
+    source_offset = checkpoint.source_offset
+    skip_output_rows = checkpoint.skip_output_rows
+    pipeline = FilterPipeline(filters, stats=checkpoint.filter_stats)
+    tracker = SourceTracker(source_offset, num_rows - skip_output_rows, pipeline.stats)
+    deduplicator = None
+    if dedup:
+        index_root = dedup_root if dedup_root is not None else os.path.dirname(os.path.abspath(output_dir))
+        deduplicator = Deduplicator(dedup, index_root, output_dir, num_proc,
+                                    exclude=same_source_exports(index_root, params, output_dir))
+    counter = TokenCounter(tokenizer, num_proc) if tokenizer else None
+    try:
+        for table in iter_field_batches(dataset, field_name, batch_size, template):
+            records = extract_records(table, field_name, flatten_mode, separator, template, row_offset=source_offset)
+            source_offset += table.num_rows
+            records = pipeline.apply(records)
+            if deduplicator is not None:
+                limit = None if max_rows is None else max_rows - num_rows + skip_output_rows
+                records = deduplicator.apply(records, pipeline.stats, limit)
+            if skip_output_rows:
+                # 這些資料已寫入先前提交的分片
+                skipped = min(skip_output_rows, records.num_rows)
+                records = records.slice(skipped)
+                skip_output_rows -= skipped
+            if max_rows is not None:
+                records = records.slice(0, max_rows - num_rows)
+
+            num_shards = len(writer.shards)
+            if records.num_rows:
+                if counter is not None:
+                    records = counter.apply(records)
+                writer.write_table(to_cp_table(records, source))
+                num_rows += records.num_rows
+            tracker.add_batch(source_offset, num_rows - skip_output_rows, pipeline.stats)
+            if deduplicator is not None:
+                deduplicator.end_batch(source_offset)
+
+            if len(writer.shards) > num_shards:
+                _commit(checkpoint, writer, tracker, deduplicator)
+
+            if max_rows is not None and num_rows >= max_rows:
+                break
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        if deduplicator is not None:
+            deduplicator.close()
+        if counter is not None:
+            counter.close()
+    shards = writer.close()
+    if deduplicator is not None:
+        _commit_dedup(checkpoint, deduplicator, source_offset)
+
+    manifest = write_manifest(output_dir, params, pipeline.stats, shards)
+
+    checkpoint.shards = shards
+    checkpoint.committed_rows = num_rows
+    checkpoint.filter_stats = pipeline.stats
+    checkpoint.completed = True
+    checkpoint.save()
+    return manifest
+
+
+def write_manifest(output_dir, params, filter_stats, shards, **extra):
+    """依匯出參數與分片資訊寫出 _manifest.json 並回傳其內容"""
+    manifest = {key: params[key] for key in MANIFEST_PARAMS}
+    manifest.update({
+        'source': source_key(params['dataset_name'], params['field_name'], params['config_name'], params['split'],
+                             params['revision'], params['flatten_mode']),
+        'filter_stats': filter_stats,
+        'schema': {field.name: str(field.type) for field in output_schema(params['tokenizer'])},
+        'num_rows': sum(shard['num_rows'] for shard in shards),
+        'num_bytes': sum(shard['num_bytes'] for shard in shards),
+        'num_shards': len(shards),
+        'shards': shards,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    })
+    if params['tokenizer']:
+        manifest['num_tokens'] = sum(shard.get(TOKEN_COLUMN, 0) for shard in shards)
+    manifest.update(extra)
+    write_json_atomic(os.path.join(output_dir, MANIFEST_NAME), manifest)
+    return manifest
+
+
+def _commit(checkpoint, writer, tracker, deduplicator=None):
+    """分片關閉後更新檢查點，記錄下一筆未提交資料的來源位置"""
+    committed_rows = writer.committed_rows
+    checkpoint.shards = list(writer.shards)
+    checkpoint.committed_rows = committed_rows
+    checkpoint.source_offset, checkpoint.skip_output_rows, checkpoint.filter_stats = tracker.resume_point(committed_rows)
+    if deduplicator is not None:
+        _commit_dedup(checkpoint, deduplicator, checkpoint.source_offset)
+    checkpoint.save()
+
+
+def _commit_dedup(checkpoint, deduplicator, source_offset):
+    """將 source_offset 之前的去重簽章寫入匯出目錄"""
+    filename = deduplicator.commit(source_offset, len(checkpoint.dedup_segments))
+    if filename is not None:
+        checkpoint.dedup_segments.append(filename)
@@ -0,0 +1,95 @@
+"""
+依 schema 偵測文字欄位
+
+走訪資料集 features 的 Arrow 型別（struct / list / string），找出所有字串葉節點，
+包含 messages: list[{role, content}]、conversations 等巢狀欄位，不需要掃描任何資料。
+每個文字欄位以路徑表示：struct 子欄位以 '.' 連接，list 以 '[]' 表示，例如：
+- text
+- messages[].content
+- meta.title
+Inspector 檢查與 parquet 匯出都以同一組路徑定位資料。
+"""
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+LIST_MARK = '[]'
+
+
+def is_string_type(data_type):
+    return pa.types.is_string(data_type) or pa.types.is_large_string(data_type)
+
+
+def _is_list_type(data_type):
+    return pa.types.is_list(data_type) or pa.types.is_large_list(data_type) or pa.types.is_fixed_size_list(data_type)
+
+
+def _walk(data_type, path):
+    if is_string_type(data_type):
+        return [path]
+    if _is_list_type(data_type):
+        return _walk(data_type.value_type, path + LIST_MARK)
+    if pa.types.is_struct(data_type):
+        paths = []
+        for i in range(data_type.num_fields):
+            child = data_type.field(i)
+            paths.extend(_walk(child.type, f"{path}.{child.name}"))
+        return paths
+    return []
+
+
+def find_text_fields(schema):
+    """
+    回傳所有字串葉節點的路徑
+
+    參數 schema 可以是 pyarrow.Schema 或 datasets.Features
+    """
+    if hasattr(schema, 'arrow_schema'):
+        schema = schema.arrow_schema
+    paths = []
+    for field in schema:
+        paths.extend(_walk(field.type, field.name))
+    return paths
+
+
+def root_column(path):
+    """路徑對應的頂層欄位名稱"""
+    return parse_path(path)[0][1]
+
+
+def parse_path(path):
+    """將路徑拆成 ('field', 名稱) 與 ('list', None) 步驟"""
+    steps = []
+    for segment in path.split('.'):
+        name = segment
+        depth = 0
+        while name.endswith(LIST_MARK):
+            name = name[:-len(LIST_MARK)]
+            depth += 1
+        steps.append(('field', name))
+        steps.extend([('list', None)] * depth)
+    return steps
+
+
+def field_values(table, path):
+    """
+    以 Arrow kernel 取出路徑上的所有非空值
+
+    回傳 (values, row_index)：
+    - values: 攤平後的值
+    - row_index: 每個值來自 table 的第幾列，供 join 或保留來源資訊使用
+    """
+    steps = parse_path(path)
+    values = table.column(steps[0][1]).combine_chunks()
+    row_index = pa.array(np.arange(len(values), dtype=np.int64))
+
+    for kind, name in steps[1:]:
+        if kind == 'list':
+            row_index = pc.take(row_index, pc.list_parent_indices(values))
+            values = pc.list_flatten(values)
+        else:
+            values = pc.struct_field(values, name)
+
+    valid = pc.is_valid(values)
+    return pc.filter(values, valid), pc.filter(row_index, valid)
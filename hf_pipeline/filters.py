@@ -0,0 +1,213 @@
+"""
+匯出時的逐列品質過濾
+
+Inspector 只決定整個欄位是否適合 CP，被認可的欄位中仍可能混有空白、過短、亂碼或以英文為主的資料。
+過濾設定以 dict 表示，只有出現在設定中的條件會被套用，例如：
+
+    {'min_chars': 10, 'min_cjk_ratio': 0.3, 'max_repeated_ngram_ratio': 0.5,
+     'max_garbled_ratio': 0.05, 'max_boilerplate_ratio': 0.3, 'min_traditional_score': 0.9}
+
+每批資料只解碼一次 UTF-8，所有條件都以 numpy / Arrow compute 對整批計算，
+每筆被捨棄的資料只計入第一個未通過的條件，各條件的捨棄筆數會寫入 _manifest.json。
+"""
+import functools
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from hf_pipeline.script import (OTHER, count_categories, decode_codepoints, script_lookup_table,
+                                traditional_scores)
+
+
+DEFAULT_FILTERS = {
+    'min_chars': 10,
+    'max_garbled_ratio': 0.05,
+    'min_cjk_ratio': 0.3,
+    'max_repeated_ngram_ratio': 0.5,
+    'max_boilerplate_ratio': 0.3,
+}
+
+REPETITION_NGRAM = 10
+
+# 字元類別
+CHAR_OTHER, CHAR_CJK, CHAR_SPACE, CHAR_CONTROL, CHAR_MOJIBAKE = 0, 1, 2, 3, 4
+NUM_CHAR_CLASSES = 5
+
+WHITESPACE = ' \t\n\r\x0b\x0c\x85\xa0\u1680\u2028\u2029\u202f\u205f\u3000' + ''.join(map(chr, range(0x2000, 0x200b)))
+# U+FFFD 與私有區字元通常來自解碼失敗；Ã、Â 是 UTF-8 被當成 Latin-1 解碼時最常見的殘留
+MOJIBAKE_CHARS = '\ufffd\u00c3\u00c2'
+# 「锟斤拷」來自 U+FFFD 經 GBK 解碼，「锟」本身也是正常用字（如「锟铻」），因此只計算整個序列
+MOJIBAKE_SEQUENCES = ('锟斤拷',)
+
+BOILERPLATE_PATTERN = '|'.join([
+    r'(?:https?://|www\.)\S+',
+    r'[\w.+-]+@[\w-]+\.[\w.]+',
+    r'(?i:all rights reserved|copyright|cookies?)',
+    '©', '版權所有', '版权所有', '轉載', '转载', '點擊', '点击', '閱讀全文', '阅读全文',
+    '上一篇', '下一篇', '分享到', '免責聲明', '免责声明', '相關文章', '相关文章', '返回頂部', '返回顶部',
+])
+
+
+@functools.lru_cache(maxsize=1)
+def char_class_table():
+    """回傳以 codepoint 為索引的字元類別查詢表"""
+    table = np.full(0x110000, CHAR_OTHER, dtype=np.uint8)
+    table[script_lookup_table() != OTHER] = CHAR_CJK
+    table[[ord(char) for char in WHITESPACE]] = CHAR_SPACE
+    table[0x00:0x20] = CHAR_CONTROL
+    table[[ord('\t'), ord('\n'), ord('\r')]] = CHAR_SPACE
+    table[0x7F:0xA0] = CHAR_CONTROL
+    table[0xE000:0xF900] = CHAR_MOJIBAKE
+    table[[ord(char) for char in MOJIBAKE_CHARS]] = CHAR_MOJIBAKE
+    return table
+
+
+class TextBatch:
+    """一批待過濾的文字，解碼結果與逐列字元統計只計算一次並由所有條件共用"""
+
+    def __init__(self, text):
+        self.text = text
+        self.codepoints, self.row_index = decode_codepoints(text)
+
+    @functools.cached_property
+    def char_counts(self):
+        return count_categories(self.codepoints, self.row_index, len(self.text), char_class_table(), NUM_CHAR_CLASSES)
+
+    @functools.cached_property
+    def script_counts(self):
+        return count_categories(self.codepoints, self.row_index, len(self.text), script_lookup_table(), 4)
+
+    @functools.cached_property
+    def num_chars(self):
+        return self.char_counts.sum(axis=1)
+
+    @functools.cached_property
+    def num_visible_chars(self):
+        return self.num_chars - self.char_counts[:, CHAR_SPACE]
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, numerator / np.maximum(denominator, 1), 0.0)
+
+
+def min_chars(batch, threshold):
+    """去除空白後的字數"""
+    return batch.num_visible_chars >= threshold
+
+
+def max_garbled_ratio(batch, threshold):
+    """控制字元與亂碼字元（含亂碼序列的每個字）佔全部字元的比例"""
+    garbled = batch.char_counts[:, CHAR_CONTROL] + batch.char_counts[:, CHAR_MOJIBAKE]
+    for sequence in MOJIBAKE_SEQUENCES:
+        occurrences = pc.fill_null(pc.count_substring(batch.text, sequence), 0).to_numpy(zero_copy_only=False)
+        garbled = garbled + len(sequence) * occurrences
+    return _ratio(garbled, batch.num_chars) <= threshold
+
+
+def min_cjk_ratio(batch, threshold):
+    """漢字佔非空白字元的比例"""
+    return _ratio(batch.char_counts[:, CHAR_CJK], batch.num_visible_chars) >= threshold
+
+
+def min_traditional_score(batch, threshold):
+    """繁體專用字佔繁簡專用字的比例，無法判別繁簡的列一律保留（見 hf_pipeline.script）"""
+    scores = traditional_scores(batch.script_counts)
+    return np.isnan(scores) | (scores >= threshold)
+
+
+def repeated_ngram_ratio(batch, n=REPETITION_NGRAM):
+    """
+    每列中重複出現的字元 n-gram 佔全部 n-gram 的比例
+
+    以多項式雜湊計算所有長度為 n 的視窗，排序後相鄰且同列同雜湊者即為重複
+    """
+    num_rows = len(batch.text)
+    num_windows = len(batch.codepoints) - n + 1
+    if num_windows <= 0:
+        return np.zeros(num_rows)
+
+    codepoints = batch.codepoints.astype(np.uint64)
+    hashes = np.zeros(num_windows, dtype=np.uint64)
+    for k in range(n):
+        hashes = hashes * np.uint64(1000003) + codepoints[k:k + num_windows]
+    rows = batch.row_index[:num_windows]
+    # 跨列的視窗不計
+    within_row = rows == batch.row_index[n - 1:]
+    hashes, rows = hashes[within_row], rows[within_row]
+
+    order = np.lexsort((hashes, rows))
+    hashes, rows = hashes[order], rows[order]
+    duplicate = (hashes[1:] == hashes[:-1]) & (rows[1:] == rows[:-1])
+    repeated = np.bincount(rows[1:][duplicate], minlength=num_rows)
+    return _ratio(repeated, np.bincount(rows, minlength=num_rows))
+
+
+def max_repeated_ngram_ratio(batch, threshold):
+    return repeated_ngram_ratio(batch) <= threshold
+
+
+def max_boilerplate_ratio(batch, threshold):
+    """網址、email 與版權宣告、分享按鈕等樣板文字佔全部字元的比例"""
+    lengths = pc.utf8_length(batch.text)
+    stripped = pc.utf8_length(pc.replace_substring_regex(batch.text, BOILERPLATE_PATTERN, ''))
+    removed = pc.subtract(lengths, stripped).to_numpy(zero_copy_only=False)
+    return _ratio(removed, lengths.to_numpy(zero_copy_only=False)) <= threshold
+
+
+# 套用順序：計算成本低的條件在前
+FILTERS = {
+    'min_chars': min_chars,
+    'max_garbled_ratio': max_garbled_ratio,
+    'min_cjk_ratio': min_cjk_ratio,
+    'min_traditional_score': min_traditional_score,
+    'max_repeated_ngram_ratio': max_repeated_ngram_ratio,
+    'max_boilerplate_ratio': max_boilerplate_ratio,
+}
+
+
+def resolve_filters(filters):
+    """None 表示使用 DEFAULT_FILTERS，False 或空 dict 表示不過濾"""
+    if filters is None:
+        return dict(DEFAULT_FILTERS)
+    if not filters:
+        return {}
+    unknown = set(filters) - set(FILTERS)
+    if unknown:
+        raise ValueError(f"Unknown filters: {sorted(unknown)}, please choose from {list(FILTERS)}.")
+    return {name: filters[name] for name in FILTERS if filters.get(name) is not None}
+
+
+class FilterPipeline:
+    """
+    依設定逐批過濾文字並累計各條件的捨棄筆數
+
+    stats 為可直接寫入 JSON 的 dict：{'input_rows': 讀入筆數, 'dropped': {條件名稱: 捨棄筆數}}
+    """
+
+    def __init__(self, filters, stats=None):
+        self.filters = resolve_filters(filters)
+        self.stats = stats or {'input_rows': 0, 'dropped': {name: 0 for name in self.filters}}
+
+    def apply(self, records):
+        """records 為含 text 欄位的 pyarrow.Table，回傳通過所有條件的資料"""
+        self.stats['input_rows'] += records.num_rows
+        if not self.filters or not records.num_rows:
+            return records
+
+        text = records.column('text').combine_chunks()
+        batch = TextBatch(text)
+        keep = np.ones(len(text), dtype=bool)
+        for name, threshold in self.filters.items():
+            passed = FILTERS[name](batch, threshold)
+            self.stats['dropped'][name] += int(np.sum(keep & ~passed))
+            keep &= passed
+        return records.filter(pa.array(keep))
+
+
+def format_stats(stats):
+    """將過濾統計格式化為一行文字"""
+    dropped = sum(stats['dropped'].values())
+    details = '、'.join(f"{name} {count}" for name, count in stats['dropped'].items() if count)
+    return f"過濾 {dropped}/{stats['input_rows']} 筆" + (f"（{details}）" if details else "")
@@ -0,0 +1,115 @@
+"""
+巢狀與對話格式欄位攤平
+
+將 list / struct 中的字串轉為 {id, text} 的 text 欄位，全部以 Arrow list / struct kernel 完成，
+不需要逐列執行 Python，對話資料集的數百萬輪對話也能以接近磁碟讀寫的速度匯出。
+
+支援三種模式：
+- explode: 每個字串各成一筆，例如 messages[].content 的每一輪對話
+- join: 同一列中的所有字串以 separator 串接成一筆，例如將整段對話合併為一篇文本
+- template: 以格式字串組合 struct 中的多個欄位後再串接，例如
+  field_name='messages[]', template='{role}：{content}'；
+  field_name='*' 表示整列，例如 template='問：{question}\\n答：{answer}'
+"""
+import string
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from hf_pipeline.fields import field_values
+
+
+FLATTEN_MODES = ('explode', 'join', 'template')
+ROW_PATH = '*'
+
+
+def _to_string(values):
+    if values.type != pa.string():
+        values = pc.cast(values, pa.string())
+    return values
+
+
+def join_by_row(values, row_index, separator):
+    """
+    將屬於同一列的字串以 separator 串接
+
+    row_index 需為遞增排序（field_values 的結果即符合），回傳 (串接後的字串, 對應的列編號)
+    """
+    index = row_index.to_numpy(zero_copy_only=False)
+    rows, starts = np.unique(index, return_index=True)
+    offsets = pa.array(np.append(starts, len(index)).astype(np.int32))
+    lists = pa.ListArray.from_arrays(offsets, _to_string(values))
+    return pc.binary_join(lists, separator), pa.array(rows, type=pa.int64())
+
+
+def _template_field(values, name):
+    for part in name.split('.'):
+        values = pc.struct_field(values, part)
+    return pc.fill_null(_to_string(values), '')
+
+
+def parse_template(template):
+    """
+    解析格式字串為 [(字面文字, 欄位名稱或 None)]
+
+    欄位以 Arrow kernel 整欄組合，無法套用格式規格或轉換（如 {x:>10}、{x!r}），
+    也不支援位置參數 {}；遇到這些寫法時拋出 ValueError，而不是靜默忽略
+    """
+    parts = []
+    for literal, name, spec, conversion in string.Formatter().parse(template):
+        if name is not None:
+            if not name or name.isdigit():
+                raise ValueError(f"Template fields must be named, e.g. '{{role}}：{{content}}', got {template!r}.")
+            if spec or conversion:
+                raise ValueError(f"Template field {{{name}}} has a format spec or conversion, which is not "
+                                 f"supported: {template!r}.")
+        parts.append((literal, name))
+    return parts
+
+
+def render_template(values, template):
+    """對 struct 陣列逐元素套用格式字串，例如 '{role}：{content}'"""
+    parts = []
+    for literal, name in parse_template(template):
+        if literal:
+            parts.append(pa.scalar(literal))
+        if name is not None:
+            parts.append(_template_field(values, name))
+    # binary_join_element_wise 的最後一個參數是分隔符號
+    return pc.binary_join_element_wise(*parts, '')
+
+
+def _row_struct(table):
+    columns = [column.combine_chunks() for column in table.columns]
+    values = pa.StructArray.from_arrays(columns, names=table.column_names)
+    return values, pa.array(np.arange(table.num_rows, dtype=np.int64))
+
+
+def flatten_field(table, field_name, mode='explode', separator='\n', template=None):
+    """
+    依模式將欄位攤平為字串
+
+    回傳 (text, row_index)：text 為不含空值的 string 陣列，row_index 為每筆文字來自 table 的第幾列
+    """
+    if mode not in FLATTEN_MODES:
+        raise ValueError(f"Invalid flatten mode: {mode}, please choose from {list(FLATTEN_MODES)}.")
+
+    if mode == 'template':
+        if template is None:
+            raise ValueError("template mode requires a template, e.g. '{role}：{content}'.")
+        if field_name == ROW_PATH:
+            values, row_index = _row_struct(table)
+        else:
+            values, row_index = field_values(table, field_name)
+        return join_by_row(render_template(values, template), row_index, separator)
+
+    values, row_index = field_values(table, field_name)
+    if mode == 'join':
+        return join_by_row(values, row_index, separator)
+    return _to_string(values), row_index
+
+
+def template_columns(template):
+    """template 中引用的頂層欄位名稱"""
+    return [name.split('.')[0] for _, name in parse_template(template) if name]
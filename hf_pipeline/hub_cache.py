@@ -0,0 +1,95 @@
+"""
+Hugging Face hub metadata 磁碟快取
+
+以 (資料集 id, revision) 為單位，將 config 名稱、split 筆數與 features 存成 JSON，
+重複分析同一資料集或 Inspector 修正迴圈重跑時，不需要再向 hub 查詢 metadata。
+每筆資料超過 TTL 後失效；離線模式（HF_HUB_OFFLINE / HF_DATASETS_OFFLINE）下
+即使過期也會使用，讓本機 hub mirror 或 HF 快取目錄中的資料集可以完全離線分析。
+快取格式版本（CACHE_VERSION）不同的資料一律視為不存在。
+"""
+import json
+import os
+import threading
+import time
+
+from hf_pipeline.shards import write_json_atomic
+
+
+DEFAULT_CACHE_DIR = os.environ.get('LAMBDA_HF_METADATA_CACHE', os.path.join('cache', 'hf_metadata'))
+DEFAULT_TTL = 24 * 60 * 60
+# 快取內容的格式版本，格式改變時遞增，舊版本的資料視為不存在
+CACHE_VERSION = 2
+
+
+def is_offline():
+    """是否處於 HF 離線模式"""
+    for name in ('HF_HUB_OFFLINE', 'HF_DATASETS_OFFLINE'):
+        if os.environ.get(name, '').upper() in ('1', 'ON', 'YES', 'TRUE'):
+            return True
+    return False
+
+
+class MetadataCache:
+    """
+    參數：
+    - cache_dir: 快取目錄
+    - ttl: 每筆資料的有效秒數，None 表示永不過期
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, dataset_name, revision):
+        if os.path.isdir(dataset_name):
+            dataset_name = os.path.abspath(dataset_name)
+        safe_dataset_name = dataset_name.strip('/').replace('/', '_').replace('\\', '_')
+        return os.path.join(self.cache_dir, f"{safe_dataset_name}@{revision or 'main'}.json")
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _expired(self, entry, now):
+        if entry.get('version') != CACHE_VERSION:
+            return True
+        return self.ttl is not None and now - entry['cached_at'] > self.ttl and not is_offline()
+
+    def get(self, dataset_name, revision, key):
+        """讀取快取值，不存在或已過期時回傳 None"""
+        entry = self._read(self._path(dataset_name, revision)).get(key)
+        if entry is None or self._expired(entry, time.time()):
+            return None
+        return entry['value']
+
+    def set(self, dataset_name, revision, key, value):
+        path = self._path(dataset_name, revision)
+        with self._lock:
+            # 重新讀取後再合併，避免覆蓋其他 thread 剛寫入的 key
+            entries = self._read(path)
+            entries[key] = {'value': value, 'cached_at': time.time(), 'version': CACHE_VERSION}
+            write_json_atomic(path, entries)
+
+    def evict_expired(self):
+        """刪除過期或舊版本的資料，整個檔案都過期時刪除檔案；離線模式下不做任何事"""
+        if is_offline():
+            return
+        now = time.time()
+        with self._lock:
+            for filename in os.listdir(self.cache_dir):
+                if not filename.endswith('.json'):
+                    continue
+                path = os.path.join(self.cache_dir, filename)
+                entries = self._read(path)
+                alive = {key: entry for key, entry in entries.items() if not self._expired(entry, now)}
+                if not alive:
+                    os.remove(path)
+                elif len(alive) != len(entries):
+                    write_json_atomic(path, alive)
@@ -0,0 +1,65 @@
+"""
+穩定且全域唯一的列 id
+
+id 由資料來源與來源位置編碼而成，與匯出順序、過濾或去重的結果無關：
+    id = hash64(來源, 來源列編號, 列內序號) 的低 63 位元
+- 來源：資料集、revision、subset、split、欄位與攤平模式組成的字串，例如
+  username/dataset/default/train@main#messages[].content
+- 來源列編號（source_row）：該筆資料在 split 中的列編號
+- 列內序號（source_part）：explode 模式下同一列的第幾個字串，其餘模式為 0
+因此不同資料集、不同欄位匯出的資料合併後 id 不會重複，重新匯出時相同位置的資料 id 不變。
+若 revision 為 None，來源會記為 main，main 更新後相同位置可能是不同內容，需要可重現時請指定 commit sha。
+"""
+import hashlib
+
+import numpy as np
+
+
+def mix64(x):
+    """splitmix64 的最後混合步驟，讓 uint64 雜湊的位元分布均勻"""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def source_key(dataset_name, field_name, config_name=None, split="train", revision=None, flatten_mode='explode'):
+    """資料來源的字串表示，寫入每筆資料的 source 欄位"""
+    key = f"{dataset_name}/{config_name or 'default'}/{split}@{revision or 'main'}#{field_name}"
+    if flatten_mode != 'explode':
+        key += f":{flatten_mode}"
+    return key
+
+
+def parse_source_key(key):
+    """
+    將 source_key 的結果拆回 dict（dataset_name、config_name、split、revision、field_name、flatten_mode），
+    無法解析的字串（如沒有來源資訊的舊檔案）回傳 None
+    """
+    location, sep, field_name = key.partition('#')
+    path, at, revision = location.rpartition('@')
+    parts = path.rsplit('/', 2)
+    if not sep or not at or len(parts) < 3:
+        return None
+    flatten_mode = 'explode'
+    head, colon, mode = field_name.rpartition(':')
+    if colon and mode in ('join', 'template'):
+        field_name, flatten_mode = head, mode
+    return {
+        'dataset_name': parts[0],
+        'config_name': None if parts[1] == 'default' else parts[1],
+        'split': parts[2],
+        'revision': revision,
+        'field_name': field_name,
+        'flatten_mode': flatten_mode,
+    }
+
+
+def stable_ids(source, source_row, source_part):
+    """依來源與來源位置計算 int64 id（非負），source_row / source_part 為 numpy 或 Arrow 整數陣列"""
+    seed = np.uint64(int.from_bytes(hashlib.blake2b(source.encode('utf-8'), digest_size=8).digest(), 'little'))
+    rows = np.asarray(source_row, dtype=np.int64).astype(np.uint64)
+    parts = np.asarray(source_part, dtype=np.int64).astype(np.uint64)
+    ids = mix64(mix64(seed ^ rows) ^ parts)
+    return (ids >> np.uint64(1)).astype(np.int64)
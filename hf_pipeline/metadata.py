@@ -0,0 +1,339 @@
+"""
+Hugging Face 資料集 subset / split 探測
+
+以有上限的 thread pool 同時探測所有 subset，每個 subset 只讀取一次：
+從 builder 資訊取得 split 名稱、筆數與 parquet 資料檔（原始資料不是 parquet 時使用 hub 自動轉換的 parquet 檔），再抽出 num_samples 筆作為樣本（抽樣方式見 hf_pipeline.sampling，
+預設依資料檔分層抽樣，只讀取少數幾個 row group）。
+回傳 subset → split → 筆數 的完整對照表與各 subset 的樣本，呼叫端不需要再載入第二次。
+config 名稱、split 筆數、features、資料檔清單與各 row group 的筆數會存入 MetadataCache，
+重複分析時略過 metadata 查詢與 footer 讀取。
+"""
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import numpy as np
+import pyarrow as pa
+
+from hf_pipeline.hub_cache import MetadataCache, is_offline
+from hf_pipeline.sampling import (DEFAULT_SAMPLING, DEFAULT_SCAN_FACTOR, check_sampling, read_row_group_rows,
+                                  reservoir_parquet_sample, reservoir_sample, stratified_parquet_sample)
+
+
+DEFAULT_MAX_WORKERS = 8
+PARQUET_CONVERSION_REVISION = 'refs/convert/parquet'
+
+
+def _hub_kwargs(token, revision=None):
+    kwargs = {}
+    if token:
+        kwargs['token'] = token
+    if revision:
+        kwargs['revision'] = revision
+    return kwargs
+
+
+def parquet_conversion_files(dataset_name, config_name=None, token=None):
+    """
+    hub 自動轉換的 parquet 資料檔（refs/convert/parquet 分支），回傳 {split: [hf:// 路徑]}，沒有轉換結果時回傳 None
+
+    轉換結果保留 split 原本的列順序，只對應 main 的最新版本；
+    split 超過大小上限時 hub 只轉換前段（目錄名稱為 partial-{split}），這種 split 不會回傳
+    """
+    if os.path.isdir(dataset_name) or is_offline():
+        return None
+    try:
+        from huggingface_hub import HfApi
+
+        entries = HfApi(token=token).list_repo_tree(dataset_name, path_in_repo=config_name or 'default',
+                                                    repo_type='dataset', revision=PARQUET_CONVERSION_REVISION,
+                                                    recursive=True)
+        paths = sorted(entry.path for entry in entries if entry.path.endswith('.parquet'))
+    except Exception:
+        return None
+    data_files = {}
+    revision = quote(PARQUET_CONVERSION_REVISION, safe='')
+    for path in paths:
+        # {config}/{split}/0000.parquet
+        parts = path.split('/')
+        if len(parts) == 3 and not parts[1].startswith('partial-'):
+            data_files.setdefault(parts[1], []).append(f"hf://datasets/{dataset_name}@{revision}/{path}")
+    return data_files or None
+
+
+def get_split_rows(dataset_name, config_name=None, token=None, revision=None):
+    """
+    回傳 ({split: 筆數}, features, {split: parquet 資料檔})，builder 資訊中沒有筆數的 split 記為 None；
+    資料檔不是 parquet（例如 json、csv 或以 script 載入的資料集）時改用 hub 自動轉換的 parquet 檔（只限 main），
+    兩者都沒有時第三個值為 None
+    """
+    from datasets import get_dataset_split_names, load_dataset_builder
+
+    builder = load_dataset_builder(dataset_name, config_name, **_hub_kwargs(token, revision))
+    if builder.info.splits:
+        splits = {name: info.num_examples for name, info in builder.info.splits.items()}
+    else:
+        split_names = get_dataset_split_names(dataset_name, config_name, **_hub_kwargs(token, revision))
+        splits = {name: None for name in split_names}
+
+    data_files = getattr(builder.config, 'data_files', None)
+    if builder.name == 'parquet' and data_files:
+        data_files = {str(name): [str(path) for path in files] for name, files in data_files.items()}
+    elif revision is None:
+        data_files = parquet_conversion_files(dataset_name, builder.config.name, token)
+    else:
+        data_files = None
+    return splits, builder.info.features, data_files
+
+
+def source_parquet_files(dataset_name, config_name=None, split="train", token=None, revision=None):
+    """
+    原始資料為 parquet 時回傳 split 的資料檔（與 streaming 的讀取順序相同），其他格式回傳 None
+
+    與 get_split_rows 不同，不會改用 hub 自動轉換的 parquet 檔：轉換結果的內容與原始資料未必逐列相同
+    """
+    from datasets import load_dataset_builder
+
+    builder = load_dataset_builder(dataset_name, config_name, **_hub_kwargs(token, revision))
+    data_files = getattr(builder.config, 'data_files', None)
+    if builder.name != 'parquet' or not data_files:
+        return None
+    for name, files in data_files.items():
+        if str(name) == split:
+            return [str(path) for path in files] or None
+    return None
+
+
+def get_split_info(dataset_name, config_name=None, token=None, revision=None, cache=None):
+    """
+    與 get_split_rows 相同，優先使用 MetadataCache 中的結果
+
+    參數 cache 為 MetadataCache，None 時使用預設快取目錄；不想使用快取時傳入 False。
+    """
+    from datasets import Features
+
+    if cache is None:
+        cache = MetadataCache()
+    elif cache is False:
+        cache = None
+    cache_key = f"config:{config_name}"
+    cached = cache.get(dataset_name, revision, cache_key) if cache is not None else None
+    if cached is not None:
+        features = Features.from_dict(cached['features']) if cached['features'] else None
+        return cached['splits'], features, cached['data_files']
+
+    splits, features, data_files = get_split_rows(dataset_name, config_name, token, revision)
+    if cache is not None:
+        cache.set(dataset_name, revision, cache_key, {
+            'splits': splits,
+            'features': features.to_dict() if features else None,
+            'data_files': data_files,
+        })
+    return splits, features, data_files
+
+
+def get_row_group_rows(dataset_name, config_name, split, data_files, token=None, revision=None, cache=None):
+    """
+    split 的各 parquet 資料檔中每個 row group 的筆數（hf_pipeline.sampling.read_row_group_rows 的結果），
+    優先使用 MetadataCache 中的結果，同一資料集重複抽樣時不需要再讀取所有 footer；參數 cache 與 get_split_info 相同
+    """
+    if cache is None:
+        cache = MetadataCache()
+    elif cache is False:
+        cache = None
+    cache_key = f"row_groups:{config_name}:{split}"
+    cached = cache.get(dataset_name, revision, cache_key) if cache is not None else None
+    if cached is not None and cached['files'] == list(data_files):
+        return [np.array(rows, dtype=np.int64) for rows in cached['rows']]
+
+    group_rows = read_row_group_rows(data_files, token)
+    if cache is not None:
+        cache.set(dataset_name, revision, cache_key, {'files': list(data_files),
+                                                      'rows': [rows.tolist() for rows in group_rows]})
+    return group_rows
+
+
+def load_sample(dataset_name, config_name=None, split="train", num_samples=100, token=None, revision=None,
+                columns=None):
+    """
+    以 streaming 模式取出前 num_samples 筆並直接回傳 pyarrow.Table，不會下載整個 split 或轉為 Python 物件；
+    columns 為要讀取的欄位，None 表示全部
+    """
+    from datasets import load_dataset
+
+    streaming = load_dataset(dataset_name, config_name, split=split, streaming=True,
+                             **_hub_kwargs(token, revision))
+    if columns is not None:
+        streaming = streaming.select_columns(columns)
+    batches = streaming.take(num_samples).with_format("arrow").iter(batch_size=num_samples)
+    table = next(iter(batches), None)
+    if table is None:
+        return pa.schema([]).empty_table()
+    return table.combine_chunks()
+
+
+def sample_split(dataset_name, config_name=None, split="train", num_samples=100, token=None, revision=None,
+                 sampling=DEFAULT_SAMPLING, data_files=None, seed=0, columns=None, cache=None):
+    """
+    依 sampling 抽出 num_samples 筆樣本，回傳 (pyarrow.Table, 每筆樣本在 split 中的列編號)
+
+    - 'stratified': 依資料檔分層抽樣
+    - 'reservoir': 從整個 split 隨機選出 row group，在其中均勻抽樣
+    - 'head': split 的前 num_samples 筆
+    前兩種方式需要 data_files（split 的 parquet 資料檔），沒有時只能從串流的前 num_samples * DEFAULT_SCAN_FACTOR 筆中均勻抽樣。
+    columns 為要讀取的欄位（例如只需要匯出欄位時為 hf_pipeline.export.source_columns 的結果），None 表示全部；
+    各 row group 的筆數來自 get_row_group_rows，參數 cache 與 get_split_info 相同
+    """
+    from datasets import load_dataset
+
+    check_sampling(sampling)
+
+    table = None
+    if sampling == 'head':
+        table = load_sample(dataset_name, config_name, split, num_samples, token, revision, columns)
+        rows = np.arange(table.num_rows, dtype=np.int64)
+    elif data_files:
+        sampler = stratified_parquet_sample if sampling == 'stratified' else reservoir_parquet_sample
+        group_rows = get_row_group_rows(dataset_name, config_name, split, data_files, token, revision, cache)
+        table, rows = sampler(data_files, num_samples, token=token, seed=seed, columns=columns, group_rows=group_rows)
+    else:
+        print(f"⚠ split '{split}' 沒有 parquet 資料檔，只能從串流的前 {num_samples * DEFAULT_SCAN_FACTOR} 筆抽樣")
+        streaming = load_dataset(dataset_name, config_name, split=split, streaming=True,
+                                 **_hub_kwargs(token, revision))
+        if columns is not None:
+            streaming = streaming.select_columns(columns)
+        batches = streaming.take(num_samples * DEFAULT_SCAN_FACTOR).with_format("arrow").iter(batch_size=num_samples)
+        table, rows = reservoir_sample(batches, num_samples, seed=seed)
+    if table is None:
+        return pa.schema([]).empty_table(), np.zeros(0, dtype=np.int64)
+    return table.combine_chunks(), rows
+
+
+def probe_config(dataset_name, config_name=None, split="train", num_samples=100, token=None, revision=None,
+                 cache=None, sampling=DEFAULT_SAMPLING):
+    """
+    探測單一 subset
+
+    回傳 dict：
+    - splits: {split: 筆數}
+    - split: 實際選用的 split（指定的 split 不存在時改用第一個可用的 split）
+    - features: 資料集 features（datasets.Features），無法取得時為 None
+    - sample: 該 split 的 num_samples 筆樣本（pyarrow.Table，依 sampling 抽樣），為空或失敗時為 None
+    - rows: 每筆樣本在 split 中的列編號（numpy 陣列），失敗時為 None
+    - error: 失敗原因，成功時為 None
+    """
+    from datasets import Features
+
+    result = {'splits': {}, 'split': None, 'features': None, 'sample': None, 'rows': None, 'error': None}
+    try:
+        splits, features, data_files = get_split_info(dataset_name, config_name, token, revision,
+                                                      cache if cache is not None else False)
+        result['splits'] = splits
+        if not splits:
+            result['error'] = "沒有可用的 split"
+            return result
+
+        target_split = split if split in splits else next(iter(splits))
+        result['split'] = target_split
+        sample, rows = sample_split(dataset_name, config_name, target_split, num_samples, token, revision,
+                                    sampling=sampling, data_files=(data_files or {}).get(target_split),
+                                    cache=cache if cache is not None else False)
+        result['features'] = features or Features.from_arrow_schema(sample.schema)
+        if sample.num_rows == 0:
+            result['error'] = f"split '{target_split}' 為空"
+        else:
+            result['sample'] = sample
+            result['rows'] = rows
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def get_config_names(dataset_name, token=None, revision=None, cache=None):
+    """取得 config 名稱，優先使用快取"""
+    from datasets import get_dataset_config_names
+
+    config_names = cache.get(dataset_name, revision, 'config_names') if cache is not None else None
+    if config_names is None:
+        config_names = get_dataset_config_names(dataset_name, **_hub_kwargs(token, revision))
+        if cache is not None:
+            cache.set(dataset_name, revision, 'config_names', config_names)
+    return config_names
+
+
+def resolve_revision(dataset_name, revision=None, token=None, cache=None):
+    """
+    將 revision（None 表示 main、branch 或 tag）換算為 commit sha，作為 catalog 的 key
+
+    本機目錄、離線或查詢失敗時回傳原本的 revision；參數 cache 與 probe_dataset 相同，
+    sha 與其他 metadata 一樣依 TTL 快取，main 更新後最晚在快取過期時換成新的 sha。
+    """
+    if os.path.isdir(dataset_name) or (revision and re.fullmatch(r'[0-9a-f]{40}', revision)):
+        return revision
+    if cache is None:
+        cache = MetadataCache()
+    elif cache is False:
+        cache = None
+
+    sha = cache.get(dataset_name, revision, 'sha') if cache is not None else None
+    if sha is None and not is_offline():
+        try:
+            from huggingface_hub import HfApi
+
+            sha = HfApi(token=token).dataset_info(dataset_name, revision=revision).sha
+        except Exception:
+            return revision
+        if cache is not None and sha:
+            cache.set(dataset_name, revision, 'sha', sha)
+    return sha or revision
+
+
+def probe_dataset(dataset_name, split="train", num_samples=100, token=None, max_workers=DEFAULT_MAX_WORKERS,
+                  revision=None, cache=None, sampling=DEFAULT_SAMPLING):
+    """
+    同時探測資料集的所有 subset
+
+    參數 cache 為 MetadataCache，None 時使用預設快取目錄；不想使用快取時傳入 False。
+    參數 sampling 為抽樣方式（'stratified' / 'reservoir' / 'head'，見 sample_split）。
+
+    回傳 dict：
+    - subsets: {subset: probe_config 的結果}，沒有 subset 的資料集以 None 為 key
+    - selected: 依 subset 原始順序，第一個有資料的 subset，找不到時為 None
+    """
+    check_sampling(sampling)
+    if cache is None:
+        cache = MetadataCache()
+        cache.evict_expired()
+    elif cache is False:
+        cache = None
+
+    try:
+        config_names = get_config_names(dataset_name, token, revision, cache)
+    except Exception as e:
+        # 無法獲取 config 資訊，可能是簡單資料集，直接以沒有 subset 的方式探測
+        print(f"無法獲取 config 資訊，嘗試直接載入: {e}")
+        config_names = []
+    if not config_names:
+        config_names = [None]
+    else:
+        print(f"找到 {len(config_names)} 個 subset: {config_names}")
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(config_names))) as pool:
+        futures = {
+            config: pool.submit(probe_config, dataset_name, config, split, num_samples, token, revision, cache,
+                                sampling)
+            for config in config_names
+        }
+        subsets = {config: future.result() for config, future in futures.items()}
+
+    selected = None
+    for config, result in subsets.items():
+        if result['error']:
+            print(f"  subset '{config}' 無法使用: {result['error']}")
+            continue
+        print(f"  subset '{config}' 可用的 split: {result['splits']}")
+        if selected is None:
+            selected = config
+
+    return {'subsets': subsets, 'selected': selected}
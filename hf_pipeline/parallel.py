@@ -0,0 +1,470 @@
+"""
+多行程匯出
+
+export_field 在 Jupyter kernel 的單一行程中執行，讀取、攤平、過濾與 parquet 編碼只能用到一個核心。
+parallel_export_field 依來源資料檔切分 partition，每個 partition 只讀取自己的資料（見 plan_partitions）。
+各 worker 行程獨立讀取、攤平、過濾、計算 token 數（指定 tokenizer 時）與去重簽章，
+並直接以最終的編碼寫出分片至 _partitions/；主行程只依 partition 順序比對簽章決定要捨棄的重複列，
+需要捨棄列（或來源列編號事先未知）的 partition 再由 worker 重寫，最後將分片依序改名移入匯出目錄。
+輸出的資料、順序與 id 都與單行程匯出相同，只是每個 partition 各自切換分片，分片的切分位置不同。
+
+已完成的 partition 會留下 _done.json，中斷後重新執行只需處理未完成的 partition。
+start_export_job 以獨立的背景行程執行整個流程，notebook 不需等待匯出結束，
+進度記錄在匯出目錄的 _job_state.json，可用 export_job_status 查詢。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import subprocess
+import multiprocessing
+import concurrent.futures
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from hf_pipeline.catalog import Catalog
+from hf_pipeline.checkpoint import ExportCheckpoint, check_source, same_source_exports
+from hf_pipeline.dedup import DEFAULT_NUM_PROC, Deduplicator, clear_segments, compute_signatures
+from hf_pipeline.encoding import writer_options
+from hf_pipeline.export import (
+    DEFAULT_BATCH_SIZE,
+    export_params,
+    extract_records,
+    iter_field_batches,
+    open_streaming_split,
+    output_schema,
+    source_columns,
+    to_cp_table,
+    write_manifest,
+)
+from hf_pipeline.ids import source_key
+from hf_pipeline.filters import FilterPipeline
+from hf_pipeline.metadata import source_parquet_files
+from hf_pipeline.sampling import open_parquet, read_row_group_rows
+from hf_pipeline.tokens import TOKEN_COLUMN, TokenCounter
+from hf_pipeline.shards import (
+    DEFAULT_MAX_BYTES_PER_SHARD,
+    DEFAULT_MAX_ROWS_PER_SHARD,
+    DEFAULT_ROW_GROUP_SIZE,
+    ShardedParquetWriter,
+    clear_shards,
+    read_manifest,
+    shard_filename,
+    write_json_atomic,
+)
+
+
+PARTITIONS_DIR = '_partitions'
+PARTITION_DONE_NAME = '_done.json'
+PARTITION_KEEP_NAME = '_keep.npy'
+PARTITION_FINAL_DIR = 'final'
+# worker 逐批附加寫出的去重簽章：exact 為每列一個 uint64，lsh 為每列 bands 個 uint64
+SIGNATURE_FILES = {'exact': '_exact.u64', 'lsh': '_lsh.u64', 'has_signature': '_has_signature.bool'}
+JOB_SPEC_NAME = '_job.json'
+JOB_STATE_NAME = '_job_state.json'
+JOB_LOG_NAME = '_job.log'
+
+
+def plan_partitions(params, num_workers, token=None):
+    """
+    依來源資料檔切分 partition，各 partition 合計的讀取量與單行程讀取整個 split 相同
+
+    - 原始資料為 parquet：讀取各檔案的 footer，將每個檔案連續的 row group 切成約 筆數 / num_workers 筆的 partition，
+      partition 開頭的來源列編號（start）事先已知
+    - 其他格式有多個資料檔（source shard）：每個資料檔為一個 partition，開頭的來源列編號要等前面的 partition 完成才知道
+    - 只有一個非 parquet 資料檔：無法切分，整個 split 為一個 partition
+    params 需有 dataset_name、config_name、split、revision
+    """
+    files = source_parquet_files(params['dataset_name'], params['config_name'], params['split'], token,
+                                 params['revision'])
+    if files:
+        partitions = _row_group_partitions(files, read_row_group_rows(files, token), num_workers)
+        if partitions:
+            return partitions
+    dataset = open_streaming_split(params['dataset_name'], params['config_name'], params['split'], token,
+                                   params['revision'])
+    if dataset.n_shards > 1:
+        return [{'shard': i, 'num_shards': dataset.n_shards} for i in range(dataset.n_shards)]
+    return [{}]
+
+
+def _row_group_partitions(files, group_rows, num_workers):
+    target = max(1, -(-sum(int(rows.sum()) for rows in group_rows) // max(1, num_workers)))
+    partitions = []
+    start = 0
+    for path, rows in zip(files, group_rows):
+        first = 0
+        num_rows = 0
+        for i, count in enumerate(rows):
+            num_rows += int(count)
+            if num_rows >= target or i == len(rows) - 1:
+                partitions.append({'file': path, 'row_groups': [first, i + 1], 'start': start, 'num_rows': num_rows})
+                start += num_rows
+                first = i + 1
+                num_rows = 0
+    return partitions
+
+
+def iter_partition_batches(params, partition, batch_size=DEFAULT_BATCH_SIZE, token=None):
+    """逐批讀取 partition 中欄位所在的頂層欄位，每批回傳一個 pyarrow.Table"""
+    if 'file' in partition:
+        # parquet 直接讀取指定的 row group，不需要略過前面的資料
+        columns = source_columns(params['field_name'], params['template'])
+        with open_parquet(partition['file'], token) as parquet_file:
+            for batch in parquet_file.iter_batches(batch_size=batch_size, row_groups=range(*partition['row_groups']),
+                                                   columns=columns):
+                yield pa.Table.from_batches([batch])
+        return
+
+    dataset = open_streaming_split(params['dataset_name'], params['config_name'], params['split'], token,
+                                   params['revision'])
+    if 'shard' in partition:
+        from datasets.distributed import split_dataset_by_node
+
+        # world_size 等於資料檔數時，每個 rank 只讀取第 rank 個資料檔
+        dataset = split_dataset_by_node(dataset, rank=partition['shard'], world_size=partition['num_shards'])
+    yield from iter_field_batches(dataset, params['field_name'], batch_size, params['template'])
+
+
+def _partition_dir(output_dir, index):
+    return os.path.join(output_dir, PARTITIONS_DIR, f"p-{index:05d}")
+
+
+def _partition_writer(params, output_dir):
+    schema = output_schema(params['tokenizer'])
+    return ShardedParquetWriter(output_dir, schema, max_rows_per_shard=params['max_rows_per_shard'],
+                                max_bytes_per_shard=params['max_bytes_per_shard'],
+                                row_group_size=params['row_group_size'],
+                                total_columns=[TOKEN_COLUMN] if params['tokenizer'] else [],
+                                parquet_options=writer_options(params['encoding'], schema))
+
+
+def _append_signatures(partition_dir, signatures):
+    for name, array in zip(SIGNATURE_FILES.values(), signatures):
+        with open(os.path.join(partition_dir, name), 'ab') as f:
+            np.ascontiguousarray(array).tofile(f)
+
+
+def _read_signatures(partition_dir, num_rows):
+    """以 memory map 讀取 worker 寫出的簽章，回傳 (exact, lsh, has_signature)，num_rows 需大於 0"""
+    def load(name, dtype):
+        path = os.path.join(partition_dir, SIGNATURE_FILES[name])
+        return np.memmap(path, dtype=dtype, mode='r') if os.path.getsize(path) else np.zeros(0, dtype=dtype)
+
+    # 不使用 MinHash 時 lsh 為每列 0 個 key
+    lsh = load('lsh', np.uint64)
+    return load('exact', np.uint64), lsh.reshape(num_rows, len(lsh) // num_rows), load('has_signature', bool)
+
+
+def _partition_complete(done, partition_dir, dedup):
+    names = [shard['file'] for shard in done['shards']] + (list(SIGNATURE_FILES.values()) if dedup else [])
+    return all(os.path.exists(os.path.join(partition_dir, name)) for name in names)
+
+
+def export_partition(params, partition, partition_dir, batch_size=DEFAULT_BATCH_SIZE, token=None):
+    """
+    worker：讀取一個 partition，攤平、過濾後以最終的編碼寫出分片，去重時另外寫出每筆資料的簽章
+
+    source_row 與 id 以 partition 的 start 為開頭的來源列編號計算（沒有 start 時為 0，合併時再修正）
+
+    已完成且參數相同的 partition 直接回傳先前的結果
+    """
+    done_path = os.path.join(partition_dir, PARTITION_DONE_NAME)
+    if os.path.exists(done_path):
+        with open(done_path, 'r', encoding='utf-8') as f:
+            done = json.load(f)
+        if done['params'] == params and done['partition'] == partition and \
+                _partition_complete(done, partition_dir, params['dedup']):
+            return done
+    shutil.rmtree(partition_dir, ignore_errors=True)
+    os.makedirs(partition_dir)
+
+    pipeline = FilterPipeline(params['filters'])
+    # 已在 worker 行程中，token 數與簽章直接在目前的行程計算
+    counter = TokenCounter(params['tokenizer'], num_proc=1) if params['tokenizer'] else None
+    writer = _partition_writer(params, partition_dir)
+    source = source_key(params['dataset_name'], params['field_name'], params['config_name'], params['split'],
+                        params['revision'], params['flatten_mode'])
+    if params['dedup']:
+        _append_signatures(partition_dir, [np.zeros(0, dtype=np.uint64)] * 2 + [np.zeros(0, dtype=bool)])
+    start = partition.get('start', 0)
+    num_rows = 0
+    source_rows = 0
+    try:
+        for table in iter_partition_batches(params, partition, batch_size, token):
+            records = extract_records(table, params['field_name'], params['flatten_mode'], params['separator'],
+                                      params['template'], row_offset=start + source_rows)
+            source_rows += table.num_rows
+            records = pipeline.apply(records)
+            if records.num_rows:
+                if params['dedup']:
+                    _append_signatures(partition_dir,
+                                       compute_signatures(records.column('text').combine_chunks(), params['dedup']))
+                if counter is not None:
+                    records = counter.apply(records)
+                writer.write_table(to_cp_table(records, source))
+                num_rows += records.num_rows
+    except BaseException:
+        writer.abort()
+        raise
+
+    done = {
+        'params': params,
+        'partition': partition,
+        'num_rows': num_rows,
+        'source_rows': source_rows,
+        'shards': writer.close(),
+        'filter_stats': pipeline.stats,
+    }
+    write_json_atomic(done_path, done)
+    return done
+
+
+def finalize_partition(params, partition_dir, shards, row_shift=0, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    worker：捨棄合併時判定為重複的列（partition_dir/_keep.npy）並將來源列編號加上 row_shift，
+    重新計算 id 後寫出至 partition_dir/final，回傳新的分片資訊
+    """
+    keep_path = os.path.join(partition_dir, PARTITION_KEEP_NAME)
+    keep = np.load(keep_path) if os.path.exists(keep_path) else None
+    final_dir = os.path.join(partition_dir, PARTITION_FINAL_DIR)
+    shutil.rmtree(final_dir, ignore_errors=True)
+    writer = _partition_writer(params, final_dir)
+    columns = ['text', 'source_row', 'source_part'] + ([TOKEN_COLUMN] if params['tokenizer'] else [])
+    source = source_key(params['dataset_name'], params['field_name'], params['config_name'], params['split'],
+                        params['revision'], params['flatten_mode'])
+    offset = 0
+    try:
+        for shard in shards:
+            parquet_file = pq.ParquetFile(os.path.join(partition_dir, shard['file']))
+            for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+                records = pa.Table.from_batches([batch])
+                if keep is not None:
+                    records = records.filter(pa.array(keep[offset:offset + batch.num_rows]))
+                offset += batch.num_rows
+                if row_shift:
+                    records = records.set_column(1, 'source_row', pc.add(records.column('source_row'), row_shift))
+                writer.write_table(to_cp_table(records, source))
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close()
+
+
+def _merge_stats(results):
+    stats = {'input_rows': 0, 'dropped': {}}
+    for result in results:
+        stats['input_rows'] += result['filter_stats']['input_rows']
+        for name, count in result['filter_stats']['dropped'].items():
+            stats['dropped'][name] = stats['dropped'].get(name, 0) + count
+    return stats
+
+
+def _write_state(output_dir, **state):
+    path = os.path.join(output_dir, JOB_STATE_NAME)
+    previous = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    previous.update(state, updated_at=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    write_json_atomic(path, previous)
+
+
+def parallel_export_field(dataset_name, field_name, output_dir, config_name=None, split="train",
+                          batch_size=DEFAULT_BATCH_SIZE, token=None,
+                          max_rows_per_shard=DEFAULT_MAX_ROWS_PER_SHARD,
+                          max_bytes_per_shard=DEFAULT_MAX_BYTES_PER_SHARD,
+                          row_group_size=DEFAULT_ROW_GROUP_SIZE, resume=True, revision=None,
+                          flatten_mode='explode', separator='\n', template=None, filters=None,
+                          dedup=None, dedup_root=None, num_workers=DEFAULT_NUM_PROC, tokenizer=None,
+                          encoding=None):
+    """
+    以多個 worker 行程匯出單一欄位，輸出的資料與 export_field 相同
+
+    參數與 export_field 相同（不支援 max_rows），另外：
+    - num_workers: worker 行程數
+
+    回傳：manifest 內容（dict）
+    """
+    params = export_params(dataset_name, field_name, config_name, split, revision, flatten_mode, separator, template,
+                           filters, dedup, None, max_rows_per_shard, max_bytes_per_shard, row_group_size,
+                           tokenizer, encoding)
+    os.makedirs(output_dir, exist_ok=True)
+    check_source(output_dir, params)
+    checkpoint = ExportCheckpoint.load(output_dir, params) if resume else None
+    if checkpoint is not None and checkpoint.completed:
+        print(f"✓ {output_dir} 已完成匯出，略過")
+        _write_state(output_dir, status='completed')
+        return read_manifest(output_dir)
+    if not resume:
+        shutil.rmtree(os.path.join(output_dir, PARTITIONS_DIR), ignore_errors=True)
+
+    partitions = plan_partitions(params, num_workers, token)
+    print(f"▶ 分為 {len(partitions)} 個 partition，以 {num_workers} 個行程匯出")
+    _write_state(output_dir, status='running', num_partitions=len(partitions), partitions_done=0,
+                 started_at=time.strftime('%Y-%m-%dT%H:%M:%S'), error=None)
+
+    results = [None] * len(partitions)
+    partition_dirs = [_partition_dir(output_dir, i) for i in range(len(partitions))]
+    # 以 spawn 建立 worker，避免在 kernel 中 fork 含有執行緒的行程
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(num_workers, mp_context=context) as executor:
+        futures = {
+            executor.submit(export_partition, params, partition, partition_dirs[i], batch_size, token): i
+            for i, partition in enumerate(partitions)
+        }
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            done = sum(result is not None for result in results)
+            print(f"  partition {i} 完成（{results[i]['num_rows']} 筆），{done}/{len(partitions)}")
+            _write_state(output_dir, partitions_done=done)
+
+        _write_state(output_dir, status='merging')
+        clear_shards(output_dir)
+        clear_segments(output_dir)
+        checkpoint = ExportCheckpoint(output_dir, params)
+        checkpoint.save()
+        stats = _merge_stats(results)
+        if params['dedup']:
+            _merge_signatures(output_dir, params, results, partition_dirs, dedup_root, stats, checkpoint,
+                              batch_size)
+
+        # 需要捨棄重複列，或事先不知道開頭的來源列編號時，由 worker 重寫該 partition 的分片
+        shards = [result['shards'] for result in results]
+        row_offset = 0
+        futures = {}
+        for i, (partition, result) in enumerate(zip(partitions, results)):
+            row_shift = row_offset - partition.get('start', 0)
+            row_offset += result['source_rows']
+            if row_shift or os.path.exists(os.path.join(partition_dirs[i], PARTITION_KEEP_NAME)):
+                futures[executor.submit(finalize_partition, params, partition_dirs[i], result['shards'], row_shift,
+                                        batch_size)] = i
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            shards[i] = future.result()
+            partition_dirs[i] = os.path.join(partition_dirs[i], PARTITION_FINAL_DIR)
+
+    manifest = _collect_shards(output_dir, params, partition_dirs, shards, stats, checkpoint)
+    shutil.rmtree(os.path.join(output_dir, PARTITIONS_DIR), ignore_errors=True)
+    _write_state(output_dir, status='completed', num_rows=manifest['num_rows'])
+    return manifest
+
+
+def _merge_signatures(output_dir, params, results, partition_dirs, dedup_root, stats, checkpoint, batch_size):
+    """
+    依 partition 順序比對 worker 寫出的簽章，判斷方式與單行程逐批去重相同；
+    有列需要捨棄的 partition 寫出 _keep.npy，並將保留的簽章寫入匯出目錄的去重索引
+    """
+    index_root = dedup_root if dedup_root is not None else os.path.dirname(os.path.abspath(output_dir))
+    # 簽章已由 worker 計算，主行程只比對索引
+    deduplicator = Deduplicator(params['dedup'], index_root, output_dir, num_proc=1,
+                                exclude=same_source_exports(index_root, params, output_dir))
+    num_batches = 0
+    try:
+        for result, partition_dir in zip(results, partition_dirs):
+            keep_path = os.path.join(partition_dir, PARTITION_KEEP_NAME)
+            if os.path.exists(keep_path):
+                # 上次中斷時留下的結果
+                os.remove(keep_path)
+            if not result['num_rows']:
+                continue
+            exact, lsh, has_signature = _read_signatures(partition_dir, result['num_rows'])
+            keep = np.ones(result['num_rows'], dtype=bool)
+            for start in range(0, result['num_rows'], batch_size):
+                end = start + batch_size
+                keep[start:end] = deduplicator.select(np.asarray(exact[start:end]), np.asarray(lsh[start:end]),
+                                                      np.asarray(has_signature[start:end]), stats)
+                num_batches += 1
+                deduplicator.end_batch(num_batches)
+            if not keep.all():
+                np.save(keep_path, keep)
+        filename = deduplicator.commit(num_batches, 0)
+        if filename is not None:
+            checkpoint.dedup_segments.append(filename)
+    finally:
+        deduplicator.close()
+
+
+def _collect_shards(output_dir, params, partition_dirs, partition_shards, stats, checkpoint):
+    """將各 partition 的分片依序改名移入匯出目錄，寫出 manifest 並將檢查點標記為完成"""
+    shards = []
+    for partition_dir, partition in zip(partition_dirs, partition_shards):
+        for shard in partition:
+            filename = shard_filename(len(shards))
+            os.replace(os.path.join(partition_dir, shard['file']), os.path.join(output_dir, filename))
+            shards.append({**shard, 'file': filename})
+
+    manifest = write_manifest(output_dir, params, stats, shards, num_partitions=len(partition_shards))
+    checkpoint.shards = shards
+    checkpoint.committed_rows = manifest['num_rows']
+    checkpoint.filter_stats = stats
+    checkpoint.completed = True
+    checkpoint.save()
+    return manifest
+
+
+def start_export_job(output_dir, token=None, catalog=None, **kwargs):
+    """
+    以背景行程執行 parallel_export_field，立即回傳行程 pid
+
+    kwargs 為 parallel_export_field 的參數；token 只透過環境變數傳給背景行程，不會寫入磁碟。
+    catalog 為 {'output_root', 'key', 'field_name'} 時，匯出完成後才在 output_root 的 catalog 中
+    記錄該欄位的輸出路徑與筆數、token 數（見 hf_pipeline.screening.record_table_field），
+    catalog 不會指向尚未完成的匯出。
+    輸出寫入 output_dir/_job.log，進度可用 export_job_status(output_dir) 查詢。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    write_json_atomic(os.path.join(output_dir, JOB_SPEC_NAME), {'kwargs': kwargs, 'catalog': catalog})
+    _write_state(output_dir, status='starting', error=None)
+
+    env = dict(os.environ)
+    if token:
+        env['HF_TOKEN'] = token
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [project_root, env.get('PYTHONPATH')]))
+    with open(os.path.join(output_dir, JOB_LOG_NAME), 'ab') as log:
+        process = subprocess.Popen([sys.executable, '-m', 'hf_pipeline.parallel', output_dir],
+                                   stdout=log, stderr=subprocess.STDOUT, env=env, start_new_session=True)
+    _write_state(output_dir, pid=process.pid)
+    print(f"▶ 已在背景行程 {process.pid} 開始匯出，進度：{os.path.join(output_dir, JOB_STATE_NAME)}")
+    return process.pid
+
+
+def record_export(catalog, output_dir, manifest):
+    """在 catalog['output_root'] 的 catalog 中記錄已完成匯出的路徑與筆數、token 數"""
+    output_root = catalog['output_root']
+    Catalog(output_root).record_field(catalog['key'], catalog['field_name'],
+                                      stats={'num_rows': manifest['num_rows'],
+                                             'num_tokens': manifest.get('num_tokens')},
+                                      output_path=os.path.relpath(output_dir, output_root))
+
+
+def export_job_status(output_dir):
+    """讀取背景匯出的進度（status: starting / running / merging / completed / failed）"""
+    path = os.path.join(output_dir, JOB_STATE_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    output_dir = sys.argv[1]
+    with open(os.path.join(output_dir, JOB_SPEC_NAME), 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    try:
+        manifest = parallel_export_field(output_dir=output_dir, token=os.environ.get('HF_TOKEN'), **spec['kwargs'])
+        if spec['catalog'] is not None:
+            record_export(spec['catalog'], output_dir, manifest)
+    except BaseException as e:
+        _write_state(output_dir, status='failed', error=f"{type(e).__name__}: {e}")
+        raise
+
+
+if __name__ == '__main__':
+    main()
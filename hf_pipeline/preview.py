@@ -0,0 +1,74 @@
+"""
+Arrow 原生的樣本預覽
+
+樣本資料全程保持為 pyarrow.Table，空值過濾、切片與型別檢查都用 Arrow compute 完成，
+只有實際要顯示的幾筆預覽資料才轉為 Python 字串。
+資料來源資訊（資料集、revision、subset、split）與每筆樣本在 split 中的列編號存放在 schema metadata 中，隨 Table 一起傳遞。
+"""
+import json
+
+import numpy as np
+
+from hf_pipeline.fields import field_values
+
+
+SOURCE_KEY = b'hf_source'
+SUBSETS_KEY = b'hf_subsets'
+ROWS_KEY = b'hf_rows'
+
+
+def attach_metadata(table, source, subsets=None, rows=None):
+    """將資料來源、subset 對照表與樣本的來源列編號寫入 schema metadata"""
+    metadata = dict(table.schema.metadata or {})
+    metadata[SOURCE_KEY] = json.dumps(source, ensure_ascii=False).encode('utf-8')
+    if subsets is not None:
+        metadata[SUBSETS_KEY] = json.dumps(subsets, ensure_ascii=False).encode('utf-8')
+    if rows is not None:
+        metadata[ROWS_KEY] = json.dumps([int(row) for row in rows]).encode('utf-8')
+    return table.replace_schema_metadata(metadata)
+
+
+def get_source(table):
+    """讀取 attach_metadata 寫入的資料來源，沒有時回傳空 dict"""
+    metadata = table.schema.metadata or {}
+    if SOURCE_KEY not in metadata:
+        return {}
+    return json.loads(metadata[SOURCE_KEY].decode('utf-8'))
+
+
+def get_subsets(table):
+    metadata = table.schema.metadata or {}
+    if SUBSETS_KEY not in metadata:
+        return {}
+    return json.loads(metadata[SUBSETS_KEY].decode('utf-8'))
+
+
+def get_sample_rows(table):
+    """每筆樣本在 split 中的列編號，沒有記錄時視為 split 的前幾列"""
+    metadata = table.schema.metadata or {}
+    if ROWS_KEY not in metadata:
+        return np.arange(table.num_rows, dtype=np.int64)
+    return np.array(json.loads(metadata[ROWS_KEY].decode('utf-8')), dtype=np.int64)
+
+
+def non_null_spread(table, field, limit):
+    """
+    取出欄位（可為巢狀路徑，如 messages[].content）中等距分布的 limit 筆非空值，結果仍為 Arrow 陣列
+
+    樣本依來源列編號排序，前幾筆通常來自同一個資料檔，等距選取才能涵蓋整個樣本。
+    """
+    values, _ = field_values(table, field)
+    if len(values) <= limit:
+        return values
+    return values.take(np.linspace(0, len(values) - 1, limit).round().astype(np.int64))
+
+
+def preview_values(table, field, limit=5, max_chars=None):
+    """取出欄位中等距分布的 limit 筆非空值並轉為字串，超過 max_chars 的內容會截斷"""
+    values = []
+    for value in non_null_spread(table, field, limit).to_pylist():
+        text = str(value)
+        if max_chars is not None and len(text) > max_chars:
+            text = text[:max_chars] + '... (已截斷)'
+        values.append(text)
+    return values
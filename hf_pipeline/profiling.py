@@ -0,0 +1,328 @@
+"""
+欄位語料統計
+
+以串流方式一次讀過欄位，逐批以 numpy / Arrow compute 累計：
+- 筆數、空白率（沒有任何可見字元的來源列比例）
+- 字數分布：t-digest 估計分位數
+- 漢字比例與繁簡字元比例
+- 粗估 token 數：漢字每字一個 token，其他連續的非空白字元（英文單字、數字、標點）各算一個 token
+- 重複率：整列文字雜湊的 HyperLogLog 估計相異筆數
+所有統計都可以合併，記憶體用量固定，多個 partition 可分別計算後再合併（num_workers），
+結果寫成一個精簡的 profile JSON，其中 sketches 保存 t-digest 與 HyperLogLog 的狀態，可再與其他 profile 合併。
+"""
+import base64
+import concurrent.futures
+import multiprocessing
+import time
+import zlib
+
+import numpy as np
+import pyarrow.compute as pc
+
+from hf_pipeline.dedup import exact_hashes
+from hf_pipeline.export import (DEFAULT_BATCH_SIZE, export_name, extract_records, iter_field_batches,
+                                open_streaming_split)
+from hf_pipeline.filters import CHAR_CJK, TextBatch
+from hf_pipeline.ids import source_key
+from hf_pipeline.script import SIMPLIFIED, TRADITIONAL
+from hf_pipeline.shards import write_json_atomic
+
+
+DEFAULT_COMPRESSION = 200
+DEFAULT_PRECISION = 14
+LENGTH_QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+# 粗估 token 時，漢字以外連續的非空白字元算一個 token
+NON_CJK_RUN_PATTERN = r'[^\s\p{Han}]+'
+
+
+def _encode(array):
+    return base64.b64encode(zlib.compress(array.tobytes())).decode('ascii')
+
+
+def _decode(data, dtype):
+    return np.frombuffer(zlib.decompress(base64.b64decode(data)), dtype=dtype).copy()
+
+
+class TDigest:
+    """
+    以 arcsin 尺度函數壓縮的 merging t-digest
+
+    每次 update 將新的數值與現有 centroid 一起排序後壓縮，centroid 數量約為 compression / 2，
+    分佈兩端的 centroid 較小，極端分位數較準確。
+    """
+
+    def __init__(self, compression=DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def count(self):
+        return float(self.weights.sum())
+
+    def _add(self, means, weights):
+        if not len(means):
+            return
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+
+        # 依每個點中間位置的分位數計算 k 值，k 值整數部分相同的點合併為同一個 centroid
+        cumulative = np.cumsum(weights)
+        q = (cumulative - weights / 2) / cumulative[-1]
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1) + self.compression / 4
+        cluster = np.floor(k)
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(cluster)) + 1])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._add(values, np.ones(len(values)))
+
+    def merge(self, other):
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._add(other.means, other.weights)
+
+    def quantile(self, q):
+        """估計分位數，q 可為純量或陣列；沒有資料時回傳 NaN"""
+        if not len(self.weights):
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else float('nan')
+        cumulative = np.cumsum(self.weights)
+        centers = (cumulative - self.weights / 2) / cumulative[-1]
+        return np.interp(q, np.concatenate([[0], centers, [1]]), np.concatenate([[self.min], self.means, [self.max]]))
+
+    def to_dict(self):
+        empty = not len(self.weights)
+        return {'compression': self.compression, 'min': None if empty else self.min, 'max': None if empty else self.max,
+                'means': _encode(self.means), 'weights': _encode(self.weights)}
+
+    @classmethod
+    def from_dict(cls, data):
+        digest = cls(data['compression'])
+        if data['min'] is not None:
+            digest.min, digest.max = data['min'], data['max']
+        digest.means, digest.weights = _decode(data['means'], np.float64), _decode(data['weights'], np.float64)
+        return digest
+
+
+class HyperLogLog:
+    """以 2^precision 個 register 估計相異值數量的 HyperLogLog，輸入為 uint64 雜湊，相對誤差約 1.04 / sqrt(2^precision)"""
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(hashes):
+            return
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        # 取 index 之後的 32 個位元，rank 為第一個 1 的位置（frexp 的指數即位元長度，全為 0 時 rank 為 33）
+        rest = (hashes << np.uint64(self.precision)) >> np.uint64(32)
+        rank = 33 - np.frexp(rest.astype(np.float64))[1]
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.sum(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # 小基數時改用 linear counting
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        return {'precision': self.precision, 'registers': _encode(self.registers)}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['precision'])
+        sketch.registers = _decode(data['registers'], np.uint8)
+        return sketch
+
+
+class FieldProfile:
+    """單一欄位的可合併統計，update 每次處理一批文字"""
+
+    COUNTERS = ['rows', 'empty_rows', 'values', 'empty_values', 'chars', 'visible_chars', 'cjk_chars',
+                'traditional_chars', 'simplified_chars', 'approx_tokens']
+
+    def __init__(self, compression=DEFAULT_COMPRESSION, precision=DEFAULT_PRECISION):
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.lengths = TDigest(compression)
+        self.distinct = HyperLogLog(precision)
+
+    def update(self, text, row_index, num_rows):
+        """
+        text 為攤平後不含空值的字串陣列，row_index 為每筆文字的來源列（0 到 num_rows - 1），
+        num_rows 為這批來源的總列數（欄位為空值的列不會出現在 text 中）
+        """
+        batch = TextBatch(text)
+        nonempty = batch.num_visible_chars > 0
+        row_index = np.asarray(row_index, dtype=np.int64)
+        words = pc.count_substring_regex(text, NON_CJK_RUN_PATTERN).to_numpy(zero_copy_only=False)
+        script_totals = batch.script_counts.sum(axis=0)
+
+        counters = self.counters
+        counters['rows'] += num_rows
+        counters['empty_rows'] += num_rows - len(np.unique(row_index[nonempty]))
+        counters['values'] += len(text)
+        counters['empty_values'] += int(np.sum(~nonempty))
+        counters['chars'] += int(batch.num_chars.sum())
+        counters['visible_chars'] += int(batch.num_visible_chars.sum())
+        counters['cjk_chars'] += int(batch.char_counts[:, CHAR_CJK].sum())
+        counters['traditional_chars'] += int(script_totals[TRADITIONAL])
+        counters['simplified_chars'] += int(script_totals[SIMPLIFIED])
+        counters['approx_tokens'] += int(batch.char_counts[:, CHAR_CJK].sum() + words.sum())
+
+        self.lengths.update(batch.num_chars[nonempty])
+        self.distinct.add(exact_hashes(batch.codepoints, batch.row_index, len(text))[nonempty])
+
+    def merge(self, other):
+        for name in self.COUNTERS:
+            self.counters[name] += other.counters[name]
+        self.lengths.merge(other.lengths)
+        self.distinct.merge(other.distinct)
+
+    def summary(self):
+        """可直接閱讀的統計結果"""
+        c = self.counters
+        nonempty_values = c['values'] - c['empty_values']
+        distinct = min(self.distinct.count(), nonempty_values)
+        quantiles = self.lengths.quantile(LENGTH_QUANTILES) if nonempty_values else [None] * len(LENGTH_QUANTILES)
+        length = {'mean': c['chars'] / nonempty_values if nonempty_values else None,
+                  'min': self.lengths.min if nonempty_values else None}
+        length.update({f"p{int(q * 100):02d}": None if value is None else round(float(value), 1)
+                       for q, value in zip(LENGTH_QUANTILES, quantiles)})
+        length['max'] = self.lengths.max if nonempty_values else None
+        return {
+            'rows': c['rows'],
+            'empty_rows': c['empty_rows'],
+            'empty_rate': c['empty_rows'] / c['rows'] if c['rows'] else 0.0,
+            'values': c['values'],
+            'empty_values': c['empty_values'],
+            'chars': c['chars'],
+            'approx_tokens': c['approx_tokens'],
+            'length': length,
+            'cjk_ratio': c['cjk_chars'] / c['visible_chars'] if c['visible_chars'] else 0.0,
+            'traditional_ratio': c['traditional_chars'] / c['cjk_chars'] if c['cjk_chars'] else 0.0,
+            'simplified_ratio': c['simplified_chars'] / c['cjk_chars'] if c['cjk_chars'] else 0.0,
+            'distinct_values': distinct,
+            'duplicate_rate': 1 - distinct / nonempty_values if nonempty_values else 0.0,
+        }
+
+    def to_dict(self):
+        return {**self.summary(), 'sketches': {
+            'counters': self.counters, 'lengths': self.lengths.to_dict(), 'distinct': self.distinct.to_dict(),
+        }}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketches = data['sketches']
+        profile = cls()
+        profile.counters = dict(sketches['counters'])
+        profile.lengths = TDigest.from_dict(sketches['lengths'])
+        profile.distinct = HyperLogLog.from_dict(sketches['distinct'])
+        return profile
+
+
+def profile_filename(dataset_name, field_name, flatten_mode='explode', config_name=None, split="train"):
+    """欄位 profile JSON 的檔名，命名方式與 export_dir_name 相同"""
+    return f"{export_name(dataset_name, field_name, flatten_mode, config_name, split)}_profile.json"
+
+
+def profile_table(table, field_name, flatten_mode='explode', separator='\n', template=None):
+    """計算已載入的 Table（如樣本）中單一欄位的統計，回傳 FieldProfile"""
+    profile = FieldProfile()
+    records = extract_records(table, field_name, flatten_mode, separator, template)
+    profile.update(records.column('text').combine_chunks(), records.column('source_row'), table.num_rows)
+    return profile
+
+
+def _profile_batches(tables, field_name, flatten_mode, separator, template):
+    profile = FieldProfile()
+    for table in tables:
+        records = extract_records(table, field_name, flatten_mode, separator, template)
+        profile.update(records.column('text').combine_chunks(), records.column('source_row'), table.num_rows)
+    return profile
+
+
+def _profile_partition(params, partition, batch_size, token):
+    """worker 行程：計算單一 partition 的統計，回傳可合併的 dict"""
+    from hf_pipeline.parallel import iter_partition_batches
+
+    return _profile_batches(iter_partition_batches(params, partition, batch_size, token), params['field_name'],
+                            params['flatten_mode'], params['separator'], params['template']).to_dict()
+
+
+def profile_field(dataset_name, field_name, output_path=None, config_name=None, split="train", token=None,
+                  revision=None, flatten_mode='explode', separator='\n', template=None,
+                  batch_size=DEFAULT_BATCH_SIZE, max_rows=None, num_workers=1):
+    """
+    以串流方式一次讀過整個欄位並計算統計
+
+    參數與 export_field 相同；max_rows 限制讀取的來源列數，num_workers > 1 時依資料檔或 row group 切分
+    （見 hf_pipeline.parallel.plan_partitions），
+    由多個行程分別計算後合併（需 max_rows=None）。
+    回傳 profile dict，指定 output_path 時同時寫成 JSON。
+    """
+    if num_workers > 1 and max_rows is not None:
+        raise ValueError("num_workers > 1 profiles the full split, set max_rows=None.")
+    params = {'dataset_name': dataset_name, 'revision': revision, 'config_name': config_name, 'split': split,
+              'field_name': field_name, 'flatten_mode': flatten_mode, 'separator': separator, 'template': template}
+    started = time.time()
+
+    if num_workers > 1:
+        from hf_pipeline.parallel import plan_partitions
+
+        partitions = plan_partitions(params, num_workers, token)
+        context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(num_workers, len(partitions)),
+                                                    mp_context=context) as pool:
+            futures = [pool.submit(_profile_partition, params, partition, batch_size, token)
+                       for partition in partitions]
+            profile = FieldProfile()
+            for future in futures:
+                profile.merge(FieldProfile.from_dict(future.result()))
+    else:
+        dataset = open_streaming_split(dataset_name, config_name, split, token, revision)
+        if max_rows is not None:
+            dataset = dataset.take(max_rows)
+        profile = _profile_batches(iter_field_batches(dataset, field_name, batch_size, template), field_name,
+                                   flatten_mode, separator, template)
+
+    result = {
+        'source': source_key(dataset_name, field_name, config_name, split, revision, flatten_mode),
+        'params': {**params, 'max_rows': max_rows},
+        **profile.to_dict(),
+        'elapsed_seconds': round(time.time() - started, 3),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    if output_path is not None:
+        write_json_atomic(output_path, result)
+    return result
+
+
+def format_profile(profile):
+    """將 profile 的主要統計格式化為一行文字"""
+    length = profile['length']
+    if length['mean'] is None:
+        return f"欄位統計：{profile['rows']} 列，全部為空"
+    return (f"欄位統計：{profile['rows']} 列、{profile['values']} 筆文字，空白率 {profile['empty_rate']:.1%}；"
+            f"字數平均 {length['mean']:.1f}（p05 {length['p05']:.0f}、中位數 {length['p50']:.0f}、"
+            f"p95 {length['p95']:.0f}、最大 {length['max']:.0f}）；漢字比例 {profile['cjk_ratio']:.1%}；"
+            f"粗估 {profile['approx_tokens']} tokens；重複率約 {profile['duplicate_rate']:.1%}")
@@ -0,0 +1,234 @@
+"""
+代表性抽樣
+
+split 的前幾筆通常只來自第一個資料檔，無法代表整個 split，Inspector 容易依偏差的樣本做出判斷。
+- stratified：資料檔為 parquet 時，依各檔案的 row group 筆數加權隨機選出最多 max_files 個檔案，
+  每個檔案只讀取 row_groups_per_file 個隨機 row group，再從中取出依檔案筆數分配的樣本；
+  hub 上的檔案以 HTTP range request 讀取，本機或 HF 快取中的檔案直接讀取。
+- reservoir：從整個 split 依筆數加權隨機排列 row group，依序讀取，每個 row group 最多取
+  num_samples / max_row_groups 筆，取得的筆數足夠後即停止讀取，再以 reservoir sampling 均勻抽樣。
+- head：split 的前 num_samples 筆（原本的行為）。
+各 row group 的筆數來自 footer（呼叫端可傳入 MetadataCache 中的結果，見 hf_pipeline.metadata.get_row_group_rows），
+指定 columns 時只讀取需要的欄位。
+沒有 parquet 資料檔時（如本機的 json、csv），只能以 reservoir sampling 從串流的前 num_samples * DEFAULT_SCAN_FACTOR 筆抽樣。
+所有方法都回傳 (樣本 Table, 每筆樣本在 split 中的列編號)，樣本依列編號排序，相同 seed 的結果相同。
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+SAMPLING_METHODS = ('stratified', 'reservoir', 'head')
+DEFAULT_SAMPLING = 'stratified'
+DEFAULT_MAX_FILES = 16
+DEFAULT_ROW_GROUPS_PER_FILE = 2
+DEFAULT_SCAN_FACTOR = 20
+DEFAULT_MAX_WORKERS = 8
+
+
+def check_sampling(sampling):
+    if sampling not in SAMPLING_METHODS:
+        raise ValueError(f"Unknown sampling method: {sampling}, please choose from {list(SAMPLING_METHODS)}.")
+
+
+def open_parquet(path, token=None):
+    """開啟本機或 hf:// 上的 parquet 檔，hub 上的檔案只會讀取 footer 與實際用到的 row group"""
+    if not path.startswith('hf://'):
+        return pq.ParquetFile(path)
+    import fsspec
+
+    storage_options = {'token': token} if token else {}
+    return pq.ParquetFile(fsspec.open(path, 'rb', **storage_options).open())
+
+
+def _row_group_rows(path, token):
+    with open_parquet(path, token) as parquet_file:
+        metadata = parquet_file.metadata
+        return np.array([metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)], dtype=np.int64)
+
+
+def read_row_group_rows(files, token=None, max_workers=DEFAULT_MAX_WORKERS):
+    """以 thread pool 同時讀取 footer，回傳每個資料檔各 row group 的筆數"""
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(files)))) as pool:
+        return list(pool.map(lambda path: _row_group_rows(path, token), files))
+
+
+def count_parquet_rows(files, token=None, max_workers=DEFAULT_MAX_WORKERS):
+    """只讀取 footer 計算 parquet 資料檔的總筆數"""
+    return int(sum(rows.sum() for rows in read_row_group_rows(files, token, max_workers)))
+
+
+def _lazy_map(function, items, max_workers):
+    """
+    依序回傳 function(item) 的結果，同時最多只有 max_workers 個尚未取用的呼叫；
+    呼叫端停止迭代後不再送出新的呼叫
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        pending = deque()
+        items = iter(items)
+        try:
+            for item in items:
+                pending.append(pool.submit(function, item))
+                if len(pending) >= max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _weighted_choice(rng, weights, size):
+    """依權重不重複地選出 size 個索引（權重為 0 的項目不會被選到），回傳排序後的結果"""
+    candidates = np.flatnonzero(weights)
+    size = min(size, len(candidates))
+    p = weights[candidates] / weights[candidates].sum()
+    return np.sort(rng.choice(candidates, size=size, replace=False, p=p))
+
+
+def stratified_parquet_sample(files, num_samples, token=None, seed=0, max_files=DEFAULT_MAX_FILES,
+                              row_groups_per_file=DEFAULT_ROW_GROUPS_PER_FILE, max_workers=DEFAULT_MAX_WORKERS,
+                              columns=None, group_rows=None):
+    """
+    依資料檔分層抽樣
+
+    files 需依 split 的讀取順序排列，列編號為檔案在 split 中的起始位置加上檔案內的列編號。
+    columns 為要讀取的欄位，None 表示全部；group_rows 為各檔案 row group 的筆數（read_row_group_rows 的結果），
+    None 時以 thread pool 讀取所有檔案的 footer。
+    """
+    rng = np.random.default_rng(seed)
+    if group_rows is None:
+        group_rows = read_row_group_rows(files, token, max_workers)
+    group_rows = [np.asarray(rows, dtype=np.int64) for rows in group_rows]
+    file_rows = np.array([rows.sum() for rows in group_rows], dtype=np.int64)
+    if not file_rows.sum():
+        return None, np.zeros(0, dtype=np.int64)
+    file_offsets = np.concatenate([[0], np.cumsum(file_rows)[:-1]])
+
+    if file_rows.sum() <= num_samples:
+        # split 比樣本數小時直接讀取全部資料
+        chosen = np.flatnonzero(file_rows)
+        allocation = file_rows[chosen]
+        row_groups_per_file = None
+    else:
+        chosen = _weighted_choice(rng, file_rows.astype(np.float64), max_files)
+        allocation = rng.multinomial(num_samples, file_rows[chosen] / file_rows[chosen].sum())
+
+    def read(file_index, count):
+        # 每個檔案使用各自的亂數產生器，平行讀取時結果仍然固定
+        file_rng = np.random.default_rng([seed, file_index])
+        rows = group_rows[file_index]
+        if row_groups_per_file is None:
+            groups = np.arange(len(rows))
+        else:
+            groups = _weighted_choice(file_rng, rows.astype(np.float64), row_groups_per_file)
+        group_offsets = np.concatenate([[0], np.cumsum(rows)[:-1]])
+        positions = np.concatenate([np.arange(rows[g], dtype=np.int64) + group_offsets[g] for g in groups])
+        picked = np.sort(file_rng.choice(len(positions), size=min(count, len(positions)), replace=False))
+        with open_parquet(files[file_index], token) as parquet_file:
+            table = parquet_file.read_row_groups(groups.tolist(), columns=columns)
+        return table.take(pa.array(picked)), positions[picked] + file_offsets[file_index]
+
+    jobs = [(int(i), int(count)) for i, count in zip(chosen, allocation) if count]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as pool:
+        parts = list(pool.map(lambda job: read(*job), jobs))
+    table = pa.concat_tables([part for part, _ in parts], promote_options='default')
+    positions = np.concatenate([rows for _, rows in parts])
+    return table, positions
+
+
+def reservoir_parquet_sample(files, num_samples, token=None, seed=0,
+                             max_row_groups=DEFAULT_MAX_FILES * DEFAULT_ROW_GROUPS_PER_FILE,
+                             max_workers=DEFAULT_MAX_WORKERS, columns=None, group_rows=None):
+    """
+    從整個 split 選出 row group 後做 reservoir sampling
+
+    files 需依 split 的讀取順序排列。row group 依筆數加權隨機排列後依序讀取，
+    每個 row group 只隨機取 num_samples / max_row_groups 筆（無條件進位），樣本分散在至少約 max_row_groups 個 row group；
+    同時最多 max_workers 個讀取，取得的筆數達到 num_samples 後即停止讀取其餘的 row group。
+    依筆數加權選出 row group、每個 row group 取固定筆數，每一列被取到的機率大致相同。
+    columns 與 group_rows 與 stratified_parquet_sample 相同。
+    """
+    rng = np.random.default_rng(seed)
+    if group_rows is None:
+        group_rows = read_row_group_rows(files, token, max_workers)
+    group_rows = [np.asarray(rows, dtype=np.int64) for rows in group_rows]
+    sizes = np.concatenate(group_rows) if group_rows else np.zeros(0, dtype=np.int64)
+    candidates = np.flatnonzero(sizes)
+    if not len(candidates):
+        return None, np.zeros(0, dtype=np.int64)
+    file_index = np.repeat(np.arange(len(files)), [len(rows) for rows in group_rows])
+    group_index = np.concatenate([np.arange(len(rows)) for rows in group_rows])
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    order = rng.choice(candidates, size=len(candidates), replace=False, p=sizes[candidates] / sizes.sum())
+    per_group = -(-num_samples // max(1, max_row_groups))
+
+    def read(i):
+        # 每個 row group 使用各自的亂數產生器，平行讀取時結果仍然固定
+        group_rng = np.random.default_rng([seed, int(i)])
+        with open_parquet(files[file_index[i]], token) as parquet_file:
+            table = parquet_file.read_row_group(int(group_index[i]), columns=columns)
+        picked = np.sort(group_rng.choice(table.num_rows, size=min(per_group, table.num_rows), replace=False))
+        return table.take(pa.array(picked)), picked + starts[i]
+
+    positions = []
+
+    def batches():
+        taken = 0
+        for table, rows in _lazy_map(read, order, max_workers):
+            positions.append(rows)
+            yield table
+            taken += len(rows)
+            if taken >= num_samples:
+                return
+
+    table, picked = reservoir_sample(batches(), num_samples, seed=seed)
+    if table is None:
+        return None, np.zeros(0, dtype=np.int64)
+    # reservoir 中的位置為讀取順序中的位置，換算為 split 中的列編號後依列編號排序
+    rows = np.concatenate(positions)[picked]
+    order = np.argsort(rows, kind='stable')
+    return table.take(pa.array(order)), rows[order]
+
+
+def reservoir_sample(batches, num_samples, seed=0):
+    """
+    對 pyarrow.Table 批次串流做 reservoir sampling（Algorithm R）
+
+    記憶體中只保留 num_samples 筆，每批以 numpy 一次決定要替換的位置。
+    """
+    rng = np.random.default_rng(seed)
+    reservoir = None
+    positions = np.zeros(0, dtype=np.int64)
+    seen = 0
+    for batch in batches:
+        n = batch.num_rows
+        index = np.arange(seen, seen + n, dtype=np.int64)
+        # 前 num_samples 筆直接放入，之後第 i 筆以 num_samples / (i + 1) 的機率取代隨機一個位置
+        fill = int(min(max(num_samples - seen, 0), n))
+        slots = np.full(n, -1, dtype=np.int64)
+        slots[:fill] = np.arange(seen, seen + fill)
+        draws = rng.integers(0, index[fill:] + 1)
+        slots[fill:] = np.where(draws < num_samples, draws, -1)
+        seen += n
+
+        # 同一個位置被同批多筆取代時只保留最後一筆
+        rows = np.flatnonzero(slots >= 0)
+        last = len(rows) - 1 - np.unique(slots[rows][::-1], return_index=True)[1]
+        rows = rows[last]
+        if not len(rows):
+            continue
+        size = max(len(positions), int(slots[rows].max()) + 1)
+        mapping = np.concatenate([np.arange(len(positions)), np.full(size - len(positions), -1)])
+        mapping[slots[rows]] = len(positions) + np.arange(len(rows))
+        taken = batch.take(pa.array(rows))
+        reservoir = (taken if reservoir is None else pa.concat_tables([reservoir, taken])).take(pa.array(mapping))
+        positions = np.concatenate([positions, index[rows]])[mapping]
+
+    if reservoir is None:
+        return None, positions
+    order = np.argsort(positions, kind='stable')
+    return reservoir.take(pa.array(order)), positions[order]
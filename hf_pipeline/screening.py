@@ -0,0 +1,338 @@
+"""
+批次初篩多個 Hugging Face 資料集
+
+每個資料集的 metadata 查詢、抽樣與預評分（繁簡字元統計、預設品質過濾的通過比例）不需要 LLM，
+由 thread pool 同時處理；只有 Inspector 的語意檢查需要排隊逐一呼叫。
+預評分時樣本中沒有任何一筆通過預設過濾條件的欄位，匯出後也不會有資料，直接判定為不適合，不送 Inspector。
+最後將所有資料集、欄位的判斷結果彙整為一張表，依副檔名寫成 CSV 或 parquet。
+判斷結果會記錄在輸出目錄的 catalog（見 hf_pipeline.catalog），以資料集的 commit sha 為 key，
+同一 revision 已判斷過的欄位直接沿用，不再送 Inspector。
+"""
+import json
+import os
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from hf_pipeline.catalog import DEFAULT_OUTPUT_ROOT, Catalog, catalog_key
+from hf_pipeline.export import extract_records
+from hf_pipeline.fields import field_values, find_text_fields
+from hf_pipeline.filters import FilterPipeline
+from hf_pipeline.metadata import probe_dataset, resolve_revision
+from hf_pipeline.preview import get_source, preview_values
+from hf_pipeline.script import format_summary, summarize_field
+
+
+DEFAULT_NUM_SAMPLES = 100
+DEFAULT_MAX_DATASETS = 4
+
+APPROVED = 'approved'
+REJECTED = 'rejected'
+PRESCREEN_REJECTED = 'prescreen_rejected'
+UNKNOWN = 'unknown'
+ERROR = 'error'
+# catalog 中可以直接沿用、不需要重新判斷的結果
+DECISIVE_VERDICTS = (APPROVED, REJECTED, PRESCREEN_REJECTED)
+
+REPORT_SCHEMA = pa.schema([
+    ('dataset', pa.string()),
+    ('config', pa.string()),
+    ('split', pa.string()),
+    ('revision', pa.string()),
+    ('field', pa.string()),
+    ('sample_rows', pa.int64()),
+    ('values', pa.int64()),
+    ('avg_chars', pa.float64()),
+    ('cjk_chars', pa.int64()),
+    ('traditional_ratio', pa.float64()),
+    ('simplified_ratio', pa.float64()),
+    ('filter_pass_ratio', pa.float64()),
+    ('verdict', pa.string()),
+    ('reason', pa.string()),
+])
+
+
+def read_dataset_list(path):
+    """讀取資料集清單：每行一個資料集 id，可寫成 id@revision，空行與 # 開頭的行會略過"""
+    datasets = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                datasets.append(line)
+    return datasets
+
+
+def split_revision(dataset_id):
+    """將 'name@revision' 拆成 (name, revision)，沒有指定時 revision 為 None"""
+    name, _, revision = dataset_id.partition('@')
+    return name, revision or None
+
+
+def table_catalog_key(table, token=None, dataset_name=None):
+    """以 load_and_display_dataset 記錄的資料來源組成 catalog key，revision 換算為 commit sha"""
+    source = get_source(table)
+    dataset_name = source.get('dataset_name', dataset_name)
+    revision = resolve_revision(dataset_name, source.get('revision'), token)
+    return catalog_key(dataset_name, revision, source.get('config_name'), source.get('split', 'train'))
+
+
+def cached_verdicts(catalog, key, fields=None):
+    """catalog 中 key 下已有判斷結果的欄位 {欄位: 紀錄}，fields 不為 None 時只保留其中的欄位"""
+    return {field: entry for field, entry in catalog.fields(key).items()
+            if entry['verdict'] in DECISIVE_VERDICTS and (fields is None or field in fields)}
+
+
+def record_table_field(table, field_name, output_root=DEFAULT_OUTPUT_ROOT, token=None, dataset_name=None,
+                       stats=None, output_path=None):
+    """
+    在 output_root 的 catalog 中記錄欄位的統計與輸出路徑（不改變 verdict）
+
+    output_path 會轉為相對於 output_root 的路徑，與 catalog 的 locations 一致
+    """
+    if output_path is not None:
+        output_path = os.path.relpath(output_path, output_root)
+    key = table_catalog_key(table, token, dataset_name)
+    Catalog(output_root).record_field(key, field_name, stats=stats, output_path=output_path)
+    return key
+
+
+def semantic_check_message(table, text_columns, key=None, output_root=None):
+    """
+    組成 SEMANTIC_CHECK_REQUEST 訊息：每個欄位附上繁簡字元統計與等距選取的 5 筆樣本
+
+    key 為 catalog key 時附在訊息開頭，Inspector 回應後由 record_semantic_check 寫入 catalog；
+    output_root 為查詢 catalog 的輸出根目錄，以絕對路徑一併附上，判斷結果會寫入同一個 catalog
+    """
+    message = "SEMANTIC_CHECK_REQUEST\n\n"
+    if key is not None:
+        message += f"資料來源：{json.dumps(key, ensure_ascii=False)}\n"
+        if output_root is not None:
+            message += f"Catalog：{json.dumps(os.path.abspath(output_root), ensure_ascii=False)}\n"
+        message += "\n"
+    for field_name in text_columns:
+        message += f"=== 欄位名稱：{field_name} ===\n"
+        # 以全部樣本計算繁簡字元比例，作為 Inspector 判斷的客觀依據
+        values, _ = field_values(table, field_name)
+        message += format_summary(summarize_field(values)) + "\n"
+        # 限制每個樣本長度避免訊息過長
+        for i, sample_text in enumerate(preview_values(table, field_name, limit=5, max_chars=500), 1):
+            message += f"樣本{i}：{sample_text}\n"
+        message += "\n"
+    return message
+
+
+def score_field(table, field_name, filters=None):
+    """預評分單一欄位：以 explode 方式取出字串，計算平均字數、繁簡字元比例與預設過濾條件的通過比例"""
+    records = extract_records(table, field_name)
+    text = records.column('text')
+    pipeline = FilterPipeline(filters)
+    passed = pipeline.apply(records).num_rows
+    summary = summarize_field(text)
+    lengths = pc.utf8_length(text).to_numpy(zero_copy_only=False)
+    return {
+        'field': field_name,
+        'values': records.num_rows,
+        'avg_chars': float(lengths.mean()) if len(lengths) else 0.0,
+        'cjk_chars': summary['cjk_chars'],
+        'traditional_ratio': summary['traditional_ratio'],
+        'simplified_ratio': summary['simplified_ratio'],
+        'filter_pass_ratio': passed / records.num_rows if records.num_rows else 0.0,
+    }
+
+
+def _cached_result(result, catalog, split):
+    """
+    沿用 catalog 中同一 revision 探測時選用的 subset 與 split（見 Catalog.selection），
+    其所有欄位都已判斷完時回傳結果，否則回傳 None
+    """
+    key = catalog.selection(result['dataset'], result['revision'], split)
+    entries = catalog.fields(key) if key is not None else {}
+    if not entries or any(entry['verdict'] not in DECISIVE_VERDICTS for entry in entries.values()):
+        return None
+    fields = [{**entry['stats'], 'field': field_name, 'verdict': entry['verdict'], 'reason': entry['reason']}
+              for field_name, entry in entries.items()]
+    result.update(config=key['config_name'] or None, split=key['split'], cached=True,
+                  sample_rows=max(scores.get('sample_rows', 0) for scores in fields), fields=fields)
+    return result
+
+
+def prescore_dataset(dataset_id, split="train", num_samples=DEFAULT_NUM_SAMPLES, token=None, filters=None,
+                     min_pass_ratio=0.0, catalog=None):
+    """
+    探測、抽樣並預評分單一資料集（與 load_and_display_dataset 相同，使用第一個有資料的 subset）
+
+    catalog 不為 None 時先以 commit sha 查詢上次探測選用的 subset 與 split：其所有欄位都已判斷過時直接沿用，
+    不探測也不送 Inspector；否則只有 catalog 中沒有判斷結果的欄位需要送 Inspector。
+
+    回傳 dict：
+    - dataset / config / split / revision / sample_rows: 資料來源（revision 為 commit sha）與樣本筆數
+    - fields: 每個文字欄位的 score_field 結果，通過比例不高於 min_pass_ratio 的欄位 verdict 為 PRESCREEN_REJECTED，
+      catalog 中已有判斷結果的欄位沿用其 verdict 與 reason
+    - message: 需要送 Inspector 的欄位所組成的 SEMANTIC_CHECK_REQUEST，沒有時為 None
+    - key: catalog key，探測失敗時為 None
+    - cached: 是否完全沿用 catalog 的結果
+    - error: 失敗原因，成功時為 None
+    """
+    dataset_name, revision = split_revision(dataset_id)
+    result = {'dataset': dataset_name, 'config': None, 'split': None, 'revision': revision, 'sample_rows': 0,
+              'fields': [], 'message': None, 'key': None, 'cached': False, 'error': None}
+    try:
+        result['revision'] = resolve_revision(dataset_name, revision, token)
+        if catalog is not None and _cached_result(result, catalog, split) is not None:
+            return result
+
+        probe = probe_dataset(dataset_name, split=split, num_samples=num_samples, token=token, revision=revision)
+        selected = probe['selected']
+        subset = probe['subsets'].get(selected)
+        if subset is None or subset['sample'] is None:
+            result['error'] = "找不到有效的 subset 和 split 組合"
+            return result
+        table = subset['sample']
+        result.update(config=selected, split=subset['split'], sample_rows=table.num_rows)
+        result['key'] = catalog_key(dataset_name, result['revision'], selected, subset['split'])
+        if catalog is not None:
+            catalog.record_selection(result['key'], split)
+
+        text_columns = find_text_fields(table.schema)
+        if not text_columns:
+            result['error'] = "未找到文字類型欄位"
+            return result
+        cached = cached_verdicts(catalog, result['key'], text_columns) if catalog is not None else {}
+        for field_name in text_columns:
+            scores = score_field(table, field_name, filters)
+            if field_name in cached:
+                scores['verdict'], scores['reason'] = cached[field_name]['verdict'], cached[field_name]['reason']
+            elif scores['filter_pass_ratio'] <= min_pass_ratio:
+                scores['verdict'] = PRESCREEN_REJECTED
+                scores['reason'] = f"樣本通過品質過濾的比例為 {scores['filter_pass_ratio']:.1%}"
+            result['fields'].append(scores)
+
+        pending = [scores['field'] for scores in result['fields'] if 'verdict' not in scores]
+        if pending:
+            result['message'] = semantic_check_message(table, pending, result['key'])
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def record_result(catalog, result):
+    """
+    將 prescore_dataset 的結果（含 Inspector 的判斷）寫入 catalog，預評分結果存為 stats
+
+    沒有明確判斷的欄位（UNKNOWN / ERROR）也會記錄但不寫入 verdict，下次會再送 Inspector
+    """
+    if result['key'] is None or result['cached']:
+        return
+    for scores in result['fields']:
+        decisive = scores.get('verdict') in DECISIVE_VERDICTS
+        stats = {name: value for name, value in scores.items() if name not in ('field', 'verdict', 'reason')}
+        catalog.record_field(result['key'], scores['field'], scores['verdict'] if decisive else None,
+                             scores['reason'] if decisive else None,
+                             stats={**stats, 'sample_rows': result['sample_rows']})
+
+
+def prescore_datasets(dataset_ids, max_workers=DEFAULT_MAX_DATASETS, **kwargs):
+    """以 thread pool 同時預評分多個資料集，依完成順序逐一產出 prescore_dataset 的結果"""
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(dataset_ids)))) as pool:
+        futures = [pool.submit(prescore_dataset, dataset_id, **kwargs) for dataset_id in dataset_ids]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+_FIELD_PATTERN = re.compile(r'欄位名稱[：:][ \t]*([^\n]+)')
+_VERDICT_PATTERN = re.compile(r'最終判斷[：:]\s*【?\s*(不適合|適合)')
+_REASON_PATTERN = re.compile(r'判斷理由[：:]\s*(.*?)(?:\n\s*CP 訓練建議|\n\s*===|\Z)', re.S)
+
+
+def parse_verdicts(response, fields):
+    """
+    從 Inspector 的回應（CODE_INSPECT 的輸出格式）取出每個欄位的判斷
+
+    回傳 {欄位: (verdict, reason)}，回應中找不到的欄位為 (UNKNOWN, '')
+    """
+    verdicts = {field: (UNKNOWN, '') for field in fields}
+    matches = list(_FIELD_PATTERN.finditer(response))
+    for i, match in enumerate(matches):
+        field = match.group(1).strip().strip('`')
+        if field not in verdicts and field.startswith('[') and field.endswith(']'):
+            field = field[1:-1]
+        if field not in verdicts:
+            continue
+        block = response[match.end():matches[i + 1].start() if i + 1 < len(matches) else len(response)]
+        verdict = _VERDICT_PATTERN.search(block)
+        reason = _REASON_PATTERN.search(block)
+        verdicts[field] = (
+            UNKNOWN if verdict is None else (REJECTED if verdict.group(1) == '不適合' else APPROVED),
+            reason.group(1).strip() if reason else '',
+        )
+    return verdicts
+
+
+_KEY_PATTERN = re.compile(r'資料來源[：:][ \t]*(\{[^\n]*\})')
+_OUTPUT_ROOT_PATTERN = re.compile(r'Catalog[：:][ \t]*("[^\n]*")')
+_REQUEST_FIELD_PATTERN = re.compile(r'=== 欄位名稱[：:](.+?) ===')
+
+
+def record_semantic_check(message, response, output_root=None):
+    """
+    將 Inspector 對 SEMANTIC_CHECK_REQUEST 的判斷寫入 output_root 的 catalog
+
+    message 為 semantic_check_message 組成的訊息（可包含在 traceback 中），沒有資料來源時不記錄；
+    output_root 為 None 時使用訊息中附上的輸出根目錄（查詢時的 catalog），訊息中沒有時為 DEFAULT_OUTPUT_ROOT；
+    只寫入明確判斷為適合 / 不適合的 verdict，其餘欄位只建立紀錄，下次仍會再送 Inspector；
+    回傳 parse_verdicts 的結果，沒有記錄時為 None
+    """
+    match = _KEY_PATTERN.search(message)
+    fields = [field.strip() for field in _REQUEST_FIELD_PATTERN.findall(message)]
+    if match is None or not fields:
+        return None
+    key = json.loads(match.group(1))
+    if output_root is None:
+        root = _OUTPUT_ROOT_PATTERN.search(message)
+        output_root = json.loads(root.group(1)) if root else DEFAULT_OUTPUT_ROOT
+    verdicts = parse_verdicts(response, fields)
+    catalog = Catalog(output_root)
+    for field, (verdict, reason) in verdicts.items():
+        if verdict in (APPROVED, REJECTED):
+            catalog.record_field(key, field, verdict, reason)
+        else:
+            catalog.record_field(key, field)
+    return verdicts
+
+
+def report_rows(result):
+    """將單一資料集的結果展開為報表列（每個欄位一列，失敗的資料集一列）"""
+    base = {key: result[key] for key in ('dataset', 'config', 'split', 'revision', 'sample_rows')}
+    if result['error']:
+        return [{**base, 'verdict': ERROR, 'reason': result['error']}]
+    return [{**base, **scores} for scores in result['fields']]
+
+
+def write_report(rows, path):
+    """依副檔名將報表寫為 parquet 或 CSV，寫入暫存檔後再取代，中途中斷不會留下不完整的報表"""
+    table = pa.Table.from_pylist([{column: row.get(column) for column in REPORT_SCHEMA.names} for row in rows],
+                                 schema=REPORT_SCHEMA)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + '.tmp'
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, tmp_path)
+    else:
+        import pyarrow.csv as pacsv
+
+        pacsv.write_csv(table, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def format_report(rows):
+    """將報表的判斷結果統計為一行文字"""
+    counts = Counter(row['verdict'] for row in rows)
+    details = '、'.join(f"{verdict} {count}" for verdict, count in counts.items())
+    datasets = len({row['dataset'] for row in rows})
+    return f"{datasets} 個資料集、{len(rows)} 個欄位" + (f"（{details}）" if details else "")
@@ -0,0 +1,153 @@
+"""
+繁體 / 簡體中文字元判別
+
+以 OpenCC 的 TSCharacters / STCharacters 字典預先建立 Unicode codepoint 查詢表，
+將每個字元分為：繁體專用、簡體專用、共用（兩種寫法相同的漢字）與其他。
+整批 Arrow 字串直接以 numpy 解碼 UTF-8 後查表計數，不需要逐字元執行 Python，
+結果可附加在 SEMANTIC_CHECK_REQUEST 中供 Inspector 參考，也可作為匯出時的列過濾條件（見 hf_pipeline.filters）。
+"""
+import functools
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+OTHER, SHARED, TRADITIONAL, SIMPLIFIED = 0, 1, 2, 3
+NUM_CATEGORIES = 4
+
+# CJK 統一表意文字（含擴充 A–F）與相容表意文字
+CJK_RANGES = [
+    (0x3400, 0x4DBF),
+    (0x4E00, 0x9FFF),
+    (0xF900, 0xFAFF),
+    (0x20000, 0x2EBEF),
+    (0x2F800, 0x2FA1F),
+]
+
+
+def _read_opencc_dictionary(filename):
+    import opencc
+
+    path = os.path.join(os.path.dirname(opencc.__file__), 'dictionary', filename)
+    mapping = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            key, _, values = line.rstrip('\n').partition('\t')
+            if len(key) == 1:
+                mapping[key] = values.split(' ')
+    return mapping
+
+
+@functools.lru_cache(maxsize=1)
+def script_lookup_table():
+    """
+    回傳長度 0x110000 的 uint8 查詢表，以 codepoint 為索引取得字元類別
+
+    繁體專用：OpenCC 繁轉簡時一定會改變的字；簡體專用：簡轉繁時一定會改變的字；
+    其餘 CJK 漢字視為共用字。
+    """
+    table = np.full(0x110000, OTHER, dtype=np.uint8)
+    for start, end in CJK_RANGES:
+        table[start:end + 1] = SHARED
+
+    traditional = {key for key, values in _read_opencc_dictionary('TSCharacters.txt').items() if key not in values}
+    simplified = {key for key, values in _read_opencc_dictionary('STCharacters.txt').items() if key not in values}
+    table[[ord(char) for char in traditional - simplified]] = TRADITIONAL
+    table[[ord(char) for char in simplified - traditional]] = SIMPLIFIED
+    return table
+
+
+def decode_codepoints(array):
+    """
+    將 Arrow 字串陣列解碼為 codepoint
+
+    回傳 (codepoints, row_index)：每個字元的 codepoint 以及它屬於第幾列
+    """
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    array = pc.cast(array, pa.large_string())
+    _, offset_buffer, data_buffer = array.buffers()
+    offsets = np.frombuffer(offset_buffer, dtype=np.int64)[array.offset:array.offset + len(array) + 1]
+    if data_buffer is None or offsets[-1] == offsets[0]:
+        return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int64)
+    data = np.frombuffer(data_buffer, dtype=np.uint8)[offsets[0]:offsets[-1]]
+    offsets = offsets - offsets[0]
+
+    # UTF-8 中非 10xxxxxx 的位元組為字元開頭
+    starts = np.flatnonzero((data & 0xC0) != 0x80)
+    lead = data[starts].astype(np.uint32)
+    length = np.select([lead < 0x80, lead < 0xE0, lead < 0xF0], [1, 2, 3], default=4)
+    codepoints = np.select([length == 1, length == 2, length == 3], [lead, lead & 0x1F, lead & 0x0F],
+                           default=lead & 0x07)
+
+    padded = np.concatenate([data, np.zeros(3, dtype=np.uint8)]).astype(np.uint32)
+    for k in range(1, 4):
+        codepoints = np.where(length > k, (codepoints << 6) | (padded[starts + k] & 0x3F), codepoints)
+
+    row_index = np.searchsorted(offsets, starts, side='right') - 1
+    return np.minimum(codepoints, 0x10FFFF), row_index
+
+
+def count_categories(codepoints, row_index, num_rows, lookup_table, num_categories):
+    """以查詢表將字元分類後逐列計數，回傳 shape 為 (num_rows, num_categories) 的陣列"""
+    categories = lookup_table[codepoints].astype(np.int64)
+    counts = np.bincount(row_index * num_categories + categories, minlength=num_rows * num_categories)
+    return counts.reshape(num_rows, num_categories)
+
+
+def script_counts(array):
+    """回傳 shape 為 (列數, 4) 的字元數，欄位依序為 其他、共用、繁體專用、簡體專用"""
+    codepoints, row_index = decode_codepoints(array)
+    return count_categories(codepoints, row_index, len(array), script_lookup_table(), NUM_CATEGORIES)
+
+
+def traditional_scores(counts):
+    """每列的繁體分數 = 繁體專用字 / (繁體專用字 + 簡體專用字)，沒有可判別字元的列為 NaN"""
+    distinctive = counts[:, TRADITIONAL] + counts[:, SIMPLIFIED]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(distinctive > 0, counts[:, TRADITIONAL] / distinctive, np.nan)
+
+
+def score_rows(array):
+    """逐列計算繁體專用、簡體專用、共用字佔漢字的比例，回傳 pyarrow.Table"""
+    counts = script_counts(array)
+    cjk = counts[:, SHARED:].sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = counts / np.where(cjk > 0, cjk, 1)[:, None]
+    return pa.table({
+        'cjk_chars': cjk,
+        'traditional_ratio': ratios[:, TRADITIONAL],
+        'simplified_ratio': ratios[:, SIMPLIFIED],
+        'shared_ratio': ratios[:, SHARED],
+        'traditional_score': traditional_scores(counts),
+    })
+
+
+def summarize_field(array):
+    """整個欄位的統計：漢字總數、三類字元比例，以及判定為繁體 / 簡體 / 無法判別的列數"""
+    counts = script_counts(array)
+    totals = counts.sum(axis=0)
+    cjk = int(totals[SHARED:].sum())
+    scores = traditional_scores(counts)
+    return {
+        'rows': len(array),
+        'cjk_chars': cjk,
+        'traditional_ratio': float(totals[TRADITIONAL] / cjk) if cjk else 0.0,
+        'simplified_ratio': float(totals[SIMPLIFIED] / cjk) if cjk else 0.0,
+        'shared_ratio': float(totals[SHARED] / cjk) if cjk else 0.0,
+        'traditional_rows': int(np.sum(scores > 0.5)),
+        'simplified_rows': int(np.sum(scores < 0.5)),
+        'undetermined_rows': int(np.sum(np.isnan(scores) | (scores == 0.5))),
+    }
+
+
+def format_summary(summary):
+    """將 summarize_field 的結果格式化為一行文字，用於 SEMANTIC_CHECK_REQUEST"""
+    return (f"繁簡字元統計：繁體專用字 {summary['traditional_ratio']:.1%}、"
+            f"簡體專用字 {summary['simplified_ratio']:.1%}、共用字 {summary['shared_ratio']:.1%}"
+            f"（漢字 {summary['cjk_chars']} 個；判定為繁體 {summary['traditional_rows']} 列、"
+            f"簡體 {summary['simplified_rows']} 列、無法判別 {summary['undetermined_rows']} 列，"
+            f"共 {summary['rows']} 列）")
+
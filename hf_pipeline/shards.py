@@ -0,0 +1,217 @@
+"""
+分片 parquet 輸出與 manifest
+
+ShardedParquetWriter 依筆數或檔案大小自動切換到新的分片檔，
+並以固定大小的 row group 寫出，方便訓練端的 dataloader 跨節點平行讀取。
+每個分片關閉後會記錄筆數、位元組數、id 範圍與 sha256（以及選用的數值欄位總和，如 num_tokens），最後寫成 _manifest.json。
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+DEFAULT_MAX_ROWS_PER_SHARD = None
+DEFAULT_MAX_BYTES_PER_SHARD = 512 * 1024 * 1024
+DEFAULT_ROW_GROUP_SIZE = 50000
+
+MANIFEST_NAME = '_manifest.json'
+
+
+def file_sha256(path, chunk_size=8 * 1024 * 1024):
+    """逐塊計算檔案的 sha256，不會將整個檔案讀入記憶體"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def shard_filename(index):
+    return f"part-{index:05d}.parquet"
+
+
+def write_json_atomic(path, data):
+    """
+    先寫入暫存檔再改名，確保讀取端不會看到寫到一半的 JSON；
+    每次寫入使用各自的暫存檔，多個 process/thread 同時寫同一路徑時不會互相覆蓋暫存檔
+    """
+    directory, filename = os.path.split(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, prefix=filename + '.',
+                                     suffix='.tmp', delete=False) as f:
+        tmp_path = f.name
+        try:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        except BaseException:
+            f.close()
+            os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, path)
+
+
+def clear_shards(output_dir):
+    """刪除目錄中舊的分片與 manifest，避免與新的匯出結果混在一起"""
+    if not os.path.isdir(output_dir):
+        return
+    for filename in os.listdir(output_dir):
+        if filename.startswith('part-') or filename.startswith(MANIFEST_NAME):
+            os.remove(os.path.join(output_dir, filename))
+
+
+def read_manifest(output_dir):
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class ShardedParquetWriter:
+    """
+    將多個 pyarrow Table 依序寫成多個大小受限的 parquet 分片
+
+    參數：
+    - output_dir: 分片輸出目錄
+    - schema: 輸出 schema，需包含 int64 的 id 欄位
+    - max_rows_per_shard: 單一分片最多筆數，None 表示不限制
+    - max_bytes_per_shard: 單一分片最多位元組數（以壓縮後實際寫出的大小計算），None 表示不限制
+    - row_group_size: 每個 row group 的筆數
+    - shards: 續傳時已提交的分片資訊，新的分片編號會接在後面
+    - total_columns: 要在分片資訊中記錄總和的數值欄位，分片資訊的 key 與欄位名稱相同
+    - parquet_options: 傳給 pyarrow.parquet.ParquetWriter 的編碼參數（見 hf_pipeline.encoding.writer_options）
+    """
+
+    def __init__(self, output_dir, schema, max_rows_per_shard=DEFAULT_MAX_ROWS_PER_SHARD,
+                 max_bytes_per_shard=DEFAULT_MAX_BYTES_PER_SHARD, row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                 shards=None, total_columns=(), parquet_options=None):
+        self.output_dir = output_dir
+        self.schema = schema
+        self.max_rows_per_shard = max_rows_per_shard
+        self.max_bytes_per_shard = max_bytes_per_shard
+        self.row_group_size = row_group_size
+        self.shards = list(shards) if shards else []
+        self.total_columns = list(total_columns)
+        self.parquet_options = dict(parquet_options or {})
+
+        self._buffer = []
+        self._buffered_rows = 0
+        self._file = None
+        self._writer = None
+        self._shard_rows = 0
+        self._shard_id_min = None
+        self._shard_id_max = None
+        self._shard_totals = {}
+
+        os.makedirs(output_dir, exist_ok=True)
+
+    @property
+    def committed_rows(self):
+        """已關閉分片中的總筆數"""
+        return sum(shard['num_rows'] for shard in self.shards)
+
+    @property
+    def num_rows(self):
+        return sum(shard['num_rows'] for shard in self.shards) + self._shard_rows + self._buffered_rows
+
+    def write_table(self, table):
+        """暫存資料，累積滿一個 row group 後才寫出"""
+        if table.num_rows == 0:
+            return
+        self._buffer.append(table)
+        self._buffered_rows += table.num_rows
+        while self._buffered_rows >= self._row_group_limit():
+            self._flush_row_group(self._row_group_limit())
+
+    def close(self):
+        """寫出剩餘資料並關閉最後一個分片，回傳所有分片的資訊"""
+        while self._buffered_rows > 0:
+            self._flush_row_group(min(self._buffered_rows, self._row_group_limit()))
+        self._close_shard()
+        return self.shards
+
+    def abort(self):
+        """放棄目前尚未完成的分片，已關閉的分片保持不變"""
+        self._buffer = []
+        self._buffered_rows = 0
+        if self._writer is not None:
+            self._writer.close()
+            self._file.close()
+            os.remove(self._tmp_path())
+        self._writer = None
+        self._file = None
+        self._shard_rows = 0
+
+    def _row_group_limit(self):
+        """row group 不可超過單一分片剩餘可寫入的筆數"""
+        limit = self.row_group_size
+        if self.max_rows_per_shard is not None:
+            limit = min(limit, self.max_rows_per_shard - self._shard_rows)
+        return limit
+
+    def _take_buffered(self, num_rows):
+        table = pa.concat_tables(self._buffer)
+        head, rest = table.slice(0, num_rows), table.slice(num_rows)
+        self._buffer = [rest] if rest.num_rows else []
+        self._buffered_rows = rest.num_rows
+        return head
+
+    def _flush_row_group(self, num_rows):
+        if self._writer is None:
+            self._open_shard()
+        row_group = self._take_buffered(num_rows).combine_chunks()
+        self._writer.write_table(row_group, row_group_size=row_group.num_rows)
+
+        id_range = pc.min_max(row_group.column('id')).as_py()
+        if self._shard_id_min is None:
+            self._shard_id_min, self._shard_id_max = id_range['min'], id_range['max']
+        self._shard_id_min = min(self._shard_id_min, id_range['min'])
+        self._shard_id_max = max(self._shard_id_max, id_range['max'])
+        for column in self.total_columns:
+            self._shard_totals[column] += pc.sum(row_group.column(column)).as_py() or 0
+        self._shard_rows += row_group.num_rows
+
+        if self._shard_full():
+            self._close_shard()
+
+    def _shard_full(self):
+        if self.max_rows_per_shard is not None and self._shard_rows >= self.max_rows_per_shard:
+            return True
+        if self.max_bytes_per_shard is not None and self._file.tell() >= self.max_bytes_per_shard:
+            return True
+        return False
+
+    def _shard_path(self):
+        return os.path.join(self.output_dir, shard_filename(len(self.shards)))
+
+    def _tmp_path(self):
+        return self._shard_path() + '.tmp'
+
+    def _open_shard(self):
+        self._file = open(self._tmp_path(), 'wb')
+        self._writer = pq.ParquetWriter(self._file, self.schema, **self.parquet_options)
+        self._shard_rows = 0
+        self._shard_id_min = None
+        self._shard_id_max = None
+        self._shard_totals = {column: 0 for column in self.total_columns}
+
+    def _close_shard(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._file.close()
+        path = self._shard_path()
+        os.replace(self._tmp_path(), path)
+
+        self.shards.append({
+            'file': os.path.basename(path),
+            'num_rows': self._shard_rows,
+            'num_bytes': os.path.getsize(path),
+            'id_min': self._shard_id_min,
+            'id_max': self._shard_id_max,
+            **self._shard_totals,
+            'sha256': file_sha256(path),
+        })
+        self._writer = None
+        self._file = None
+        self._shard_rows = 0
@@ -0,0 +1,150 @@
+"""
+以 tokenizer 計算 token 數
+
+CP 的資料量以 token 計算，而不同 tokenizer 對中文的切分差異很大，因此以實際要訓練的模型 tokenizer 計算：
+- TokenCounter: 匯出時逐批計算每筆資料的 token 數，寫入選用的 num_tokens 欄位，
+  manifest 記錄每個分片與全部資料的 token 總數；資料量大時分給多個行程計算
+- estimate_tokens: 不讀完整個 split，只抽樣幾千列計算平均 token 數，
+  再依 split 筆數推估總 token 數與信賴區間，幾秒內即可估算預算
+
+只支援 fast tokenizer（Rust 實作），以 encode_batch 整批編碼，不加入 special tokens。
+"""
+import concurrent.futures
+import functools
+import multiprocessing
+import statistics
+import time
+
+import numpy as np
+import pyarrow as pa
+
+from hf_pipeline.dedup import DEFAULT_NUM_PROC, PARALLEL_MIN_ROWS
+
+
+TOKEN_COLUMN = 'num_tokens'
+DEFAULT_ENCODE_BATCH_SIZE = 1000
+DEFAULT_ESTIMATE_SAMPLES = 2000
+DEFAULT_CONFIDENCE = 0.95
+
+
+@functools.lru_cache(maxsize=4)
+def load_tokenizer(tokenizer_name):
+    """載入 fast tokenizer 的 Rust 後端（每個行程只載入一次）"""
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, use_fast=True)
+    if not tokenizer.is_fast:
+        raise ValueError(f"Tokenizer {tokenizer_name} has no fast implementation, token counting requires one.")
+    return tokenizer.backend_tokenizer
+
+
+def count_tokens(text, tokenizer_name, batch_size=DEFAULT_ENCODE_BATCH_SIZE):
+    """text 為 pyarrow 字串陣列，回傳每筆的 token 數（int32）"""
+    tokenizer = load_tokenizer(tokenizer_name)
+    counts = np.zeros(len(text), dtype=np.int32)
+    for start in range(0, len(text), batch_size):
+        encodings = tokenizer.encode_batch(text.slice(start, batch_size).to_pylist(), add_special_tokens=False)
+        counts[start:start + len(encodings)] = [len(encoding.ids) for encoding in encodings]
+    return counts
+
+
+class TokenCounter:
+    """
+    逐批計算 token 數並加入 num_tokens 欄位
+
+    - tokenizer_name: Hugging Face tokenizer 名稱或本機路徑
+    - num_proc: 計算的行程數，每批少於 PARALLEL_MIN_ROWS 筆時在目前的行程計算
+    """
+
+    def __init__(self, tokenizer_name, num_proc=DEFAULT_NUM_PROC):
+        self.tokenizer_name = tokenizer_name
+        self.num_proc = num_proc
+        self._executor = None
+
+    def count(self, text):
+        if self.num_proc <= 1 or len(text) < PARALLEL_MIN_ROWS:
+            return count_tokens(text, self.tokenizer_name)
+        if self._executor is None:
+            # 以 spawn 建立 worker，fork 已使用過 tokenizer 執行緒的行程可能會 deadlock
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                self.num_proc, mp_context=multiprocessing.get_context('spawn'))
+        bounds = np.linspace(0, len(text), self.num_proc + 1).astype(int)
+        chunks = [text.slice(start, end - start) for start, end in zip(bounds[:-1], bounds[1:])]
+        return np.concatenate(list(self._executor.map(count_tokens, chunks, [self.tokenizer_name] * len(chunks))))
+
+    def apply(self, records):
+        """records 為含 text 欄位的 pyarrow.Table，回傳加上 num_tokens 欄位的 Table"""
+        counts = self.count(records.column('text').combine_chunks())
+        return records.append_column(TOKEN_COLUMN, pa.array(counts, pa.int32()))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def estimate_tokens(dataset_name, field_name, tokenizer_name, config_name=None, split="train", token=None,
+                    revision=None, flatten_mode='explode', separator='\n', template=None, filters=None,
+                    num_samples=DEFAULT_ESTIMATE_SAMPLES, confidence=DEFAULT_CONFIDENCE, seed=0, cache=None):
+    """
+    抽樣推估欄位的總 token 數
+
+    以 hf_pipeline.sampling 分層抽出 num_samples 列，依匯出相同的方式攤平並套用品質過濾（filters），
+    計算每個來源列的 token 數（被過濾或為空的列記為 0），再以 split 筆數 × 平均值推估總數。
+    信賴區間以常態近似並加上有限母體校正；同一個 row group 內的列通常較相似，實際誤差可能略大於區間。
+    去重的影響無法由樣本推估，估計值為去重前的 token 數。
+    split 筆數、資料檔清單與各 row group 的筆數來自 MetadataCache（參數 cache 與 hf_pipeline.metadata.get_split_info 相同）。
+
+    回傳 dict：num_rows、sample_rows、mean_tokens_per_row、estimated_tokens、lower、upper、confidence 等
+    """
+    from hf_pipeline.export import extract_records, source_columns
+    from hf_pipeline.filters import FilterPipeline
+    from hf_pipeline.metadata import get_split_info, sample_split
+    from hf_pipeline.sampling import count_parquet_rows
+
+    started = time.time()
+    splits, _, data_files = get_split_info(dataset_name, config_name, token, revision, cache)
+    if split not in splits:
+        raise ValueError(f"Split {split} not found, available splits: {list(splits)}.")
+    files = (data_files or {}).get(split)
+    num_rows = splits[split]
+    if num_rows is None:
+        if not files:
+            raise ValueError(f"The number of rows in split {split} is unknown, token estimation needs it.")
+        num_rows = count_parquet_rows(files, token)
+
+    sample, _ = sample_split(dataset_name, config_name, split, num_samples, token, revision, data_files=files,
+                             seed=seed, columns=source_columns(field_name, template), cache=cache)
+    records = extract_records(sample, field_name, flatten_mode, separator, template)
+    pipeline = FilterPipeline(filters)
+    records = pipeline.apply(records)
+    counts = count_tokens(records.column('text').combine_chunks(), tokenizer_name)
+    # 同一個來源列的多筆文字（explode 模式）合計為該列的 token 數
+    per_row = np.bincount(records.column('source_row').to_numpy(), weights=counts, minlength=sample.num_rows)
+
+    n = len(per_row)
+    mean = float(per_row.mean()) if n else 0.0
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    fpc = np.sqrt(max(0.0, 1 - n / num_rows)) if num_rows else 0.0
+    margin = z * float(per_row.std(ddof=1)) / np.sqrt(n) * fpc if n > 1 else float('inf')
+    return {
+        'tokenizer': tokenizer_name,
+        'num_rows': num_rows,
+        'sample_rows': n,
+        'sample_tokens': int(counts.sum()),
+        'filter_stats': pipeline.stats,
+        'mean_tokens_per_row': mean,
+        'estimated_tokens': int(round(mean * num_rows)),
+        'lower': int(max(0.0, (mean - margin) * num_rows)) if np.isfinite(margin) else 0,
+        'upper': int(round((mean + margin) * num_rows)) if np.isfinite(margin) else None,
+        'confidence': confidence,
+        'elapsed_seconds': round(time.time() - started, 3),
+    }
+
+
+def format_estimate(estimate):
+    """將 estimate_tokens 的結果格式化為一行文字"""
+    upper = '未知' if estimate['upper'] is None else f"{estimate['upper']:,}"
+    return (f"估計約 {estimate['estimated_tokens']:,} tokens（{estimate['confidence']:.0%} 信賴區間 "
+            f"{estimate['lower']:,} ~ {upper}；平均每列 {estimate['mean_tokens_per_row']:.1f} tokens，"
+            f"抽樣 {estimate['sample_rows']}/{estimate['num_rows']} 列，{estimate['tokenizer']}）")
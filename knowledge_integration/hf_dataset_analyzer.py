@@ -6,16 +6,17 @@ class HuggingFaceDatasetAnalyzer(knw):
         super().__init__()
         self.name = "HF資料集分析器"
         self.description = "分析 Hugging Face 資料集 繁體中文 持續預訓練 Continue Pretrain CP 適用性評估 資料集品質檢測 展示資料集內容 儲存 parquet"
+        self.keywords = ("載入 顯示欄位樣本 匯出 analyze evaluate huggingface hub dataset quality traditional chinese "
+                         "pretraining load show samples columns fields save export")
         self.core_function = "analyze_and_save_dataset"
         self.mode = 'full'
 
     def analyze_and_save_dataset(self):
         return """
         # Hugging Face 資料集分析與儲存完整程式碼
-        from datasets import load_dataset
-        import pandas as pd
         import os
         from dotenv import load_dotenv
+        import numpy as np
         import pyarrow as pa
         import pyarrow.parquet as pq
         
@@ -30,176 +31,352 @@ class HuggingFaceDatasetAnalyzer(knw):
             print("⚠ 未找到 HF_KEY 環境變數，某些私有資料集可能無法存取")
             print("   請確認 .env 文件中已設置 HF_KEY")
         
-        def load_and_display_dataset(dataset_name, split="train", num_samples=100):
-            '''載入並展示資料集'''
-            print(f"正在載入資料集：{dataset_name}")
+        # 已探測過的資料集：{(dataset_name, revision, split, num_samples, sampling): probe_dataset 的結果}，切換 subset 時不需重新探測
+        dataset_probes = {}
+        
+        def load_and_display_dataset(dataset_name, split="train", num_samples=100, subset=None, max_workers=8,
+                                     revision=None, sampling='stratified'):
+            '''
+            載入並展示資料集
             
-            # 準備載入參數
-            load_kwargs = {}
-            if hf_token:
-                load_kwargs['token'] = hf_token
+            所有 subset 會以 thread pool 同時探測，每個 subset 只抽樣一次 num_samples 筆：
+            sampling='stratified'（預設）從各 parquet 資料檔隨機選取少數 row group 分層抽樣，
+            'reservoir' 從串流前段均勻抽樣，'head' 則是 split 的前 num_samples 筆。
+            回傳 pyarrow.Table，不轉換為 pandas；資料來源與探測結果（subset → split → 筆數）
+            記錄在 schema metadata 中，可用 get_source(table) / get_subsets(table) 讀取。
+            若要改看其他 subset，指定 subset 參數即可直接使用已探測的樣本，不會重新載入。
+            config 名稱、split 與 features 會依 (資料集, revision) 快取於 cache/hf_metadata，
+            重複分析或離線（HF_HUB_OFFLINE=1）時不會再查詢 hub metadata。
+            '''
+            from hf_pipeline.metadata import probe_dataset
+            from hf_pipeline.preview import attach_metadata, preview_values
             
-            from datasets import get_dataset_config_names, get_dataset_split_names
+            print(f"正在載入資料集：{dataset_name}")
             
-            dataset = None
-            subset_name = None
-            target_split = split
+            probe_key = (dataset_name, revision, split, num_samples, sampling)
+            probe = dataset_probes.get(probe_key)
+            if probe is None:
+                probe = probe_dataset(dataset_name, split=split, num_samples=num_samples,
+                                      token=hf_token, max_workers=max_workers, revision=revision, sampling=sampling)
+                dataset_probes[probe_key] = probe
             
-            # 先檢查是否有 subset (config)
-            try:
-                config_names = get_dataset_config_names(dataset_name, **load_kwargs)
-                
-                if config_names and len(config_names) > 0:
-                    # 有 subset，需要選擇合適的 subset 和 split
-                    print(f"找到 {len(config_names)} 個 subset: {config_names}")
-                    
-                    valid_subset_found = False
-                    for config in config_names:
-                        try:
-                            # 獲取該 subset 的所有可用 split
-                            available_splits = get_dataset_split_names(dataset_name, config, **load_kwargs)
-                            print(f"  subset '{config}' 可用的 split: {available_splits}")
-                            
-                            # 優先使用指定的 split，如果不存在則使用第一個可用的 split
-                            if split in available_splits:
-                                target_split = split
-                            elif available_splits and len(available_splits) > 0:
-                                target_split = available_splits[0]
-                                print(f"  指定的 split '{split}' 不存在，改用 '{target_split}'")
-                            else:
-                                print(f"  subset '{config}' 沒有可用的 split，跳過")
-                                continue
-                            
-                            # 嘗試載入該 subset 和 split（先載入少量資料檢查）
-                            print(f"  嘗試載入 subset: {config}, split: {target_split}")
-                            test_dataset = load_dataset(dataset_name, config, split=f"{target_split}[:10]", **load_kwargs)
-                            
-                            # 檢查是否有資料
-                            if len(test_dataset) > 0:
-                                subset_name = config
-                                # 載入實際需要的樣本數
-                                dataset = load_dataset(dataset_name, config, split=f"{target_split}[:{num_samples}]", **load_kwargs)
-                                print(f"✓ 成功載入 subset: {subset_name}, split: {target_split}")
-                                valid_subset_found = True
-                                break
-                            else:
-                                print(f"  subset '{config}' 的 split '{target_split}' 為空，跳過")
-                        except Exception as e_sub:
-                            print(f"  無法載入 subset '{config}': {e_sub}")
-                            continue
-                    
-                    if not valid_subset_found:
-                        raise ValueError("找不到有效的 subset 和 split 組合")
-                        
-                else:
-                    # 沒有 subset，直接載入
-                    print("此資料集沒有 subset")
-                    dataset = load_dataset(dataset_name, split=f"{split}[:{num_samples}]", **load_kwargs)
-                    
-            except ValueError as ve:
-                # 重新拋出我們自己定義的錯誤
-                raise ve
-            except Exception as e:
-                # 無法獲取 config 資訊，可能是簡單資料集，直接嘗試載入
-                print(f"無法獲取 config 資訊，嘗試直接載入: {e}")
-                try:
-                    dataset = load_dataset(dataset_name, split=f"{split}[:{num_samples}]", **load_kwargs)
-                except Exception as e2:
-                    print(f"直接載入失敗: {e2}")
-                    print("提示：如需存取私有或需登入的資料集，請確保：")
-                    print("1. 已設置 HF_KEY 環境變數")
-                    print("2. 或使用 huggingface-cli login 登入")
-                    raise
+            subset_name = subset if subset is not None else probe['selected']
+            result = probe['subsets'].get(subset_name)
+            if result is None or result['sample'] is None:
+                print("提示：如需存取私有或需登入的資料集，請確保：")
+                print("1. 已設置 HF_KEY 環境變數")
+                print("2. 或使用 huggingface-cli login 登入")
+                raise ValueError("找不到有效的 subset 和 split 組合")
             
-            # 轉換為 DataFrame
-            df = pd.DataFrame(dataset)
+            target_split = result['split']
+            if target_split != split:
+                print(f"  指定的 split '{split}' 不存在，改用 '{target_split}'")
+            print(f"✓ 成功載入 subset: {subset_name}, split: {target_split}")
+            
+            # 記錄資料來源，供串流匯出時重新開啟同一個 subset 和 split
+            table = attach_metadata(
+                result['sample'],
+                source={
+                    'dataset_name': dataset_name,
+                    'revision': revision,
+                    'config_name': subset_name,
+                    'split': target_split,
+                },
+                subsets={str(config): r['splits'] for config, r in probe['subsets'].items()},
+                rows=result['rows'],
+            )
             
             # 顯示資料集資訊
             if subset_name:
                 print(f"\\n資料集：{dataset_name} (subset: {subset_name})")
             else:
                 print(f"\\n資料集：{dataset_name}")
-            print(f"資料筆數：{len(df)}")
-            print(f"欄位：{list(df.columns)}\\n")
+            print(f"資料筆數：{table.num_rows}")
+            print(f"欄位：{table.column_names}\\n")
             
-            # 顯示每個欄位的樣本
+            # 顯示每個欄位等距選取的樣本（只有預覽的幾筆會轉為 Python 字串）
             print("\\n=== 欄位樣本預覽 ===")
-            for column in df.columns:
+            for column in table.column_names:
                 print(f"\\n【欄位：{column}】")
-                samples = df[column].dropna().head(5).tolist()
-                for i, sample in enumerate(samples, 1):
-                    display_text = str(sample)
-                    # 如果樣本過長，只顯示前200字符
-                    if len(display_text) > 200:
-                        display_text = display_text[:200] + '... (已截斷)'
+                # 如果樣本過長，只顯示前200字符
+                for i, display_text in enumerate(preview_values(table, column, limit=5, max_chars=200), 1):
                     print(f"  樣本 {i}: {display_text}")
             print("=" * 80)
             
-            return df
+            return table
         
-        def save_approved_fields_to_parquet(df, field_name, dataset_name, output_dir="./output", num_samples=None):
+        def save_approved_fields_to_parquet(table, field_name, dataset_name, output_dir="./output", num_samples=None,
+                                            streaming=True, batch_size=10000, max_rows_per_shard=None,
+                                            max_bytes_per_shard=512 * 1024 * 1024, row_group_size=50000, resume=True,
+                                            flatten_mode='explode', separator='\\n', template=None,
+                                            filters=None, dedup=None, num_workers=1, background=False, tokenizer=None,
+                                            encoding=None):
             '''
             將被 Inspector 認可的欄位儲存為 parquet 格式
             
             參數：
-            - df: DataFrame 包含資料
-            - field_name: 要儲存的欄位名稱
+            - table: 樣本資料 pyarrow.Table（由 load_and_display_dataset 取得）
+            - field_name: 要儲存的欄位名稱，巢狀欄位使用路徑（如 messages[].content）；
+                          template 模式下可為 list of struct（如 messages[]）或 '*'（整列）
             - dataset_name: 資料集名稱（用於檔案命名）
             - output_dir: 輸出目錄
             - num_samples: 要儲存的樣本數量，None 表示全部
+            - streaming: True 時以串流方式重新讀取完整 split 並逐批寫出，記憶體用量固定；
+                         False 時只儲存 table 中已載入的資料
+            - batch_size: 串流模式下每批讀取的筆數
+            - max_rows_per_shard / max_bytes_per_shard: 串流模式下分片切換門檻，None 表示不限制
+            - row_group_size: 每個 row group 的筆數
+            - resume: 串流模式下若先前匯出中斷，保留已完成的分片並從中斷處繼續；已完成的匯出會直接略過
+            - flatten_mode: 巢狀欄位的攤平方式
+                - 'explode': 每個字串各存為一筆（如每一輪對話）
+                - 'join': 同一列的所有字串以 separator 串接為一筆（如整段對話）
+                - 'template': 以 template 組合 struct 欄位後再以 separator 串接，
+                              例如 field_name='messages[]', template='{role}：{content}'
+            - filters: 逐列品質過濾設定，None 表示使用預設條件（最少字數、亂碼比例、漢字比例、重複 n-gram、樣板文字），
+                       False 表示不過濾；可指定 dict 調整門檻，例如加上 {'min_traditional_score': 0.9} 濾除簡體資料
+            - dedup: 去重設定，None 表示預設（完全重複 + 字元 5-gram MinHash LSH 近似重複），False 表示不去重；
+                     串流模式會與 output_dir 下所有已匯出的資料一起去重
+            - num_workers: 串流模式下的 worker 行程數，大於 1 時依來源資料檔或 parquet row group 切分並平行匯出（需 num_samples=None）
+            - background: True 時在背景行程中執行匯出並立即回傳，notebook 不需等待；
+                          進度可用 hf_pipeline.parallel.export_job_status(匯出目錄) 查詢，完成後才記錄至 catalog
+            - tokenizer: 訓練模型的 Hugging Face tokenizer 名稱（需有 fast 版本），指定時每筆多一個 num_tokens 欄位，
+                         manifest 記錄每個分片與全部資料的 token 總數；None 表示不計算
+            - encoding: parquet 編碼設定，None 表示預設的 'zstd'（zstd level 3、text 不使用 dictionary、4MB data page、
+                        只記錄 id 與 source_row 的統計）；可為 'fast'、'archive'、'pyarrow' 或覆蓋個別設定的 dict，
+                        各設定的速度與壓縮率可用 benchmark_parquet_encoding() 比較
+            
+            串流模式輸出至 {output_dir}/{dataset}_{field}_cp_data/ 目錄（有 subset 或 split 不是 train 時為
+            {dataset}@{subset}@{split}_{field}_cp_data/，不同來源不會寫入同一個目錄），
+            包含 part-00000.parquet 等分片與記錄各分片筆數、大小、id 範圍和 sha256 的 _manifest.json；
+            輸出路徑與筆數、token 數會記錄在 {output_dir}/_catalog.sqlite 中該欄位的紀錄
             '''
             # 創建輸出目錄
-            output_dir = "./output"
             os.makedirs(output_dir, exist_ok=True)
             
-            # 清理資料集名稱用於檔案命名
-            safe_dataset_name = dataset_name.replace('/', '_').replace('\\\\', '_')
-            safe_field_name = field_name.replace('/', '_').replace('\\\\', '_')
+            from hf_pipeline.export import export_name, extract_records, to_cp_table
+            from hf_pipeline.encoding import writer_options
+            from hf_pipeline.ids import source_key
+            from hf_pipeline.preview import get_sample_rows, get_source
+            from hf_pipeline.checkpoint import same_source_exports
+            from hf_pipeline.dedup import Deduplicator, resolve_dedup
+            from hf_pipeline.screening import record_table_field
+            from hf_pipeline.filters import FilterPipeline, format_stats
+            from hf_pipeline.tokens import TokenCounter
             
-            # 檔案名稱
-            filename = f"{safe_dataset_name}_{safe_field_name}_cp_data.parquet"
-            filepath = os.path.join(output_dir, filename)
+            # 清理資料集名稱用於檔案命名，不同 subset、split 的結果寫入不同的檔案或目錄
+            source = get_source(table)
+            name = export_name(dataset_name, field_name, flatten_mode, source.get('config_name'),
+                               source.get('split', 'train'))
+            filepath = os.path.join(output_dir, f"{name}_cp_data.parquet")
             
-            # 準備資料
+            if streaming:
+                from hf_pipeline.export import export_field
+                from hf_pipeline.shards import MANIFEST_NAME
+                
+                export_dir = os.path.join(output_dir, f"{name}_cp_data")
+                export_kwargs = dict(
+                    dataset_name=source.get('dataset_name', dataset_name),
+                    field_name=field_name,
+                    config_name=source.get('config_name'),
+                    split=source.get('split', 'train'),
+                    batch_size=batch_size,
+                    max_rows_per_shard=max_rows_per_shard,
+                    max_bytes_per_shard=max_bytes_per_shard,
+                    row_group_size=row_group_size,
+                    resume=resume,
+                    revision=source.get('revision'),
+                    flatten_mode=flatten_mode,
+                    separator=separator,
+                    template=template,
+                    filters=filters,
+                    dedup=dedup,
+                    tokenizer=tokenizer,
+                    encoding=encoding,
+                )
+                if (num_workers > 1 or background) and num_samples is not None:
+                    raise ValueError("num_workers > 1 and background=True export the full split, set num_samples=None.")
+                if background:
+                    from hf_pipeline.parallel import start_export_job
+                    
+                    from hf_pipeline.screening import table_catalog_key
+                    
+                    # 匯出完成後才由背景行程記錄輸出路徑，catalog 不會指向尚未完成的匯出
+                    catalog = {'output_root': os.path.abspath(output_dir), 'field_name': field_name,
+                               'key': table_catalog_key(table, hf_token, dataset_name)}
+                    start_export_job(os.path.abspath(export_dir), token=hf_token, catalog=catalog,
+                                     num_workers=num_workers, **export_kwargs)
+                    return export_dir
+                if num_workers > 1:
+                    from hf_pipeline.parallel import parallel_export_field
+                    
+                    manifest = parallel_export_field(output_dir=export_dir, token=hf_token, num_workers=num_workers,
+                                                     **export_kwargs)
+                else:
+                    manifest = export_field(output_dir=export_dir, token=hf_token, max_rows=num_samples,
+                                            **export_kwargs)
+                print(f"✓ 已串流儲存 {manifest['num_rows']} 筆資料至：{export_dir}（{manifest['num_shards']} 個分片）")
+                print("  Schema: {'id': int（穩定 id）, 'text': string, 'source': string, 'source_row': int, 'source_part': int}")
+                print(f"  {format_stats(manifest['filter_stats'])}")
+                if tokenizer:
+                    print(f"  Tokens: {manifest['num_tokens']:,}（{tokenizer}，每筆 token 數存於 num_tokens 欄位）")
+                print(f"  Manifest: {os.path.join(export_dir, MANIFEST_NAME)}")
+                record_table_field(table, field_name, output_dir, hf_token, dataset_name, output_path=export_dir,
+                                   stats={'num_rows': manifest['num_rows'], 'num_tokens': manifest.get('num_tokens')})
+                return export_dir
+            
+            # 準備資料（過濾掉空值），並將樣本中的列位置換算為 split 中的來源列編號
+            records = extract_records(table, field_name, flatten_mode, separator, template)
+            sample_rows = get_sample_rows(table)
+            records = records.set_column(1, 'source_row',
+                                         pa.array(sample_rows[records.column('source_row').to_numpy()]))
+            pipeline = FilterPipeline(filters)
+            records = pipeline.apply(records)
+            dedup = resolve_dedup(dedup)
+            if dedup:
+                # 只與其他來源已匯出的資料比對，單一檔案模式不保存簽章
+                source_params = {'dataset_name': source.get('dataset_name', dataset_name), 'field_name': field_name,
+                                 'config_name': source.get('config_name'), 'split': source.get('split', 'train')}
+                deduplicator = Deduplicator(dedup, output_dir, num_proc=1,
+                                            exclude=same_source_exports(output_dir, source_params))
+                try:
+                    records = deduplicator.apply(records, pipeline.stats)
+                finally:
+                    deduplicator.close()
             if num_samples is not None:
-                data_to_save = df[field_name].head(num_samples)
+                records = records.slice(0, num_samples)
+            if tokenizer:
+                records = TokenCounter(tokenizer, num_proc=1).apply(records)
+            
+            # 以穩定 id 與來源欄位組成 CP schema 並儲存為 parquet
+            cp_table = to_cp_table(records, source_key(
+                source.get('dataset_name', dataset_name), field_name, source.get('config_name'),
+                source.get('split', 'train'), source.get('revision'), flatten_mode))
+            pq.write_table(cp_table, filepath, row_group_size=row_group_size,
+                           **writer_options(encoding, cp_table.schema))
+            
+            num_tokens = int(records.column('num_tokens').to_numpy().sum()) if tokenizer else None
+            print(f"✓ 已儲存 {records.num_rows} 筆資料至：{filepath}")
+            print("  Schema: {'id': int（穩定 id）, 'text': string, 'source': string, 'source_row': int, 'source_part': int}")
+            print(f"  {format_stats(pipeline.stats)}")
+            if tokenizer:
+                print(f"  Tokens: {num_tokens:,}（{tokenizer}）")
+            record_table_field(table, field_name, output_dir, hf_token, dataset_name, output_path=filepath,
+                               stats={'num_rows': records.num_rows, 'num_tokens': num_tokens})
+            
+            return filepath
+        
+        def profile_approved_field(table, field_name, dataset_name, output_dir="./output", num_samples=None,
+                                   streaming=True, batch_size=10000, flatten_mode='explode', separator='\\n',
+                                   template=None, num_workers=1):
+            '''
+            計算欄位的語料統計並寫成 profile JSON
+            
+            以串流方式一次讀過完整 split（與 save_approved_fields_to_parquet 相同的來源與攤平方式），
+            逐批累計筆數、空白率、字數分布（t-digest 分位數）、漢字與繁簡字元比例、粗估 token 數
+            與重複率（HyperLogLog），記憶體用量固定。
+            - num_samples: 只讀取前 num_samples 列，None 表示全部
+            - streaming: False 時只計算 table 中已載入的樣本
+            - num_workers: 大於 1 時依資料檔或 parquet row group 切分，由多個行程分別計算後合併（需 num_samples=None）
+            
+            輸出至 {output_dir}/{dataset}_{field}_profile.json（命名方式與匯出目錄相同），回傳 profile dict；
+            主要統計同時記錄在 {output_dir}/_catalog.sqlite 中該欄位的紀錄
+            '''
+            from hf_pipeline.preview import get_source
+            from hf_pipeline.profiling import format_profile, profile_field, profile_filename, profile_table
+            from hf_pipeline.screening import record_table_field
+            from hf_pipeline.shards import write_json_atomic
+            
+            os.makedirs(output_dir, exist_ok=True)
+            source = get_source(table)
+            filepath = os.path.join(output_dir, profile_filename(dataset_name, field_name, flatten_mode,
+                                                                 source.get('config_name'), source.get('split', 'train')))
+            if streaming:
+                profile = profile_field(
+                    source.get('dataset_name', dataset_name), field_name, output_path=filepath,
+                    config_name=source.get('config_name'), split=source.get('split', 'train'), token=hf_token,
+                    revision=source.get('revision'), flatten_mode=flatten_mode, separator=separator,
+                    template=template, batch_size=batch_size, max_rows=num_samples, num_workers=num_workers,
+                )
             else:
-                data_to_save = df[field_name]
+                profile = profile_table(table, field_name, flatten_mode, separator, template).to_dict()
+                write_json_atomic(filepath, profile)
             
-            # 過濾掉空值
-            data_to_save = data_to_save.dropna()
+            print(f"✓ {field_name} {format_profile(profile)}")
+            print(f"  Profile: {filepath}")
+            summary = {name: profile[name] for name in ('rows', 'values', 'empty_rate', 'cjk_ratio', 'approx_tokens',
+                                                        'duplicate_rate')}
+            record_table_field(table, field_name, output_dir, hf_token, dataset_name,
+                               stats={'profile': {**summary, 'length_p50': profile['length']['p50']}})
+            return profile
+        
+        def estimate_field_tokens(table, field_name, dataset_name, tokenizer, num_samples=2000, flatten_mode='explode',
+                                  separator='\\n', template=None, filters=None, confidence=0.95):
+            '''
+            抽樣估算欄位匯出後的總 token 數（幾秒內完成，不需讀取完整 split）
             
-            # 建立 DataFrame with id and text schema
-            output_df = pd.DataFrame({
-                'id': range(len(data_to_save)),
-                'text': data_to_save.values
-            })
+            從 split 分層抽出 num_samples 列，依匯出相同的攤平方式與品質過濾計算每列 token 數，
+            再依 split 筆數推估總數與 confidence 信賴區間；估計值為去重前的 token 數。
+            回傳 dict（estimated_tokens、lower、upper、mean_tokens_per_row 等）
+            '''
+            from hf_pipeline.preview import get_source
+            from hf_pipeline.tokens import estimate_tokens, format_estimate
             
-            # 儲存為 parquet
-            table = pa.Table.from_pandas(output_df)
-            pq.write_table(table, filepath)
+            source = get_source(table)
+            estimate = estimate_tokens(
+                source.get('dataset_name', dataset_name), field_name, tokenizer, config_name=source.get('config_name'),
+                split=source.get('split', 'train'), token=hf_token, revision=source.get('revision'),
+                flatten_mode=flatten_mode, separator=separator, template=template, filters=filters,
+                num_samples=num_samples, confidence=confidence,
+            )
+            print(f"✓ {field_name} {format_estimate(estimate)}")
+            return estimate
+        
+        def benchmark_parquet_encoding(table, field_name, dataset_name, num_samples=20000, profiles=None,
+                                       row_group_sizes=(50000,), flatten_mode='explode', separator='\\n',
+                                       template=None):
+            '''
+            以欄位的抽樣資料比較 parquet 編碼設定（壓縮方式與等級、dictionary、data page 大小、統計欄位）
             
-            print(f"✓ 已儲存 {len(output_df)} 筆資料至：{filepath}")
-            print(f"  Schema: {{'id': int, 'text': string}}")
+            從 split 分層抽出 num_samples 列並轉為匯出的 CP schema，在記憶體中以每個 profile 與 row group 大小寫入再讀回，
+            印出檔案大小、壓縮率與寫入 / 讀取 MB/s；profiles 為 None 時比較全部 profile（pyarrow、fast、zstd、archive）。
+            回傳結果 list，選定的 profile 以 save_approved_fields_to_parquet(..., encoding=名稱) 套用
+            '''
+            from hf_pipeline.encoding import benchmark_field, format_benchmark
+            from hf_pipeline.preview import get_source
             
-            return filepath
+            source = get_source(table)
+            results = benchmark_field(
+                source.get('dataset_name', dataset_name), field_name, config_name=source.get('config_name'),
+                split=source.get('split', 'train'), token=hf_token, revision=source.get('revision'),
+                flatten_mode=flatten_mode, separator=separator, template=template, num_samples=num_samples,
+                profiles=profiles, row_group_sizes=row_group_sizes,
+            )
+            print(f"✓ {field_name} parquet 編碼比較（{results[0]['num_rows'] if results else 0} 筆）")
+            print(format_benchmark(results))
+            return results
         
-        def trigger_inspector_check(df, text_columns):
-            '''觸發 Inspector 進行語意檢查（一次檢查所有欄位）'''
-            error_msg = "SEMANTIC_CHECK_REQUEST\\n\\n"
-            
-            for field_name in text_columns:
-                samples = df[field_name].dropna().head(5).tolist()
-                error_msg += f"=== 欄位名稱：{field_name} ===\\n"
-                for i, sample in enumerate(samples, 1):
-                    # 限制每個樣本長度避免訊息過長
-                    sample_text = str(sample)
-                    if len(sample_text) > 500:
-                        sample_text = sample_text[:500] + '... (已截斷)'
-                    error_msg += f"樣本{i}：{sample_text}\\n"
-                error_msg += "\\n"
-            
-            raise ValueError(error_msg)
+        def trigger_inspector_check(table, text_columns, output_dir="./output"):
+            '''
+            觸發 Inspector 進行語意檢查（一次檢查所有欄位，每個欄位附上繁簡字元統計與樣本）
+            
+            先查詢 {output_dir}/_catalog.sqlite：同一資料集 revision（commit sha）、subset、split 已判斷過的欄位
+            直接沿用，只有尚未判斷的欄位會送 Inspector（訊息附上 output_dir，判斷結果會寫入同一個 catalog）；
+            全部欄位都已判斷過時不觸發檢查，
+            回傳 {欄位: {'verdict': 'approved' / 'rejected', 'reason': 理由, 'stats': 統計, 'output_path': 輸出路徑}}
+            '''
+            from hf_pipeline.catalog import Catalog
+            from hf_pipeline.screening import cached_verdicts, semantic_check_message, table_catalog_key
+            
+            key = table_catalog_key(table, hf_token)
+            cached = cached_verdicts(Catalog(output_dir), key, text_columns)
+            for field, entry in cached.items():
+                print(f"↻ {field}: {entry['verdict']}（catalog 中已有判斷結果）{entry['reason'] or ''}")
+            
+            pending = [field for field in text_columns if field not in cached]
+            if pending:
+                error_msg = semantic_check_message(table, pending, key, output_dir)
+                raise ValueError(error_msg)
+            return cached
         
         # 主要分析流程
         def analyze_hf_dataset(dataset_name, split="train", num_samples=100):
@@ -212,29 +389,29 @@ class HuggingFaceDatasetAnalyzer(knw):
             3. 根據 Inspector 回饋儲存認可的欄位
             '''
             # 步驟 1：載入並展示資料集
-            df = load_and_display_dataset(dataset_name, split, num_samples)
+            table = load_and_display_dataset(dataset_name, split, num_samples)
             
             # 步驟 2：觸發 Inspector 檢查（針對所有文字欄位）
+            from hf_pipeline.fields import find_text_fields
+            
             print("\\n開始進行 CP 適用性檢查...")
-            text_columns = []
-            for column in df.columns:
-                # 檢查是否為文字類型欄位
-                sample_value = df[column].dropna().head(1).tolist()
-                if sample_value and isinstance(sample_value[0], str):
-                    text_columns.append(column)
+            # 依 schema 找出所有字串欄位，包含巢狀欄位（如 messages[].content），不需要掃描資料
+            text_columns = find_text_fields(table.schema)
             
             # 逐一觸發檢查（系統會在每次 ValueError 後由 Inspector 處理）
             if text_columns:
                 print(f"找到 {len(text_columns)} 個文字欄位需要檢查：{text_columns}")
-                # 一次性檢查所有文字欄位
-                trigger_inspector_check(df, text_columns)
+                # 一次性檢查所有文字欄位（catalog 中都已判斷過時直接回傳判斷結果）
+                return trigger_inspector_check(table, text_columns)
             else:
                 print("⚠ 未找到文字類型欄位")
                 return None
         
         # 使用範例
         # Step 1: 初次執行會觸發 Inspector 檢查
+        # table = load_and_display_dataset("username/dataset_name", split="train", num_samples=100)
         # result = analyze_hf_dataset("username/dataset_name", split="train", num_samples=100)
+        # 同一 revision 的欄位都判斷過時不會觸發檢查，result 為 catalog 中的判斷結果 {欄位: {'verdict': ..., 'reason': ...}}
         
         # Step 2: Inspector 回饋後，使用以下代碼儲存認可的欄位
         # inspector_results = {
@@ -248,11 +425,13 @@ class HuggingFaceDatasetAnalyzer(knw):
         # for field, result in inspector_results.items():
         #     if result['approved']:
         #         save_approved_fields_to_parquet(
-        #             df=df,
+        #             table=table,
         #             field_name=field,
         #             dataset_name='username/dataset_name',
-        #             num_samples=10  # 測試用，改為 None 儲存全部
+        #             num_samples=None  # None 以串流方式儲存完整 split
         #         )
+        #         profile_approved_field(table, field, 'username/dataset_name')  # 欄位統計 profile JSON
+        #         estimate_field_tokens(table, field, 'username/dataset_name', tokenizer='model/name')  # 抽樣估算 token 預算
         """
 
 
@@ -1,3 +1,4 @@
+import hashlib
 import inspect
 import textwrap
 
@@ -8,6 +9,8 @@ class knw:
     def __init__(self):
         self.name = 'knowledge_integration'
         self.description = 'Integrate knowledge into the LLM.'
+        # extra words for the BM25 retrieval backend, e.g. the Chinese and English terms users write for this knowledge
+        self.keywords = ''
         self.core_function = 'core_function'
         self.runnable_function = None
         self.mode = 'full'
@@ -38,4 +41,27 @@ class knw:
             return ''
 
     def get_all_code(self):
-        return self.get_runnable_function() + self.get_core_function()
\ No newline at end of file
+        return self.get_runnable_function() + self.get_core_function()
+
+    def get_retrieval_key(self):
+        """
+        Text matched against the user instruction during retrieval.
+        """
+        return self.name + self.description
+
+    def get_retrieval_terms(self):
+        """
+        Text indexed by the lexical retrieval backend, which cannot match a word to its translation.
+        """
+        return ' '.join([self.name, self.description, self.keywords])
+
+    def fingerprint(self):
+        """
+        Hash of the name, description and code, used to invalidate the persisted key embedding.
+        """
+        try:
+            code = inspect.getsource(type(self))
+        except (OSError, TypeError):  # source is unavailable, e.g. in a frozen build
+            code = self.get_all_code()
+        content = '\0'.join([self.name, self.description, self.keywords, code])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
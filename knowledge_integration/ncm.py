@@ -7,6 +7,7 @@ class Nearest_Correlation_Matrix(knw):
         super().__init__()
         self.name = 'nearest_correlation_matrix'
         self.description = 'The function calculates the nearest correlation matrix using the quadratically convergent newton method. Acceptable parameters: Sigma, b>0, tau>=0, and tol (tolerance error) For the correlation matrix problem, set b = np.ones((n,1)).'
+        self.keywords = '最近相關矩陣 最接近的相關係數矩陣 半正定 牛頓法 nearest closest correlation matrix positive semidefinite'
         self.core_function = 'core'
         self.runnable_function = 'runnable'
         self.mode = 'core'
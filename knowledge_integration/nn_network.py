@@ -28,6 +28,7 @@ class nn_networks(knw):
 
         return res: The console information, including training parameters and training and testing loss for each epoch.
         """
+        self.keywords = '非負神經網路 不動點 固定點 nonnegative neural network fixed point sigmoid mnist'
         self.core_function = 'core'
         self.runnable_function = 'runnable'
         self.mode = 'core'
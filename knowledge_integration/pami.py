@@ -6,6 +6,7 @@ class pattern_mining(knw):
         super().__init__()
         self.name = "pami"
         self.description = "The pami library is a Python library for pattern mining. User can choose many algorithms like FP-growth algorithm. For Transactional_T10I4D100K.csv, the separator should be '\\t'"
+        self.keywords = "頻繁模式探勘 頻繁樣式 頻繁項目集 交易資料 frequent pattern itemset mining transactions"
         self.core_function = "pami"
         self.mode = 'full'
 
@@ -1,9 +1,18 @@
-import torch
+import ast
+import atexit
+import hashlib
+import json
+import math
+import os
+import re
 import sys
-from sentence_transformers import SentenceTransformer, util
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
 import numpy as np
 # from knw import KNW_INJECTION, knowledge_injection
-from prompt_engineering.prompts import PMT_KNW_IN_CORE, PMT_KNW_IN_FULL
+from prompt_engineering.prompts import PMT_KNW_IN_CORE, PMT_KNW_IN_FULL, PMT_KNW_IN_SUMMARY
 # from config import rag_mode
 from knowledge_integration.ncm import Nearest_Correlation_Matrix
 from knowledge_integration.nn_network import nn_networks
@@ -13,36 +22,604 @@ from kernel import execute
 
 
 KNW_INJECTION = {}
+EMBEDDING_MODEL = 'BAAI/bge-m3'
+SMALL_EMBEDDING_MODEL = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+# key embeddings of the registered knowledge, rebuilt incrementally when a knw subclass changes;
+# knowledge modules are imported once, so edits to their code take effect after a restart
+KNW_INDEX_PATH = os.environ.get('LAMBDA_KNW_INDEX', os.path.join('cache', 'knw_index.npz'))
+SIMILARITY_THRESHOLD = 0.5
+DEFAULT_RETRIEVAL_BACKEND = 'bge-m3'
+# at most top_k knowledge items above the threshold are injected; the best one always in full,
+# the others within token_budget (approximate) tokens
+DEFAULT_TOP_K = 3
+DEFAULT_TOKEN_BUDGET = 8000
+# a hit after the best one is kept only if it clears the threshold by at least this fraction of the best hit's margin
+SECONDARY_HIT_MARGIN = 0.5
+# routing decisions of recent instructions, see RetrievalCache
+RETRIEVAL_CACHE_PATH = os.environ.get('LAMBDA_KNW_RETRIEVAL_CACHE', os.path.join('cache', 'knw_retrieval_cache.json'))
+RETRIEVAL_CACHE_SIZE = 1024
+# new routing decisions are written to the cache file at most this often, and at exit
+RETRIEVAL_CACHE_FLUSH_SECONDS = 5.0
+# labelled instructions for benchmark_backends: [{"instruction": ..., "knowledge": knw name or null}]
+RETRIEVAL_EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'knowledge_integration',
+                                       'retrieval_examples.json')
 
 def knowledge_register():
+    if KNW_INJECTION:
+        return
     ncm = Nearest_Correlation_Matrix()
-    ncm_key = ncm.name+ncm.description
-    KNW_INJECTION[ncm_key] = ncm
+    KNW_INJECTION[ncm.get_retrieval_key()] = ncm
     nnn = nn_networks()
-    nnn_key = nnn.name+nnn.description
-    KNW_INJECTION[nnn_key] = nnn
+    KNW_INJECTION[nnn.get_retrieval_key()] = nnn
     pami = pattern_mining()
-    pami_key = pami.name+pami.description
-    KNW_INJECTION[pami_key] = pami
+    KNW_INJECTION[pami.get_retrieval_key()] = pami
     hf_analyzer = HuggingFaceDatasetAnalyzer()
-    hf_key = hf_analyzer.name+hf_analyzer.description
-    KNW_INJECTION[hf_key] = hf_analyzer
+    KNW_INJECTION[hf_analyzer.get_retrieval_key()] = hf_analyzer
 
-embeding_model = SentenceTransformer('BAAI/bge-m3')
 
-def search_knowledge(user_input, knowledge_embeddings, knowledge_keys):
-    input_embedding = embeding_model.encode(user_input, convert_to_tensor=True)
-    similarities_list = util.pytorch_cos_sim(input_embedding, knowledge_embeddings)
-    if torch.max(similarities_list) > 0.5:
-        best_match_idx = np.argmax(similarities_list.cpu())
-        best_match_key = knowledge_keys[best_match_idx]
+
+class EmbeddingService:
+    """
+    The retrieval encoder, loaded on first use so that sessions without retrieval never import torch
+    or load the model. warm_up() loads it in a background thread; callers that need it before the
+    warm-up finishes wait for it instead of loading a second copy.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+        self._warm_up_thread = None
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                print(f"Loading retrieval model {self.model_name}...")
+                self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def is_loaded(self):
+        return self._model is not None
+
+    def warm_up(self, callback=None):
+        """
+        Load the model in a daemon thread and then run `callback`, without blocking the caller.
+        """
+        if self._warm_up_thread is None:
+            self._warm_up_thread = threading.Thread(target=self._warm_up, args=(callback,), name='knw-warm-up',
+                                                    daemon=True)
+            self._warm_up_thread.start()
+        return self._warm_up_thread
+
+    def _warm_up(self, callback):
+        try:
+            self.model
+            if callback is not None:
+                callback()
+        except Exception as e:
+            print(f"Warning: failed to warm up the retrieval model, it will be loaded on first use: {e}")
+
+    def encode(self, texts):
+        # normalized embeddings, so the dot product is the cosine similarity
+        return self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+class KnowledgeIndex:
+    """
+    Key embeddings of the registered knowledge, persisted to `path` and keyed by knw.fingerprint().
+    Only the knowledge whose name, description or code changed is encoded again.
+    """
+
+    def __init__(self, encode, model_name=EMBEDDING_MODEL, path=None):
+        self.encode = encode
+        self.model_name = model_name
+        self.path = path or knowledge_index_path(model_name)
+        self.embeddings = {}  # fingerprint -> embedding
+        self._matrix = None  # (knowledge_state, keys, stacked embeddings) of the last update
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data['model']) != self.model_name:
+                    return
+                self.embeddings = dict(zip(data['fingerprints'].tolist(), data['embeddings']))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Knowledge index {self.path} is unreadable and will be rebuilt: {e}")
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + '.tmp.npz'  # np.savez appends .npz to other names
+        np.savez(tmp_path, model=np.array(self.model_name), fingerprints=np.array(list(self.embeddings)),
+                 embeddings=np.stack(list(self.embeddings.values())))
+        os.replace(tmp_path, self.path)
+
+    def update(self, knowledge):
+        """
+        Sync the index with `knowledge` ({key: knw}) and return (keys, embedding matrix in the same order).
+        The matrix is reused while knowledge_state() is unchanged, so a lookup is a single matrix-vector product;
+        replacing an item or editing its name or description re-checks the fingerprints.
+        """
+        keys = list(knowledge)
+        state = knowledge_state(knowledge)
+        matrix = self._matrix
+        if matrix is not None and matrix[0] == state:
+            return matrix[1:]
+        fingerprints = {key: item.fingerprint() for key, item in knowledge.items()}
+        with self._lock:
+            missing = [key for key, fingerprint in fingerprints.items() if fingerprint not in self.embeddings]
+            stale = set(self.embeddings) - set(fingerprints.values())
+            if missing:
+                print(f"Knowledge index: encoding {len(missing)} new or changed knowledge item(s)")
+                self.embeddings.update(zip([fingerprints[key] for key in missing], self.encode(missing)))
+            for fingerprint in stale:
+                del self.embeddings[fingerprint]
+            if (missing or stale) and self.embeddings:
+                self._save()
+            self._matrix = (state, keys, np.stack([self.embeddings[fingerprints[key]] for key in keys]))
+            return self._matrix[1:]
+
+
+def knowledge_state(knowledge):
+    """
+    Cheap stand-in for the fingerprints of `knowledge`: changes when an item is re-created from a
+    reloaded class or gets another name, description or keywords, so that knw.fingerprint() is only recomputed then.
+    """
+    return tuple((key, type(item), item.name, item.description, item.keywords) for key, item in knowledge.items())
+
+
+def knowledge_index_path(model_name):
+    """
+    KNW_INDEX_PATH for the default model, a sibling file per model for the others.
+    """
+    if model_name == EMBEDDING_MODEL:
+        return KNW_INDEX_PATH
+    root, ext = os.path.splitext(KNW_INDEX_PATH)
+    return f"{root}_{re.sub(r'[^A-Za-z0-9.-]+', '_', model_name)}{ext}"
+
+
+class RetrievalBackend:
+    """
+    Scores the registered knowledge against an instruction. Subclasses implement score();
+    search() returns the best keys above the backend's threshold.
+    """
+
+    name = None
+
+    def __init__(self, threshold=SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+
+    def warm_up(self):
+        """
+        Prepare the backend without blocking the caller, returns the background thread or None.
+        """
+        return None
+
+    def cache_id(self):
+        """
+        Identifies the backend and its settings in the retrieval cache.
+        """
+        return f"{self.name}:{self.threshold}"
+
+    def score(self, instruction, knowledge):
+        """
+        Return (keys, scores) for `knowledge` ({key: knw}), scores is a numpy array in the order of keys.
+        """
+        raise NotImplementedError
+
+    def search(self, instruction, knowledge, top_k=1, margin=SECONDARY_HIT_MARGIN):
+        """
+        Return up to top_k (key, score) pairs above the threshold, best first. The hits after the best one
+        must also score at least threshold + margin * (best score - threshold), so that a weak match is not
+        injected next to a clear one.
+        """
+        keys, scores = self.score(instruction, knowledge)
+        if not keys:
+            return []
+        top_k = min(top_k, len(keys))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        cutoff = self.threshold + margin * (scores[best[0]] - self.threshold)
+        return [(keys[i], float(scores[i])) for n, i in enumerate(best)
+                if scores[i] > self.threshold and (n == 0 or scores[i] >= cutoff)]
+
+
+class EmbeddingBackend(RetrievalBackend):
+    """
+    Cosine similarity between SentenceTransformer embeddings, key embeddings come from a persisted KnowledgeIndex.
+    """
+
+    name = 'bge-m3'
+
+    def __init__(self, model=EMBEDDING_MODEL, threshold=SIMILARITY_THRESHOLD, index_path=None):
+        super().__init__(threshold)
+        self.service = EmbeddingService(model)
+        self.index_path = index_path
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    @property
+    def index(self):
+        with self._index_lock:
+            if self._index is None:
+                self._index = KnowledgeIndex(self.service.encode, self.service.model_name, self.index_path)
+        return self._index
+
+    def warm_up(self):
+        return self.service.warm_up(callback=lambda: self.index.update(registered_knowledge()))
+
+    def cache_id(self):
+        return f"{self.name}:{self.service.model_name}:{self.threshold}"
+
+    def score(self, instruction, knowledge):
+        # only the instruction is encoded here, the key embeddings come from the persisted index
+        keys, embeddings = self.index.update(knowledge)
+        return keys, embeddings @ self.service.encode([instruction])[0]
+
+
+class SmallEncoderBackend(EmbeddingBackend):
+    """
+    EmbeddingBackend with a small multilingual encoder, several times faster than BGE-M3 on CPU.
+    """
+
+    name = 'small'
+
+    def __init__(self, model=SMALL_EMBEDDING_MODEL, threshold=SIMILARITY_THRESHOLD, index_path=None):
+        super().__init__(model, threshold, index_path)
+
+
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_TOKEN_PATTERN = re.compile(f'[a-z0-9]+|[{_CJK}]+')
+_STOPWORDS = frozenset(
+    'a an and are as at be by can do for from how i in is it me my of on or please should the this to use user '
+    'using we what which with you'.split()
+)
+
+
+def tokenize(text, ngram=2):
+    """
+    Lowercase English words (without stopwords and plural 's') plus CJK character n-grams, for mixed
+    Chinese and English text.
+    """
+    tokens = []
+    for word in _TOKEN_PATTERN.findall(unicodedata.normalize('NFKC', text).lower()):
+        if word[0].isascii():
+            if word not in _STOPWORDS:
+                tokens.append(word[:-1] if len(word) > 3 and word[-1] == 's' and word[-2] not in 'su' else word)
+        elif len(word) < ngram:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + ngram] for i in range(len(word) - ngram + 1))
+    return tokens
+
+
+class BM25Backend(RetrievalBackend):
+    """
+    Okapi BM25 over words and CJK character n-grams, pure Python with no model to load. Each knowledge item
+    is indexed by knw.get_retrieval_terms(), its keywords carry the translations the word match cannot make.
+
+    The score is normalized by the best score the instruction could reach (every query term present and
+    saturated, terms that no knowledge contains count with the highest idf), so it lies in [0, 1] and
+    instructions that share only a few common terms with a key score low.
+    """
+
+    name = 'bm25'
+
+    def __init__(self, threshold=0.08, k1=1.5, b=0.75, ngram=2):
+        super().__init__(threshold)
+        self.k1 = k1
+        self.b = b
+        self.ngram = ngram
+        self._fitted = None  # (documents, postings, idf)
+
+    def cache_id(self):
+        return f"{self.name}:{self.threshold}:{self.k1}:{self.b}:{self.ngram}"
+
+    def _fit(self, documents):
+        # the BM25 weight of a term in a document does not depend on the query, so it is computed once
+        # per knowledge set and stored as postings {term: (document indices, weights)}
+        if self._fitted is None or self._fitted[0] != documents:
+            docs = [Counter(tokenize(document, self.ngram)) for document in documents]
+            lengths = np.array([sum(doc.values()) for doc in docs], dtype=np.float64)
+            norms = self.k1 * (1 - self.b + self.b * lengths / max(lengths.mean(), 1.0)) if docs else lengths
+            postings = {}
+            for i, doc in enumerate(docs):
+                for term, tf in doc.items():
+                    postings.setdefault(term, ([], []))
+                    postings[term][0].append(i)
+                    postings[term][1].append(tf * (self.k1 + 1) / (tf + norms[i]))
+            idf = {term: math.log(1 + (len(docs) - len(rows) + 0.5) / (len(rows) + 0.5))
+                   for term, (rows, _) in postings.items()}
+            postings = {term: (np.array(rows), idf[term] * np.array(weights)) for term, (rows, weights) in postings.items()}
+            self._fitted = (documents, postings, idf)
+        return self._fitted
+
+    def score(self, instruction, knowledge):
+        keys = list(knowledge)
+        _, postings, idf = self._fit([item.get_retrieval_terms() for item in knowledge.values()])
+        terms = set(tokenize(instruction, self.ngram))
+        unseen_idf = math.log(1 + (len(keys) + 0.5) / 0.5)
+        scores = np.zeros(len(keys))
+        for term in terms:
+            if term in postings:
+                rows, weights = postings[term]
+                scores[rows] += weights
+        best_possible = sum(idf.get(term, unseen_idf) for term in terms) * (self.k1 + 1)
+        return keys, scores / best_possible if best_possible else scores
+
+
+RETRIEVAL_BACKENDS = {backend.name: backend for backend in (BM25Backend, SmallEncoderBackend, EmbeddingBackend)}
+
+
+def make_backend(spec=None):
+    """
+    spec is a backend name ('bm25', 'small' or 'bge-m3'), None for DEFAULT_RETRIEVAL_BACKEND, or a dict
+    with 'name' and the backend's options, e.g. {'name': 'small', 'model': '...', 'threshold': 0.4}.
+    """
+    if spec is None:
+        spec = DEFAULT_RETRIEVAL_BACKEND
+    options = dict(spec) if isinstance(spec, dict) else {'name': spec}
+    name = options.pop('name', DEFAULT_RETRIEVAL_BACKEND)
+    if name not in RETRIEVAL_BACKENDS:
+        raise ValueError(f"Unknown retrieval backend: {name}, please choose from {list(RETRIEVAL_BACKENDS)}.")
+    return RETRIEVAL_BACKENDS[name](**options)
+
+
+retrieval_backend = None
+retrieval_cache = None
+_retrieval_backend_lock = threading.Lock()
+RETRIEVAL_SETTINGS = {'top_k': DEFAULT_TOP_K, 'token_budget': DEFAULT_TOKEN_BUDGET, 'cache': True}
+
+def configure_retrieval(spec=None, top_k=None, token_budget=None, cache=None):
+    """
+    Select the retrieval backend, the injection limits and the routing cache from the `retrieval_backend`,
+    `retrieval_top_k`, `retrieval_token_budget` and `retrieval_cache` entries of config.yaml, None keeps the
+    defaults. cache is True (RETRIEVAL_CACHE_PATH), False (no cache) or the path of the cache file.
+    """
+    global retrieval_backend, retrieval_cache
+    if top_k is not None and top_k < 1:
+        raise ValueError(f"retrieval_top_k must be at least 1, got {top_k}.")
+    if token_budget is not None and token_budget < 1:
+        raise ValueError(f"retrieval_token_budget must be positive, got {token_budget}.")
+    if cache is not None and not isinstance(cache, (bool, str)):
+        raise ValueError(f"retrieval_cache must be True, False or a file path, got {cache!r}.")
+    with _retrieval_backend_lock:
+        retrieval_backend = make_backend(spec)
+        if retrieval_cache is not None:
+            retrieval_cache.flush()
+        retrieval_cache = None
+    RETRIEVAL_SETTINGS['top_k'] = top_k or DEFAULT_TOP_K
+    RETRIEVAL_SETTINGS['token_budget'] = token_budget or DEFAULT_TOKEN_BUDGET
+    RETRIEVAL_SETTINGS['cache'] = True if cache is None else cache
+    return retrieval_backend
+
+
+def get_retrieval_backend():
+    global retrieval_backend
+    with _retrieval_backend_lock:
+        if retrieval_backend is None:
+            retrieval_backend = make_backend()
+    return retrieval_backend
+
+
+def registered_knowledge():
+    knowledge_register()
+    return KNW_INJECTION
+
+
+def get_retrieval_cache():
+    global retrieval_cache
+    setting = RETRIEVAL_SETTINGS['cache']
+    if setting is False:
+        return None
+    with _retrieval_backend_lock:
+        if retrieval_cache is None:
+            retrieval_cache = RetrievalCache(setting if isinstance(setting, str) else RETRIEVAL_CACHE_PATH)
+    return retrieval_cache
+
+
+# Hugging Face Hub ids namespace/name[@revision] that are not part of a path or URL
+_DATASET_ID_PATTERN = re.compile(r'(?<![\w./@~-])[a-z0-9][a-z0-9_.-]*/[a-z0-9_.-]*[a-z0-9](?:@[a-z0-9_.-]+)?'
+                                 r'(?![\w/:@~-]|\.\w)')
+_FILE_EXTENSIONS = ('.csv', '.tsv', '.json', '.jsonl', '.parquet', '.txt', '.xls', '.xlsx', '.py')
+# a plain word/word pair such as tcp/ip or and/or is only taken for an id right after a dataset cue
+_PLAIN_WORD_PAIR = re.compile(r'[a-z]+/[a-z]+')
+_DATASET_CUE = re.compile(r'(?:資料集|數據集|dataset|hub|hf|hugging ?face)[\s:="\'`「(]*$')
+_PUNCTUATION_SPACES = re.compile(r'\s*([^\w\s<>])\s*')
+
+
+def _mask_dataset_id(match):
+    dataset_id = match.group()
+    if dataset_id.endswith(_FILE_EXTENSIONS):  # a relative file path such as data/a.csv
+        return dataset_id
+    if _PLAIN_WORD_PAIR.fullmatch(dataset_id) and not _DATASET_CUE.search(match.string, 0, match.start()):
+        return dataset_id
+    return '<dataset>'
+
+
+def normalize_instruction(instruction):
+    """
+    NFKC, lowercase and collapsed whitespace (none around punctuation), with Hub dataset ids masked as
+    <dataset>, so that "請分析 Hugging Face 資料集：A/B" and "請分析 Hugging Face 資料集: C/D" share a cache entry.
+    """
+    text = _DATASET_ID_PATTERN.sub(_mask_dataset_id, unicodedata.normalize('NFKC', instruction).lower())
+    return _PUNCTUATION_SPACES.sub(r'\1', ' '.join(text.split()))
+
+
+_knowledge_versions = {}
+
+def knowledge_version(knowledge):
+    """
+    Hash of the keys and fingerprints of `knowledge`, cached routing decisions are dropped when it changes.
+    """
+    state = knowledge_state(knowledge)
+    if state not in _knowledge_versions:
+        content = '\0'.join(f"{key}\0{knowledge[key].fingerprint()}" for key in sorted(knowledge))
+        _knowledge_versions[state] = hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+    return _knowledge_versions[state]
+
+
+class RetrievalCache:
+    """
+    Routing decisions ([(key, score)] from RetrievalBackend.search) of recent instructions: an in-memory
+    LRU of `maxsize` entries mirrored to a JSON file, so repeated instructions return without the encoder.
+    Entries are keyed by the backend settings, the knowledge version, top_k and the normalized instruction.
+    set() only updates memory; the file is rewritten by a background timer `flush_seconds` after the first
+    unsaved entry and at exit, so a burst of new instructions costs one write.
+    """
+
+    def __init__(self, path=RETRIEVAL_CACHE_PATH, maxsize=RETRIEVAL_CACHE_SIZE,
+                 flush_seconds=RETRIEVAL_CACHE_FLUSH_SECONDS):
+        self.path = path
+        self.maxsize = maxsize
+        self.flush_seconds = flush_seconds
+        self.entries = OrderedDict()  # key -> {'instruction': normalized instruction, 'results': [[key, score]]}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._flush_timer = None
+        self._load()
+        atexit.register(self.flush)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.entries = OrderedDict(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Retrieval cache {self.path} is unreadable and will be rebuilt: {e}")
+
+    def flush(self):
+        """
+        Write the entries to the file if any changed since the last write.
+        """
+        with self._write_lock:
+            with self._lock:
+                if self._flush_timer is None:
+                    return
+                self._flush_timer.cancel()
+                self._flush_timer = None
+                entries = list(self.entries.items())
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def make_key(backend, knowledge, instruction, top_k):
+        content = '\0'.join([backend.cache_id(), knowledge_version(knowledge), str(top_k), str(SECONDARY_HIT_MARGIN),
+                             normalize_instruction(instruction)])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return [tuple(result) for result in entry['results']]
+
+    def set(self, key, instruction, results):
+        with self._lock:
+            self.entries[key] = {'instruction': normalize_instruction(instruction),
+                                 'results': [list(result) for result in results]}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_seconds, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+
+def warm_up_retrieval():
+    """
+    Prepare the configured backend in the background (load the encoder and sync the knowledge index),
+    called at startup when retrieval is enabled.
+    """
+    return get_retrieval_backend().warm_up()
+
+
+def search_knowledge(user_input, knowledge=None, backend=None, top_k=1, cache=None):
+    """
+    Return up to top_k (key, knw, score) above the backend's threshold, best first.
+    With a RetrievalCache, a cached routing decision for the same normalized instruction is returned
+    without running the backend.
+    """
+    knowledge = registered_knowledge() if knowledge is None else knowledge
+    backend = backend or get_retrieval_backend()
+    if cache is None:
+        results = backend.search(user_input, knowledge, top_k)
     else:
-        best_match_key = False
-    return (best_match_key, KNW_INJECTION[best_match_key]) if best_match_key else (False, None)
+        cache_key = cache.make_key(backend, knowledge, user_input, top_k)
+        results = cache.get(cache_key)
+        if results is None:
+            results = backend.search(user_input, knowledge, top_k)
+            cache.set(cache_key, user_input, results)
+    return [(key, knowledge[key], score) for key, score in results if key in knowledge]
+
+
+_CJK_CHAR_PATTERN = re.compile(f'[{_CJK}]')
+
 
+def approx_tokens(text):
+    """
+    Rough prompt token count: one per CJK character, one per four other characters.
+    """
+    cjk = len(_CJK_CHAR_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
 
-def format_code_snaps(knw, kernel):
+
+def code_outline(code):
+    """
+    Signatures of the functions and classes defined in `code`, each followed by the first docstring line.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return ''
+    lines = []
+
+    def visit(nodes, indent):
+        for node in nodes:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                line = f"{indent}def {node.name}({ast.unparse(node.args)})"
+            elif isinstance(node, ast.ClassDef):
+                line = f"{indent}class {node.name}"
+            else:
+                continue
+            doc = (ast.get_docstring(node) or '').strip().splitlines()
+            lines.append(line + (f"  # {doc[0]}" if doc else ''))
+            if isinstance(node, ast.ClassDef):
+                visit(node.body, indent + '    ')
+
+    visit(tree.body, '')
+    return '\n'.join(lines)
+
+
+def format_code_snaps(knw, kernel, summary=False):
+    """
+    Render a knowledge item for injection. summary=True lists only the description and the function
+    signatures, used when the whole code does not fit the token budget.
+    """
     desc = knw.description
+    if summary:
+        if knw.mode == 'core':
+            execute(knw.get_runnable_function(), kernel)
+            note = "這些函數和類都已在後端定義和執行，您可以直接使用它們。"
+        else:
+            note = "完整程式碼超過檢索的長度預算而未提供，請參考描述與函數簽名撰寫程式碼。"
+        return PMT_KNW_IN_SUMMARY.format(desc=desc, outline=code_outline(knw.get_all_code()), note=note)
     core_code = knw.get_core_function()
     if knw.mode == 'full':
         print("Knowledge_integration in full mode")
@@ -57,13 +634,109 @@ def format_code_snaps(knw, kernel):
         raise ValueError(f"Invalid mode: {knw.mode}, please choose from ['full', 'core'].")
 
 
-def retrieval_knowledge(instruction, kernel): # return code_snaps and mode: 'full' or runnable code in 'core'. Nothing retrieval, return None
-    knowledge_register()
-    knowledge_keys = list(KNW_INJECTION.keys())
-    knowledge_embeddings = embeding_model.encode(knowledge_keys, convert_to_tensor=True)
-    best_key, best_knw_object = search_knowledge(instruction, knowledge_embeddings, knowledge_keys)
-    if best_key:
-        return format_code_snaps(best_knw_object, kernel)
+def format_retrieved_snippets(results, kernel, token_budget=DEFAULT_TOKEN_BUDGET):
+    """
+    Render the search results best first. The best hit is always injected in full and token_budget only
+    limits the further hits: each one is injected in full if it fits the remaining budget, as a summary
+    (description and signatures) if only that fits, otherwise it is skipped.
+    """
+    if not results:
+        return ''
+    (_, best, score), *others = results
+    print(f"Knowledge_integration: {best.name} (score {score:.3f})")
+    snaps, remaining = [format_code_snaps(best, kernel)], token_budget
+    for key, knw, score in others:
+        summary = approx_tokens(knw.description + knw.get_all_code()) > remaining
+        if summary and approx_tokens(knw.description + code_outline(knw.get_all_code())) > remaining:
+            print(f"Knowledge_integration: skip {knw.name} (score {score:.3f}), over the token budget")
+            continue
+        snap = format_code_snaps(knw, kernel, summary=summary)
+        print(f"Knowledge_integration: {knw.name} (score {score:.3f}){' as a summary' if summary else ''}")
+        snaps.append(snap)
+        remaining -= approx_tokens(snap)
+    return ''.join(snaps)
+
+
+def retrieval_knowledge(instruction, kernel): # return code_snaps of the top-k knowledge within the token budget. Nothing retrieval, return None
+    results = search_knowledge(instruction, top_k=RETRIEVAL_SETTINGS['top_k'], cache=get_retrieval_cache())
+    if results:
+        return format_retrieved_snippets(results, kernel, RETRIEVAL_SETTINGS['token_budget']) or None
     else:
         return None
 
+
+def load_retrieval_examples(path=RETRIEVAL_EXAMPLES_PATH):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def benchmark_backends(backends=None, examples=None, repeat=3):
+    """
+    Compare retrieval backends on labelled instructions ({"instruction", "knowledge": knw name or None}).
+
+    Per backend: per-query latency (best of `repeat`, after the model is loaded and the index is synced),
+    top-1 accuracy on the instructions that have a label (argmax only, ignoring the threshold), and
+    routing accuracy on all instructions (the labelled knowledge above the threshold, or nothing for
+    unlabelled ones).
+    """
+    backends = backends or list(RETRIEVAL_BACKENDS)
+    examples = load_retrieval_examples() if examples is None else examples
+    knowledge = registered_knowledge()
+    names = {key: item.name for key, item in knowledge.items()}
+    results = []
+    for spec in backends:
+        backend = make_backend(spec)
+        started = time.perf_counter()
+        backend.score('warm up', knowledge)
+        setup_seconds = time.perf_counter() - started
+
+        latencies, top1, routed, labelled = [], 0, 0, 0
+        for example in examples:
+            best_seconds = float('inf')
+            for _ in range(repeat):
+                started = time.perf_counter()
+                keys, scores = backend.score(example['instruction'], knowledge)
+                best_seconds = min(best_seconds, time.perf_counter() - started)
+            latencies.append(best_seconds)
+            best = int(np.argmax(scores))
+            retrieved = names[keys[best]] if scores[best] > backend.threshold else None
+            if example['knowledge'] is not None:
+                labelled += 1
+                top1 += names[keys[best]] == example['knowledge']
+            routed += retrieved == example['knowledge']
+        latencies = np.array(latencies) * 1000
+        results.append({
+            'backend': backend.name,
+            'setup_seconds': setup_seconds,
+            'mean_ms': float(latencies.mean()),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'top1_accuracy': top1 / labelled if labelled else 0.0,
+            'routing_accuracy': routed / len(examples) if examples else 0.0,
+            'num_examples': len(examples),
+        })
+    return results
+
+
+def format_backend_benchmark(results):
+    lines = [f"{'backend':<10}{'setup (s)':>10}{'mean ms':>10}{'p95 ms':>10}{'top-1':>8}{'routing':>9}"]
+    for result in results:
+        lines.append(f"{result['backend']:<10}{result['setup_seconds']:>10.2f}{result['mean_ms']:>10.2f}"
+                     f"{result['p95_ms']:>10.2f}{result['top1_accuracy']:>8.1%}{result['routing_accuracy']:>9.1%}")
+    return '\n'.join(lines)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compare the latency and accuracy of the knowledge retrieval backends')
+    parser.add_argument('--backends', nargs='+', default=None, choices=list(RETRIEVAL_BACKENDS),
+                        help='backends to compare, all by default')
+    parser.add_argument('--examples', default=RETRIEVAL_EXAMPLES_PATH, help='labelled instructions (JSON)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    results = benchmark_backends(args.backends, load_retrieval_examples(args.examples), args.repeat)
+    print(format_backend_benchmark(results))
+
+
+if __name__ == '__main__':
+    main()
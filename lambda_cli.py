@@ -5,6 +5,8 @@ LAMBDA CLI - Command Line Interface for LAMBDA
     python lambda_cli.py                    # 互動模式
     python lambda_cli.py "your question"    # 單次查詢
     python lambda_cli.py -f data.csv        # 上傳檔案後互動
+    python lambda_cli.py -b datasets.txt    # 批次初篩多個 HF 資料集並輸出報表
+    python lambda_cli.py compact            # 合併 ./output 中的匯出結果並更新 catalog
 """
 
 import sys
@@ -74,6 +76,50 @@ class LAMBDACLI:
         print(f"✅ {data_info}\n")
         return True
 
+    def batch_analyze(self, dataset_ids, report_path, split="train", num_samples=100, max_workers=4, refresh=False):
+        """
+        批次初篩多個資料集（headless，不經過 Programmer 與 kernel）
+
+        metadata 查詢、抽樣與預評分由 thread pool 同時處理，只有 Inspector 呼叫依完成順序排隊逐一送出；
+        每完成一個資料集就更新一次報表，最後的報表包含每個資料集、欄位的判斷結果。
+        判斷結果寫入 ./output 的 catalog，同一 revision 已判斷過的欄位直接沿用；refresh=True 時全部重新判斷。
+        """
+        from hf_pipeline import screening
+        from hf_pipeline.catalog import Catalog
+
+        hf_token = os.environ.get('HF_KEY') or os.environ.get('HF_TOKEN') or os.environ.get('HUGGING_FACE_HUB_TOKEN')
+        catalog = Catalog()
+        rows = []
+        results = screening.prescore_datasets(dataset_ids, max_workers=max_workers, split=split,
+                                              num_samples=num_samples, token=hf_token,
+                                              catalog=None if refresh else catalog)
+        for done, result in enumerate(results, 1):
+            print(f"\n▶ [{done}/{len(dataset_ids)}] {result['dataset']}")
+            if result['cached']:
+                print("↻ 沿用 catalog 中的判斷結果")
+            if result['message'] is not None:
+                print("🔍 Inspector 檢查中...")
+                code = f"analyze_hf_dataset({result['dataset']!r}, split={split!r}, num_samples={num_samples})"
+                response = self.lambda_instance.conv.semantic_check(result['message'], code)
+                pending = [scores for scores in result['fields'] if 'verdict' not in scores]
+                if response is None:
+                    verdicts = {scores['field']: (screening.ERROR, "Inspector API 呼叫失敗") for scores in pending}
+                else:
+                    verdicts = screening.parse_verdicts(response, [scores['field'] for scores in pending])
+                for scores in pending:
+                    scores['verdict'], scores['reason'] = verdicts[scores['field']]
+            screening.record_result(catalog, result)
+
+            dataset_rows = screening.report_rows(result)
+            for row in dataset_rows:
+                print(f"  {row.get('field') or '-'}: {row['verdict']} {row.get('reason') or ''}"[:200])
+            rows.extend(dataset_rows)
+            screening.write_report(rows, report_path)
+
+        print(f"\n✅ 批次初篩完成：{screening.format_report(rows)}")
+        print(f"📄 報表: {report_path}")
+        return rows
+
     def show_dataframe(self):
         """顯示當前資料框"""
         try:
@@ -163,6 +209,13 @@ class LAMBDACLI:
 
 
 def main():
+    # 子指令：合併輸出目錄，不需要初始化 LAMBDA
+    if len(sys.argv) > 1 and sys.argv[1] == 'compact':
+        from hf_pipeline.compaction import main as compact_main
+
+        compact_main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(
         description='LAMBDA CLI - Command Line Interface',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -172,6 +225,9 @@ def main():
   python lambda_cli.py "分析這個數據集"         # 單次查詢
   python lambda_cli.py -f data.csv           # 上傳檔案後進入互動模式
   python lambda_cli.py -f data.csv "顯示前5行"  # 上傳檔案並執行查詢
+  python lambda_cli.py -b datasets.txt --report output/screening.parquet  # 批次初篩資料集清單
+  python lambda_cli.py -b datasets.txt --refresh  # 忽略 catalog 中已有的判斷結果重新初篩
+  python lambda_cli.py compact --dedup --encoding archive  # 合併 ./output 的匯出結果（compact -h 查看選項）
         """
     )
     
@@ -189,12 +245,51 @@ def main():
         action='store_true',
         help='強制進入互動模式'
     )
+    parser.add_argument(
+        '-b', '--batch',
+        help='資料集清單檔案（每行一個 HF 資料集 id，可寫成 id@revision），批次初篩後輸出報表'
+    )
+    parser.add_argument(
+        '--report',
+        default='output/screening_report.csv',
+        help='批次初篩報表路徑，副檔名為 .parquet 時寫成 parquet，否則為 CSV'
+    )
+    parser.add_argument(
+        '--split',
+        default='train',
+        help='批次初篩使用的 split（不存在時改用第一個可用的 split）'
+    )
+    parser.add_argument(
+        '--num-samples',
+        type=int,
+        default=100,
+        help='批次初篩每個資料集的樣本筆數'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='批次初篩同時處理的資料集數量'
+    )
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        help='批次初篩時忽略 catalog 中已有的判斷結果，全部重新判斷'
+    )
     
     args = parser.parse_args()
     
     # 初始化 CLI
     cli = LAMBDACLI()
     
+    # 批次初篩模式
+    if args.batch:
+        from hf_pipeline.screening import read_dataset_list
+
+        cli.batch_analyze(read_dataset_list(args.batch), args.report, split=args.split,
+                          num_samples=args.num_samples, max_workers=args.workers, refresh=args.refresh)
+        return
+
     # 如果有檔案，先上傳
     if args.file:
         cli.upload_file(args.file)
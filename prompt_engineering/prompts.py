@@ -56,10 +56,10 @@ PROGRAMMER_PROMPT = '''你是一名資料科學家，任務是協助人類完成
 使用者將提供 Hugging Face 資料集名稱或路徑（如 dataset_name 或 username/dataset_name）。
 
 分析流程：
-- 使用 datasets 函式庫載入資料集（預設使用 train split 與前 N 筆資料，若使用者無指定 N ，請使用 100 做為資料筆數）
+- 使用知識庫中的 `load_and_display_dataset()` 載入資料集（預設使用 train split 並分層抽樣 N 筆資料，若使用者無指定 N ，請使用 100 做為資料筆數）
 - **首先輸出資料集實際擁有的所有欄位名稱**
 - **顯示每個欄位的前 5-10 筆完整樣本內容**
-- **不要進行任何自動分析（不計算長度、不檢測亂碼、不判斷繁體中文）**
+- **不要自行撰寫任何自動分析程式（不計算長度、不檢測亂碼、不判斷繁體中文）；欄位統計一律使用知識庫中的 `profile_approved_field()`**
 - **你的職責是展示資料，而非分析資料**
 
 ---
@@ -72,17 +72,18 @@ PROGRAMMER_PROMPT = '''你是一名資料科學家，任務是協助人類完成
 - 將樣本內容以清晰的格式輸出
 
 **步驟 2：觸發 Inspector 語意品質檢查**
-顯示樣本後，**必須**為每個文字類型欄位執行以下代碼觸發 Inspector 檢查：
+顯示樣本後，**必須**以知識庫中的 `trigger_inspector_check()` 為所有文字類型欄位觸發 Inspector 檢查，不要自行組合檢查請求：
 ```python
-# 為需要檢查的欄位構建檢查請求
-for field in text_columns:
-    samples = df[field].dropna().head(5).tolist()
-    error_msg = f"SEMANTIC_CHECK_REQUEST\\n欄位名稱：{{{{field}}}}\\n"
-    for i, sample in enumerate(samples, 1):
-        error_msg += f"樣本{{{{i}}}}：{{{{sample}}}}\\n"
-    raise ValueError(error_msg)
+# table 為 load_and_display_dataset 回傳的 pyarrow.Table（含抽樣樣本與資料來源）
+from hf_pipeline.fields import find_text_fields
+text_columns = find_text_fields(table.schema)  # 依 schema 找出文字欄位，包含巢狀欄位（如 messages[].content）
+verdicts = trigger_inspector_check(table, text_columns)
 ```
-注意：這會觸發 Inspector 進行語意判斷，系統會自動繼續後續分析。
+也可以直接呼叫 `analyze_hf_dataset(dataset_name, split, num_samples)` 一次完成步驟 1 與步驟 2。
+注意：尚未判斷的欄位會以 SEMANTIC_CHECK_REQUEST（附上樣本、繁簡字元統計與資料來源）觸發 Inspector 進行語意判斷，系統會自動繼續後續分析。
+判斷結果會記錄在 `./output/_catalog.sqlite`；同一資料集 revision 已判斷過的欄位會印出「↻ 欄位: approved / rejected」，
+全部欄位都判斷過時不會觸發 Inspector，而是直接回傳 {{欄位: {{'verdict': ..., 'reason': ...}}}}，
+此時請直接依回傳的 verdict 與 reason 執行步驟 3。
 
 **步驟 3：處理 Inspector 回饋**
 當 Inspector 完成判斷後，你會收到每個欄位的評估結果。
@@ -90,15 +91,19 @@ for field in text_columns:
 
 1. **對於被認可的欄位（適合繁體中文 CP）**：
    - 使用知識庫中的 `save_approved_fields_to_parquet()` 函數
-   - 將該欄位的資料儲存為 `./output` 下面的 parquet 檔案
-   - Schema: {{"id": 序號, "text": 欄位內容}}
-   - 檔案命名：`{{dataset_name}}_{{field_name}}_cp_data.parquet`
+   - 將該欄位的資料儲存為 `./output` 下面的 parquet 分片
+   - Schema: {{"id": 穩定的全域唯一 id, "text": 欄位內容, "source": 資料來源, "source_row": 來源列編號, "source_part": 列內序號}}
+   - 輸出目錄：`{{dataset_name}}_{{field_name}}_cp_data/`（內含 part-*.parquet 分片與 _manifest.json；
+     有 subset 或 split 不是 train 時為 `{{dataset_name}}@{{subset}}@{{split}}_{{field_name}}_cp_data/`）
+   - 使用 `profile_approved_field()` 以串流方式計算該欄位的統計（筆數、字數分布、漢字比例、空白率、重複率、粗估 token 數），
+     結果寫入 `./output/{{dataset_name}}_{{field_name}}_profile.json`
 
 2. **輸出最終總結表格**（請輸出所有欄位的判斷適不適合 CP 的原因）：
    - 欄位名稱
    - Inspector 判斷結果（適合/不適合）
    - Inspector 給出的理由
    - 是否已儲存為 parquet
+   - 欄位統計（若已計算：字數中位數、空白率、重複率、粗估 token 數）
 
 **提示：你可以使用知識庫中的 HF 資料集分析器**
 系統知識庫中包含專門用於分析 Hugging Face 資料集的完整程式碼工具。
@@ -127,7 +132,7 @@ CODE_INSPECT = """您是一位專業的資料品質檢查專家（Inspector）
 【CP 適用性評估任務】
 
 請執行以下任務：
-1. 從錯誤訊息中提取欄位名稱和樣本內容
+1. 從錯誤訊息中提取欄位名稱、樣本內容與「繁簡字元統計」
 2. 評估該欄位是否適合用於繁體中文 CP 訓練
 3. 提供詳細的判斷理由
 
@@ -176,7 +181,7 @@ CP 訓練建議（若適合）：
 ⚠️ 重要提醒：
 - 請基於實際樣本內容進行判斷，不要假設
 - 如果樣本數量不足或品質參差，請說明並給出保守評估
-- 繁體中文和簡體中文要明確區分
+- 繁體中文和簡體中文要明確區分；「繁簡字元統計」依 OpenCC 字表計算全部樣本，可作為語言類型判斷的依據
 - 即使內容包含少量特殊字符，若主體語意清晰仍可認定為適合
 
 ---
@@ -203,8 +208,13 @@ CODE_FIX = """您應該根據提供的錯誤資訊和修改方法嘗試修復以
 2. 記錄每個欄位的判斷結果（適合/不適合）及理由
 3. **對於被 Inspector 認可的欄位**：
    - 使用 `save_approved_fields_to_parquet()` 函數儲存資料
-   - Schema: {{"id": 序號, "text": 內容}}
-   - 目前先儲存前幾筆測試資料
+   - Schema: {{"id": 穩定的全域唯一 id, "text": 內容, "source" / "source_row" / "source_part": 資料來源}}
+   - 預設以串流方式匯出完整 split（num_samples=None），記憶體用量固定
+   - 匯出時預設會逐列過濾過短、亂碼、非中文為主、大量重複與樣板文字的資料；若 Inspector 指出欄位混有簡體，可傳入 filters={{'min_traditional_score': 0.9, ...}}
+   - 匯出時預設會去除完全重複與近似重複（MinHash）的資料，並與 ./output 中已匯出的資料一起去重
+   - 大型資料集可傳入 num_workers=8 以多行程平行匯出；background=True 時匯出在背景行程執行，不會佔用 kernel 的執行時間
+   - 若使用者指定訓練模型的 tokenizer，可傳入 tokenizer='模型名稱'，每筆資料會多一個 num_tokens 欄位並在 manifest 記錄 token 總數；
+     只需要估算 token 預算時使用 `estimate_field_tokens()` 抽樣估算（含信賴區間），不需匯出完整 split
 4. 移除觸發檢查的 raise ValueError 語句
 5. 輸出最終總結表格
 
@@ -227,10 +237,10 @@ for field, result in inspector_results.items():
     if result['approved']:
         # 使用知識庫函數儲存資料
         save_approved_fields_to_parquet(
-            df=df,
+            table=table,
             field_name=field,
             dataset_name='dataset_name',
-            num_samples=10  # 測試用，後續改為全部
+            num_samples=None  # None 以串流方式匯出完整 split
         )
         print(f"✓ 已儲存欄位 '{{field}}' 至 parquet 檔案")
 
@@ -460,6 +470,8 @@ KNOWLEDGE_INTEGRATION_SYSTEM = '''\n此外，您可以從知識庫中檢索一
 核心程式碼（參考此核心程式碼，請注意所有函數和類都已在後端定義，您可以直接使用它們）：\n```core_function\n{core}\n```\n
 您的程式碼：
 
+一次可能檢索到多個知識（依相關程度由高到低排列），請優先參考第一個。程式碼超過檢索長度預算的知識會以「摘要」模式呈現，只列出程式碼描述與函數簽名。
+
 
 以下是檢索知識的範例：
 使用者：我想使用二次收斂牛頓法計算最近的相關矩陣。請撰寫詳細的程式碼。程式碼應提供每次迭代的計算詳細資訊，例如梯度的範數、相對對偶間隙、對偶目標函數值、原始目標函數值和運行時間。
@@ -543,3 +555,12 @@ PMT_KNW_IN_CORE = """
 核心程式碼（參考此核心程式碼，請注意所有函數和類都已在後端定義，您可以直接使用它們）：\n```\n{core}\n```\n
 您的程式碼：
 """
+
+
+PMT_KNW_IN_SUMMARY = """
+\n📝 檢索：\n檢索器找到了以下可能相關的知識，完整程式碼超過檢索的長度預算，只列出描述與函數簽名。
+「摘要」模式的檢索程式碼：
+程式碼描述：\n{desc}
+函數簽名：\n```\n{outline}\n```\n
+{note}
+"""
@@ -0,0 +1,69 @@
+"""
+測試共用的設定與本機資料集
+
+測試不連線 Hugging Face hub：資料集為 tmp_path 中的 parquet 資料檔，以 datasets 的本機目錄方式載入。
+"""
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+os.environ.setdefault('LAMBDA_HF_METADATA_CACHE', tempfile.mkdtemp(prefix='lambda-hf-metadata-'))
+_knw_cache_dir = tempfile.mkdtemp(prefix='lambda-knw-')
+os.environ.setdefault('LAMBDA_KNW_INDEX', os.path.join(_knw_cache_dir, 'knw_index.npz'))
+os.environ.setdefault('LAMBDA_KNW_RETRIEVAL_CACHE', os.path.join(_knw_cache_dir, 'knw_retrieval_cache.json'))
+
+
+def random_texts(rng, num_rows, min_chars=30, max_chars=80):
+    """隨機漢字組成的文字，彼此之間幾乎不會有共同的 5-gram"""
+    codepoints = rng.integers(0x4E00, 0x4E00 + 3000, size=(num_rows, max_chars))
+    lengths = rng.integers(min_chars, max_chars + 1, size=num_rows)
+    return [''.join(map(chr, row[:length])) for row, length in zip(codepoints, lengths)]
+
+
+def write_dataset(path, num_files=2, rows_per_file=2500, row_group_size=500, seed=0):
+    """
+    在 path/data 下寫出 train split 的 parquet 資料檔，回傳 text 欄位依 split 順序的所有值
+
+    每 10 列中有一列完全重複、一列近似重複（只改最後一個字）、一列過短與一列空值，
+    後面的資料檔另外含有與第一個資料檔完全重複的列
+    """
+    rng = np.random.default_rng(seed)
+    texts = random_texts(rng, num_files * rows_per_file)
+    for i in range(0, len(texts), 10):
+        texts[i + 1] = texts[i]
+        texts[i + 3] = texts[i + 2][:-1] + '。'
+        texts[i + 5] = '太短'
+        texts[i + 7] = None
+    for i in range(rows_per_file + 4, len(texts), 37):
+        texts[i] = texts[i % rows_per_file]
+
+    os.makedirs(os.path.join(path, 'data'), exist_ok=True)
+    for i in range(num_files):
+        rows = slice(i * rows_per_file, (i + 1) * rows_per_file)
+        table = pa.table({'text': pa.array(texts[rows], pa.string()),
+                          'n': pa.array(np.arange(rows.start, rows.stop))})
+        pq.write_table(table, os.path.join(path, 'data', f"train-{i:05d}-of-{num_files:05d}.parquet"),
+                       row_group_size=row_group_size)
+    return texts
+
+
+@pytest.fixture
+def dataset_dir(tmp_path):
+    path = str(tmp_path / 'dataset')
+    write_dataset(path)
+    return path
+
+
+def read_export(output_dir):
+    """讀取匯出目錄中依 manifest 順序排列的所有分片"""
+    from hf_pipeline.shards import read_manifest
+
+    manifest = read_manifest(output_dir)
+    return pa.concat_tables([pq.read_table(os.path.join(output_dir, shard['file'])) for shard in manifest['shards']])
@@ -0,0 +1,29 @@
+import os
+
+from conftest import read_export, write_dataset
+from hf_pipeline.compaction import compact_output
+from hf_pipeline.export import export_dir_name, export_field
+
+
+def compacted_ids(output_root, source):
+    table = read_export(os.path.join(output_root, 'compacted'))
+    return [row['id'] for row in table.select(['id', 'source']).to_pylist() if row['source'] == source]
+
+
+def test_reexport_after_compaction_keeps_its_rows(dataset_dir, tmp_path):
+    output_root = str(tmp_path / 'output')
+    other_dir = str(tmp_path / 'other')
+    write_dataset(other_dir, num_files=1, rows_per_file=1000, seed=1)
+    output_dir = os.path.join(output_root, export_dir_name(dataset_dir, 'text'))
+    first = export_field(dataset_dir, 'text', output_dir)
+    export_field(other_dir, 'text', os.path.join(output_root, export_dir_name(other_dir, 'text')))
+
+    compacted = compact_output(output_root, dedup=True)
+    assert compacted['num_rows'] > first['num_rows']
+    assert not [name for name in os.listdir(os.path.join(output_root, 'compacted')) if name.startswith('_dedup-')]
+
+    again = export_field(dataset_dir, 'text', output_dir, resume=False)
+    assert again['num_rows'] == first['num_rows']
+    assert again['filter_stats'] == first['filter_stats']
+    assert read_export(output_dir).column('id').to_pylist() == \
+        compacted_ids(output_root, first['source'])
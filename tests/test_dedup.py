@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pyarrow as pa
+
+from conftest import random_texts, read_export
+from hf_pipeline.dedup import DEFAULT_DEDUP, Deduplicator, KeyIndex
+from hf_pipeline.export import export_dir_name, export_field
+
+
+def _apply(texts, batch_sizes, **kwargs):
+    deduplicator = Deduplicator(dict(DEFAULT_DEDUP), kwargs.pop('index_root', '/nonexistent'), num_proc=1, **kwargs)
+    stats = {'input_rows': len(texts), 'dropped': {}}
+    kept = []
+    start = 0
+    for size in batch_sizes:
+        records = pa.table({'text': pa.array(texts[start:start + size], pa.string())})
+        kept += deduplicator.apply(records, stats).column('text').to_pylist()
+        start += size
+    deduplicator.close()
+    return kept, stats['dropped']
+
+
+def test_duplicate_stats_do_not_depend_on_batch_boundaries():
+    rng = np.random.default_rng(0)
+    a, b = random_texts(rng, 2, min_chars=60, max_chars=60)
+    near = a[:-1] + '。'
+    # near 是 a 的近似重複，最後一列與 near 完全相同
+    texts = [a, b, near, near]
+    results = [_apply(texts, sizes) for sizes in ([4], [1, 1, 1, 1], [3, 1], [2, 2])]
+    assert all(result == results[0] for result in results)
+    assert results[0] == ([a, b], {'exact_duplicate': 1, 'near_duplicate': 1})
+
+
+def test_export_dedup_does_not_depend_on_batch_size(dataset_dir, tmp_path):
+    exports = []
+    for batch_size in (97, 700, 10000):
+        output_dir = os.path.join(str(tmp_path / f"b{batch_size}"), export_dir_name(dataset_dir, 'text'))
+        manifest = export_field(dataset_dir, 'text', output_dir, batch_size=batch_size)
+        exports.append((manifest['filter_stats'], read_export(output_dir).column('id').to_pylist()))
+    assert all(result == exports[0] for result in exports)
+
+
+def test_key_index_spills_to_disk(tmp_path):
+    rng = np.random.default_rng(0)
+    keys = rng.integers(0, 2 ** 64, size=20000, dtype=np.uint64)
+    index = KeyIndex(str(tmp_path), memory_keys=500)
+    for chunk in np.array_split(keys[:10000], 40):
+        index.add(chunk)
+    assert os.listdir(tmp_path)
+    assert index.contains(keys[:10000]).all()
+    assert not index.contains(keys[10000:]).any()
+    assert len(index) == 10000
+    index.close()
+    assert not os.listdir(tmp_path)
+
+
+def test_dedup_with_a_disk_index_matches_the_memory_index(tmp_path):
+    rng = np.random.default_rng(1)
+    texts = random_texts(rng, 3000)
+    texts += [text[:-1] + '。' for text in texts[::7]] + texts[::5]
+    order = rng.permutation(len(texts))
+    texts = [texts[i] for i in order]
+    in_memory = _apply(texts, [500] * 8, memory_keys=None)
+    on_disk = _apply(texts, [500] * 8, index_root=str(tmp_path), memory_keys=1000)
+    assert on_disk == in_memory
+    assert in_memory[1]['exact_duplicate'] and in_memory[1]['near_duplicate']
+
+
+def test_reexport_of_the_same_field_is_not_deduplicated_against_itself(dataset_dir, tmp_path):
+    root = str(tmp_path / 'output')
+    first = export_field(dataset_dir, 'text', os.path.join(root, export_dir_name(dataset_dir, 'text')))
+    joined_dir = os.path.join(root, export_dir_name(dataset_dir, 'text', 'join'))
+    joined = export_field(dataset_dir, 'text', joined_dir, flatten_mode='join')
+    assert joined['num_rows'] == first['num_rows']
+    assert joined['filter_stats']['dropped'] == first['filter_stats']['dropped']
@@ -0,0 +1,21 @@
+import hf_pipeline.metadata as metadata
+from hf_pipeline.encoding import benchmark_field, main
+
+
+def test_benchmark_cli_supports_template_mode(dataset_dir, capsys):
+    main([dataset_dir, '*', '--flatten-mode', 'template', '--template', '{n}：{text}', '--num-samples', '200',
+          '--profiles', 'fast', 'zstd', '--repeat', '1'])
+    lines = capsys.readouterr().out.strip().splitlines()
+    assert [line.split()[0] for line in lines[-2:]] == ['fast', 'zstd']
+
+
+def test_benchmark_uses_cached_metadata(dataset_dir, monkeypatch):
+    first = benchmark_field(dataset_dir, 'text', num_samples=200, profiles=['fast'], repeat=1)
+
+    def no_hub(*args, **kwargs):
+        raise AssertionError("metadata should come from the cache")
+
+    monkeypatch.setattr(metadata, 'get_split_rows', no_hub)
+    second = benchmark_field(dataset_dir, 'text', num_samples=200, profiles=['fast'], repeat=1)
+    assert second[0]['num_rows'] == first[0]['num_rows'] > 0
+    assert second[0]['num_bytes'] == first[0]['num_bytes']
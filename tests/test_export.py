@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from conftest import read_export
+from hf_pipeline.export import export_dir_name, export_field
+
+
+def test_export_dir_name_includes_subset_and_split():
+    assert export_dir_name('user/ds', 'text') == 'user_ds_text_cp_data'
+    assert export_dir_name('user/ds', 'text', config_name='zh') == 'user_ds@zh_text_cp_data'
+    assert export_dir_name('user/ds', 'text', split='validation') == 'user_ds@validation_text_cp_data'
+    assert export_dir_name('user/ds', 'messages[].content', 'join', 'zh', 'test') == \
+        'user_ds@zh@test_messages.content_join_cp_data'
+
+
+def test_export_refuses_directory_of_another_source(dataset_dir, tmp_path):
+    output_dir = str(tmp_path / 'output' / export_dir_name(dataset_dir, 'text'))
+    manifest = export_field(dataset_dir, 'text', output_dir, max_rows=300, dedup=False)
+    with pytest.raises(ValueError, match='another source'):
+        export_field(dataset_dir, 'text', output_dir, split='validation', dedup=False)
+    # 原本的匯出不會被刪除
+    assert read_export(output_dir).num_rows == manifest['num_rows'] == 300
+    assert all(os.path.exists(os.path.join(output_dir, shard['file'])) for shard in manifest['shards'])
+
+
+def _export(dataset_dir, output_root, **kwargs):
+    output_dir = os.path.join(output_root, export_dir_name(dataset_dir, 'text'))
+    return output_dir, export_field(dataset_dir, 'text', output_dir, batch_size=700, max_rows_per_shard=450,
+                                    **kwargs)
+
+
+def test_resumed_export_matches_uninterrupted_export(dataset_dir, tmp_path, monkeypatch, capsys):
+    reference_dir, reference = _export(dataset_dir, str(tmp_path / 'reference'))
+
+    import hf_pipeline.export as export
+
+    to_cp_table = export.to_cp_table
+    calls = []
+
+    def interrupted(records, source):
+        calls.append(records.num_rows)
+        if len(calls) == 5:
+            raise KeyboardInterrupt
+        return to_cp_table(records, source)
+
+    monkeypatch.setattr(export, 'to_cp_table', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        _export(dataset_dir, str(tmp_path / 'resumed'))
+    monkeypatch.setattr(export, 'to_cp_table', to_cp_table)
+    capsys.readouterr()
+    output_dir, manifest = _export(dataset_dir, str(tmp_path / 'resumed'))
+    assert '繼續匯出' in capsys.readouterr().out
+
+    assert read_export(output_dir).equals(read_export(reference_dir))
+    assert manifest['filter_stats'] == reference['filter_stats']
+    assert manifest['filter_stats']['dropped']['exact_duplicate'] > 0
+    assert manifest['filter_stats']['dropped']['near_duplicate'] > 0
+    assert [shard['sha256'] for shard in manifest['shards']] == [shard['sha256'] for shard in reference['shards']]
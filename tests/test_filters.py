@@ -0,0 +1,13 @@
+import pyarrow as pa
+
+from hf_pipeline.filters import FilterPipeline
+
+
+def test_garbled_filter_counts_the_mojibake_sequence_not_the_character():
+    pipeline = FilterPipeline({'max_garbled_ratio': 0.05})
+    records = pa.table({'text': ['锟铻是古代名劍，出自列子湯問篇的記載',
+                                 '锟斤拷锟斤拷這是一段被錯誤解碼的文字內容',
+                                 '這段文字有一個替換字元�，其餘都正常，總共超過二十個字']})
+    kept = pipeline.apply(records)
+    assert kept.column('text').to_pylist() == [records.column('text')[0].as_py(), records.column('text')[2].as_py()]
+    assert pipeline.stats['dropped'] == {'max_garbled_ratio': 1}
@@ -0,0 +1,20 @@
+import pyarrow as pa
+import pytest
+
+from hf_pipeline.flatten import flatten_field
+
+
+def _messages():
+    return pa.table({'messages': [[{'role': 'user', 'content': '你好'}, {'role': 'assistant', 'content': '嗨'}]]})
+
+
+def test_template_mode_renders_named_fields():
+    text, rows = flatten_field(_messages(), 'messages[]', 'template', separator='\n', template='{role}：{content}')
+    assert text.to_pylist() == ['user：你好\nassistant：嗨']
+    assert rows.to_pylist() == [0]
+
+
+@pytest.mark.parametrize('template', ['{role:>10}：{content}', '{role!r}：{content}', '{}：{content}', '{0}'])
+def test_template_mode_rejects_unsupported_fields(template):
+    with pytest.raises(ValueError, match='Template field'):
+        flatten_field(_messages(), 'messages[]', 'template', template=template)
@@ -0,0 +1,146 @@
+import numpy as np
+
+import knw_in
+from knowledge_integration.knw import knw
+
+
+class Alpha(knw):
+    def __init__(self):
+        super().__init__()
+        self.name = 'alpha'
+        self.description = 'Compute the alpha statistic of a table.'
+
+
+class Beta(knw):
+    def __init__(self):
+        super().__init__()
+        self.name = 'beta'
+        self.description = 'Fit a beta distribution to a column.'
+
+
+class CountingEncoder:
+    def __init__(self):
+        self.texts = []
+
+    def __call__(self, texts):
+        self.texts.extend(texts)
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+
+class Snippet(knw):
+    def __init__(self, name, code_lines):
+        super().__init__()
+        self.name = name
+        self.description = f'{name} helpers.'
+        self.core_function = 'code'
+        self.code_lines = code_lines
+
+    def code(self):
+        return ''.join(f"def {self.name}_{i}(x):\n    return x + {i}\n" for i in range(self.code_lines))
+
+
+class FixedScores(knw_in.RetrievalBackend):
+    name = 'fixed'
+
+    def __init__(self, scores, threshold=0.5):
+        super().__init__(threshold)
+        self.scores = scores
+
+    def score(self, instruction, knowledge):
+        return list(knowledge), np.array([self.scores[item.name] for item in knowledge.values()])
+
+
+def _knowledge(*items):
+    return {item.get_retrieval_key(): item for item in items}
+
+
+def test_index_reencodes_knowledge_edited_in_place(tmp_path):
+    alpha, beta = Alpha(), Beta()
+    knowledge = _knowledge(alpha, beta)
+    encode = CountingEncoder()
+    index = knw_in.KnowledgeIndex(encode, path=str(tmp_path / 'index.npz'))
+    keys, matrix = index.update(knowledge)
+    assert keys == list(knowledge) and matrix.shape == (2, 4)
+    assert len(encode.texts) == 2
+
+    index.update(knowledge)
+    assert len(encode.texts) == 2
+    version = knw_in.knowledge_version(knowledge)
+
+    # the registered key stays the same, the fingerprint does not
+    beta.description = 'Fit a beta distribution to a numeric column.'
+    index.update(knowledge)
+    assert len(encode.texts) == 3
+    assert knw_in.knowledge_version(knowledge) != version
+
+    reloaded = knw_in.KnowledgeIndex(encode, path=str(tmp_path / 'index.npz'))
+    reloaded.update(knowledge)
+    assert len(encode.texts) == 3
+
+
+def test_bm25_routes_the_labelled_examples():
+    knw_in.knowledge_register()
+    result, = knw_in.benchmark_backends(['bm25'], repeat=1)
+    assert result['top1_accuracy'] == 1.0
+    assert result['routing_accuracy'] >= 0.9
+
+
+def test_search_drops_hits_far_below_the_best():
+    knowledge = _knowledge(Snippet('a', 1), Snippet('b', 1), Snippet('c', 1), Snippet('d', 1))
+    backend = FixedScores({'a': 0.9, 'b': 0.75, 'c': 0.65, 'd': 0.4})
+    assert [key for key, _ in backend.search('x', knowledge, top_k=4)] == list(knowledge)[:2]
+    assert backend.search('x', knowledge, top_k=4, margin=0) == backend.search('x', knowledge, top_k=3, margin=0)
+    assert len(backend.search('x', knowledge, top_k=4, margin=0)) == 3
+
+
+def test_snippets_keep_the_best_hit_in_full():
+    big, small, other = Snippet('big', 400), Snippet('small', 10), Snippet('other', 400)
+    results = [(item.get_retrieval_key(), item, 0.9) for item in (big, small, other)]
+    text = knw_in.format_retrieved_snippets(results, kernel=None, token_budget=1000)
+    # the best hit alone is over the budget, the further hits are budgeted without it
+    assert 'big_399' in text
+    assert 'small_0' in text and 'small_9' in text
+    assert 'other_0' not in text
+
+    medium = Snippet('medium', 200)
+    results = [(item.get_retrieval_key(), item, 0.9) for item in (small, medium)]
+    text = knw_in.format_retrieved_snippets(results, kernel=None, token_budget=1000)
+    assert 'small_9' in text
+    assert 'medium_199' in text and 'return x + 199' not in text
+
+
+def test_normalize_instruction_masks_only_hub_ids():
+    normalize = knw_in.normalize_instruction
+    assert normalize('請分析 Hugging Face 資料集：A/B') == normalize('請分析 Hugging Face 資料集: c/d')
+    assert normalize('analyze user/ds@v1.0 and save parquet') == 'analyze <dataset> and save parquet'
+    assert normalize('Load bigscience/xP3.') == 'load <dataset>.'
+    for text in ['explain TCP/IP', 'use and/or here', 'read ./data/a.csv', 'read data/a.csv',
+                 'open https://huggingface.co/datasets/foo/bar now', '/abs/path/x', 'foo/bar/baz']:
+        assert '<dataset>' not in normalize(text), text
+
+
+def test_retrieval_cache_keys_and_persistence(tmp_path):
+    knowledge = _knowledge(Snippet('a', 1), Snippet('b', 1))
+    backend = FixedScores({'a': 0.9, 'b': 0.6})
+    make_key = knw_in.RetrievalCache.make_key
+    key = make_key(backend, knowledge, '請分析 Hugging Face 資料集：foo/bar', 3)
+    assert key == make_key(backend, knowledge, '請分析 hugging face 資料集:  baz/qux@main', 3)
+    assert key != make_key(backend, knowledge, '請分析 Hugging Face 資料集：foo/bar', 1)
+    assert key != make_key(FixedScores({'a': 0.9, 'b': 0.6}, threshold=0.4), knowledge,
+                           '請分析 Hugging Face 資料集：foo/bar', 3)
+    edited = Snippet('a', 1)
+    edited.keywords = 'alpha'
+    assert key != make_key(backend, {**knowledge, edited.get_retrieval_key(): edited},
+                           '請分析 Hugging Face 資料集：foo/bar', 3)
+
+    path = str(tmp_path / 'cache.json')
+    cache = knw_in.RetrievalCache(path, flush_seconds=60)
+    results = knw_in.search_knowledge('請分析 Hugging Face 資料集：foo/bar', knowledge, backend, top_k=3, cache=cache)
+    assert [item.name for _, item, _ in results] == ['a']
+    assert cache.misses == 1 and not (tmp_path / 'cache.json').exists()
+    knw_in.search_knowledge('請分析 Hugging Face 資料集：baz/qux', knowledge, backend, top_k=3, cache=cache)
+    assert cache.hits == 1
+    cache.flush()
+
+    reloaded = knw_in.RetrievalCache(path)
+    assert reloaded.get(key) == [(results[0][0], 0.9)]
@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pyarrow.parquet as pq
+
+from conftest import read_export, write_dataset
+from hf_pipeline.catalog import Catalog, catalog_key
+from hf_pipeline.export import export_dir_name, export_field
+from hf_pipeline.parallel import export_job_status, parallel_export_field, plan_partitions, start_export_job
+from hf_pipeline.shards import read_manifest
+
+
+def test_parallel_export_matches_sequential_export(dataset_dir, tmp_path):
+    name = export_dir_name(dataset_dir, 'text')
+    sequential_dir = os.path.join(str(tmp_path / 'sequential'), name)
+    parallel_dir = os.path.join(str(tmp_path / 'parallel'), name)
+    sequential = export_field(dataset_dir, 'text', sequential_dir, batch_size=700, max_rows_per_shard=1000)
+    parallel = parallel_export_field(dataset_dir, 'text', parallel_dir, batch_size=700, max_rows_per_shard=1000,
+                                     num_workers=2)
+
+    assert parallel['num_partitions'] == 2
+    assert read_export(parallel_dir).equals(read_export(sequential_dir))
+    assert parallel['filter_stats'] == sequential['filter_stats']
+    assert all(shard['num_rows'] <= 1000 for shard in parallel['shards'])
+    assert sorted(name for name in os.listdir(parallel_dir) if name.startswith('part-')) == \
+        [shard['file'] for shard in parallel['shards']]
+
+
+def test_single_parquet_file_is_split_by_row_group(tmp_path):
+    path = str(tmp_path / 'dataset')
+    write_dataset(path, num_files=1, rows_per_file=5000)
+    params = {'dataset_name': path, 'config_name': None, 'split': 'train', 'revision': None}
+    partitions = plan_partitions(params, num_workers=4)
+    assert [partition['row_groups'] for partition in partitions] == [[0, 3], [3, 6], [6, 9], [9, 10]]
+    assert [partition['start'] for partition in partitions] == [0, 1500, 3000, 4500]
+
+    sequential_dir = str(tmp_path / 'sequential' / 'export')
+    parallel_dir = str(tmp_path / 'parallel' / 'export')
+    export_field(path, 'text', sequential_dir, batch_size=700)
+    parallel_export_field(path, 'text', parallel_dir, batch_size=700, num_workers=4)
+    assert read_export(parallel_dir).equals(read_export(sequential_dir))
+
+
+def test_non_parquet_files_are_read_one_stream_per_file(tmp_path):
+    path = str(tmp_path / 'dataset')
+    texts = write_dataset(path, num_files=3, rows_per_file=1000)
+    for filename in os.listdir(os.path.join(path, 'data')):
+        parquet_path = os.path.join(path, 'data', filename)
+        pq.read_table(parquet_path).to_pandas().to_json(parquet_path.replace('.parquet', '.jsonl'),
+                                                        orient='records', lines=True, force_ascii=False)
+        os.remove(parquet_path)
+    params = {'dataset_name': path, 'config_name': None, 'split': 'train', 'revision': None}
+    assert plan_partitions(params, num_workers=2) == [{'shard': i, 'num_shards': 3} for i in range(3)]
+
+    sequential_dir = str(tmp_path / 'sequential' / 'export')
+    parallel_dir = str(tmp_path / 'parallel' / 'export')
+    sequential = export_field(path, 'text', sequential_dir, batch_size=700)
+    parallel = parallel_export_field(path, 'text', parallel_dir, batch_size=700, num_workers=2)
+    exported = read_export(parallel_dir)
+    assert exported.equals(read_export(sequential_dir))
+    assert parallel['filter_stats'] == sequential['filter_stats']
+    rows = exported.column('source_row').to_numpy()
+    assert exported.column('text').to_pylist() == [texts[row] for row in rows]
+    assert np.all(np.diff(rows) > 0)
+
+
+def test_background_job_records_the_catalog_when_it_completes(dataset_dir, tmp_path):
+    output_root = str(tmp_path / 'output')
+    export_dir = os.path.join(output_root, 'export')
+    key = catalog_key(dataset_dir)
+    pid = start_export_job(export_dir, catalog={'output_root': output_root, 'key': key, 'field_name': 'text'},
+                           dataset_name=dataset_dir, field_name='text', num_workers=2)
+    assert Catalog(output_root).fields(key).get('text', {}).get('output_path') is None
+    os.waitpid(pid, 0)
+
+    assert export_job_status(export_dir)['status'] == 'completed'
+    entry = Catalog(output_root).fields(key)['text']
+    assert entry['output_path'] == 'export'
+    assert entry['stats']['num_rows'] == read_manifest(export_dir)['num_rows']
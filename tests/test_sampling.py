@@ -0,0 +1,118 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from conftest import write_dataset
+from hf_pipeline.hub_cache import MetadataCache
+from hf_pipeline.metadata import get_split_rows, probe_dataset, sample_split
+from hf_pipeline.shards import write_json_atomic
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = str(tmp_path / 'dataset')
+    # 4 個資料檔、每個 10 個 row group，只讀前段的抽樣不會超過第一個資料檔
+    return path, write_dataset(path, num_files=4, rows_per_file=2000, row_group_size=200)
+
+
+@pytest.mark.parametrize('sampling', ['stratified', 'reservoir'])
+def test_samples_cover_the_whole_split(dataset, sampling):
+    path, texts = dataset
+    splits, _, data_files = get_split_rows(path)
+    assert list(splits) == ['train']
+    assert len(data_files['train']) == 4
+
+    table, rows = sample_split(path, num_samples=100, sampling=sampling, data_files=data_files['train'], seed=1)
+    assert table.num_rows == len(rows) == 100
+    assert np.all(np.diff(rows) > 0)
+    # 列編號對應到 split 中的原始資料
+    assert table.column('n').to_pylist() == rows.tolist()
+    assert table.column('text').to_pylist() == [texts[row] for row in rows]
+    # 樣本分布在整個 split，而不是集中在前段
+    assert len(np.unique(rows // 2000)) >= 3
+    assert rows.max() > 6000
+
+    again, again_rows = sample_split(path, num_samples=100, sampling=sampling, data_files=data_files['train'], seed=1)
+    assert again.equals(table) and np.array_equal(again_rows, rows)
+
+
+def test_reservoir_reads_enough_row_groups_for_the_sample(dataset):
+    path, _ = dataset
+    _, _, data_files = get_split_rows(path)
+    table, rows = sample_split(path, num_samples=7000, sampling='reservoir', data_files=data_files['train'])
+    assert table.num_rows == len(np.unique(rows)) == 7000
+
+
+def test_reservoir_reads_only_the_needed_columns_and_row_groups(dataset, tmp_path, monkeypatch):
+    path, texts = dataset
+    _, _, data_files = get_split_rows(path)
+    cache = MetadataCache(str(tmp_path / 'cache'))
+    import hf_pipeline.sampling as sampling
+
+    reads = []
+    read_row_group = sampling.pq.ParquetFile.read_row_group
+
+    def counting_read(self, i, **kwargs):
+        reads.append(kwargs.get('columns'))
+        return read_row_group(self, i, **kwargs)
+
+    monkeypatch.setattr(sampling.pq.ParquetFile, 'read_row_group', counting_read)
+    table, rows = sample_split(path, num_samples=100, sampling='reservoir', data_files=data_files['train'],
+                               columns=['text'], cache=cache)
+    assert table.column_names == ['text'] and table.num_rows == 100
+    assert table.column('text').to_pylist() == [texts[row] for row in rows]
+    # 每個 row group 取 4 筆，約 25 個 row group 即足夠（另有最多 max_workers 個已送出的讀取），不會讀完全部 40 個
+    assert len(reads) < 40 and all(columns == ['text'] for columns in reads)
+
+    def no_footer(*args, **kwargs):
+        raise AssertionError("row group sizes should come from the cache")
+
+    monkeypatch.setattr(sampling, '_row_group_rows', no_footer)
+    again, _ = sample_split(path, num_samples=100, sampling='stratified', data_files=data_files['train'],
+                            columns=['text'], cache=cache)
+    assert again.num_rows == 100
+
+
+def test_probe_uses_cached_metadata(dataset, tmp_path, monkeypatch):
+    path, _ = dataset
+    cache = MetadataCache(str(tmp_path / 'cache'))
+    first = probe_dataset(path, num_samples=50, cache=cache)
+    assert cache.get(path, None, 'config:default')['data_files']['train']
+
+    import hf_pipeline.metadata as metadata
+
+    def no_hub(*args, **kwargs):
+        raise AssertionError("metadata should come from the cache")
+
+    monkeypatch.setattr(metadata, 'get_split_rows', no_hub)
+    second = probe_dataset(path, num_samples=50, cache=cache)
+    assert second['subsets']['default']['splits'] == first['subsets']['default']['splits']
+    assert second['subsets']['default']['sample'].equals(first['subsets']['default']['sample'])
+
+
+def test_metadata_cache_ignores_entries_of_other_versions(tmp_path):
+    cache = MetadataCache(str(tmp_path / 'cache'))
+    cache.set('user/ds', None, 'config_names', ['a'])
+    assert cache.get('user/ds', None, 'config_names') == ['a']
+
+    path = cache._path('user/ds', None)
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    entries['config_names'].pop('version')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f)
+    assert cache.get('user/ds', None, 'config_names') is None
+
+
+def test_concurrent_json_writes_do_not_share_a_temp_file(tmp_path):
+    path = str(tmp_path / 'entries.json')
+    payloads = [{'writer': i, 'values': list(range(20000))} for i in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for _ in range(5):
+            list(pool.map(lambda data: write_json_atomic(path, data), payloads))
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f) in payloads
+    assert os.listdir(tmp_path) == ['entries.json']
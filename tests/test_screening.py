@@ -0,0 +1,38 @@
+from hf_pipeline import screening
+from hf_pipeline.catalog import Catalog, catalog_key
+
+
+def test_cached_result_uses_the_subset_the_probe_selected(dataset_dir, tmp_path):
+    catalog = Catalog(str(tmp_path / 'output'))
+    result = screening.prescore_dataset(dataset_dir, num_samples=50, catalog=catalog)
+    assert result['error'] is None and not result['cached']
+    for scores in result['fields']:
+        scores.setdefault('verdict', screening.APPROVED)
+        scores.setdefault('reason', 'ok')
+    screening.record_result(catalog, result)
+    # 同一 revision、split 下另一個已判斷完的 subset，名稱排在前面
+    other = catalog_key(dataset_dir, result['revision'], 'aaa', result['split'])
+    catalog.record_field(other, 'text', screening.REJECTED, 'other subset')
+
+    cached = screening.prescore_dataset(dataset_dir, num_samples=50, catalog=catalog)
+    assert cached['cached']
+    assert (cached['config'], cached['split']) == (result['config'], result['split'])
+    assert [(scores['field'], scores['verdict']) for scores in cached['fields']] == \
+        [(scores['field'], scores['verdict']) for scores in sorted(result['fields'], key=lambda s: s['field'])]
+
+
+def test_semantic_check_verdicts_land_in_the_catalog_that_was_queried(dataset_dir, tmp_path, monkeypatch):
+    import pyarrow.parquet as pq
+
+    monkeypatch.chdir(tmp_path)
+    table = pq.read_table(f"{dataset_dir}/data/train-00000-of-00002.parquet").slice(0, 20)
+    key = catalog_key(dataset_dir)
+    output_root = str(tmp_path / 'custom-output')
+    message = screening.semantic_check_message(table, ['text'], key, output_root)
+    response = "欄位名稱：text\n最終判斷：【適合】\n判斷理由：繁體中文。"
+
+    # 訊息可能包在 kernel 的 traceback 中
+    verdicts = screening.record_semantic_check(f"ValueError: {message}", response)
+    assert verdicts == {'text': (screening.APPROVED, '繁體中文。')}
+    assert Catalog(output_root).fields(key)['text']['verdict'] == screening.APPROVED
+    assert not (tmp_path / 'output').exists()
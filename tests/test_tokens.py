@@ -0,0 +1,25 @@
+import numpy as np
+
+import hf_pipeline.metadata as metadata
+import hf_pipeline.tokens as tokens
+from hf_pipeline.hub_cache import MetadataCache
+
+
+def _count_chars(text, tokenizer_name):
+    return np.array([len(value) for value in text.to_pylist()], dtype=np.int32)
+
+
+def test_estimate_tokens_uses_cached_metadata(dataset_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(tokens, 'count_tokens', _count_chars)
+    cache = MetadataCache(str(tmp_path / 'cache'))
+    first = tokens.estimate_tokens(dataset_dir, 'text', 'chars', num_samples=500, cache=cache)
+    assert first['num_rows'] == 5000
+    assert first['sample_rows'] == 500
+    assert first['lower'] <= first['estimated_tokens'] <= first['upper']
+
+    def no_hub(*args, **kwargs):
+        raise AssertionError("metadata should come from the cache")
+
+    monkeypatch.setattr(metadata, 'get_split_rows', no_hub)
+    second = tokens.estimate_tokens(dataset_dir, 'text', 'chars', num_samples=500, cache=cache)
+    assert second['estimated_tokens'] == first['estimated_tokens']